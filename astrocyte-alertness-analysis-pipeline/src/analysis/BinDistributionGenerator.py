@@ -1,7 +1,7 @@
 # BinDistributionGenerator.py
 # -------------------------------------------------------------------------
 # Origin: "Bindist 0-100 generation.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Generates a 0–100 bin distribution (bindist_2000) representing calcium and pupil activity frequencies across normalized intensity ranges.
@@ -14,6 +14,7 @@
 #
 # File Relationships:
 #   - Supports event analysis modules like DilationEventDetection.
+#   - process_partition/process_day are run cohort-wide by utils/CohortRunner.
 #
 # Dependencies:
 #   - pandas, os
@@ -58,17 +59,28 @@ def average_calcium(csv_files, output_path):
 
 
 # Base paths and file names
-base_path = r"C:\Users\ASH213\Documents\Correlated\890\d084"
 trials = [f"trial_{i}" for i in range(1, 4)]
 stimconditions = [f"stimcondition_{i}" for i in range(1, 6)]
 bin_distances = [0, 20, 40, 60, 80, 100]
 
-# Iterate through trials and stimconditions
-for trial in trials:
-    for stimcondition in stimconditions:
-        # Generate the list of CSV file paths
-        csv_files = [os.path.join(base_path, trial, stimcondition, f"bindist_{bd}.csv") for bd in bin_distances]
-        output_path = os.path.join(base_path, trial, stimcondition, 'bindist_2000.csv')
 
-        # Call the function to average calcium data
-        average_calcium(csv_files, output_path)
+def process_partition(base_path, trial, stimcondition):
+    # Generate the list of CSV file paths
+    csv_files = [os.path.join(base_path, trial, stimcondition, f"bindist_{bd}.csv") for bd in bin_distances]
+    output_path = os.path.join(base_path, trial, stimcondition, 'bindist_2000.csv')
+
+    # Call the function to average calcium data
+    average_calcium(csv_files, output_path)
+    return output_path
+
+
+def process_day(base_path):
+    # Iterate through trials and stimconditions
+    for trial in trials:
+        for stimcondition in stimconditions:
+            process_partition(base_path, trial, stimcondition)
+
+
+if __name__ == "__main__":
+    base_path = r"C:\Users\ASH213\Documents\Correlated\890\d084"
+    process_day(base_path)
@@ -1,7 +1,7 @@
 # CalciumPupilCouplingAnalysisNormalized.py
 # -------------------------------------------------------------------------
 # Origin: "Data correlation test.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Computes correlation between calcium and pupil diameter signals, normalizing pupil data to its maximum. Produces dynamically averaged time-aligned CSVs ensuring consistent data point counts (n=1198).
@@ -11,21 +11,28 @@
 #
 # Outputs:
 #   - Correlation CSVs per trial/stimulation condition
+#   - 'pupil_diameter_averaging.log' with one JSON diagnostics record per file (see utils/PipelineDiagnostics)
 #
 # File Relationships:
 #   - Core analysis step before event detection and bin distribution.
 #
 # Dependencies:
-#   - pandas, re, os, logging
+#   - pandas, numpy, re, os, sys, logging
 # -------------------------------------------------------------------------
 
 import pandas as pd
+import numpy as np
 import os
 import re
+import sys
 import logging
 
-# Set up logging configuration
-logging.basicConfig(filename='pupil_diameter_averaging.log', level=logging.INFO, format='%(message)s')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from PipelineDiagnostics import DIAGNOSTICS_LOGGER, DiagnosticsRecorder, configure_diagnostics_logging
+
+# Cohort-wide diagnostics; per-file summaries are emitted as single JSON records
+logger = logging.getLogger(DIAGNOSTICS_LOGGER)
+diagnostics = DiagnosticsRecorder(logger)
 
 def extract_averaged_pupil_diameters(filtered_file):
     # Read the filtered CSV file
@@ -37,12 +44,13 @@ def extract_averaged_pupil_diameters(filtered_file):
         max_pupil_diameter = df_filtered['Pupil Diameter'].max()
         df_filtered['Pupil Diameter Ratio'] = df_filtered['Pupil Diameter'] / max_pupil_diameter
     else:
-        logging.error(f"Missing necessary 'Pupil Diameter' column in {filtered_file}")
+        logger.error(f"Missing necessary 'Pupil Diameter' column in {filtered_file}")
         return None, 0
 
     # Get the total number of pupil diameter data points
     total_pupil_points = len(df_filtered)
-    logging.info(f"Total pupil points in {os.path.basename(filtered_file)} (excluding first row): {total_pupil_points}")  # Log the info
+    diagnostics.count('pupil_files_read')
+    diagnostics.count('pupil_points', total_pupil_points)
 
     return df_filtered, total_pupil_points
 
@@ -66,47 +74,58 @@ def add_pupil_diameters_to_untouched(untouched_folder, df_filtered, total_pupil_
 
             # Skip files with no data points in the "calcium" column
             if "calcium" not in df.columns or df["calcium"].count() == 0:
-                logging.info(f"Skipping {file} because it has 0 calcium data points.")
+                diagnostics.count('skipped_no_calcium')
                 continue
 
-            # Calculate the ratio for this specific file
-            calcium_count = df["calcium"].count()
-            logging.info(f"File: {file} | Calcium data points: {calcium_count}")  # Log the info
-            if calcium_count == 0:
-                ratio = 1  # To avoid division by zero
-            else:
-                ratio = total_pupil_points / calcium_count
-            logging.info(f"File: {file} | Ratio: {ratio}")  # Log the info
-
-            # Initialize an empty list to store averaged pupil diameter ratio values for this file
-            averaged_pupil_diameter_ratios = []
-
-            # Initialize variables to manage the cumulative ratio
-            cumulative_ratio = 0
-            start_idx = 0
-
-            # Calculate the average of 'ratio' rows starting from the second row
-            for i in range(calcium_count):
-                cumulative_ratio += ratio
-                end_idx = round(cumulative_ratio)
-                subset = df_filtered['Pupil Diameter Ratio'].iloc[start_idx:end_idx]
-                num_points = end_idx - start_idx
-                logging.info(f"Averaging {num_points} points from index {start_idx} to {end_idx} for file {file}.")  # Log the info
-                if len(subset) > 0:  # Ensure subset is not empty
-                    averaged_pupil_diameter_ratios.append(subset.mean())
-                start_idx = end_idx
-
-            # Create an iterator for the pupil diameter ratios list
-            pupil_diameters_iter = iter(averaged_pupil_diameter_ratios)
-            # Add the pupil diameter ratio values to the DataFrame starting from the first row
-            pupil_diameters_to_add = [next(pupil_diameters_iter, '') for _ in range(1198)]
-            if len(pupil_diameters_to_add) < 1198:
-                logging.info(f"Warning: Not enough pupil diameters for file {file}")
-                pupil_diameters_to_add.extend([''] * (1198 - len(pupil_diameters_to_add)))
-            df['Pupil Diameter Ratio'] = pupil_diameters_to_add
-            # Save the modified DataFrame to the output folder
-            output_file_path = os.path.join(output_folder, file)
-            df.to_csv(output_file_path, index=False)
+            with diagnostics.file(os.path.join(output_folder, file)) as diag:
+                # Calculate the ratio for this specific file
+                calcium_count = df["calcium"].count()
+                if calcium_count == 0:
+                    ratio = 1  # To avoid division by zero
+                else:
+                    ratio = total_pupil_points / calcium_count
+                diag.set('calcium_points', int(calcium_count))
+                diag.set('pupil_points', int(total_pupil_points))
+                diag.set('ratio', float(ratio))
+                diag.observe('ratio', ratio, decimals=2)
+
+                # Initialize an empty list to store averaged pupil diameter ratio values for this file
+                averaged_pupil_diameter_ratios = []
+                points_per_bin = np.empty(calcium_count, dtype=int)
+
+                # Initialize variables to manage the cumulative ratio
+                cumulative_ratio = 0
+                start_idx = 0
+
+                # Calculate the average of 'ratio' rows starting from the second row
+                for i in range(calcium_count):
+                    cumulative_ratio += ratio
+                    end_idx = round(cumulative_ratio)
+                    subset = df_filtered['Pupil Diameter Ratio'].iloc[start_idx:end_idx]
+                    points_per_bin[i] = end_idx - start_idx
+                    if diag.should_trace(i):
+                        diag.trace("Averaging %d points from index %d to %d", end_idx - start_idx, start_idx, end_idx)
+                    if len(subset) > 0:  # Ensure subset is not empty
+                        averaged_pupil_diameter_ratios.append(subset.mean())
+                    else:
+                        diag.count('empty_bins')
+                    start_idx = end_idx
+
+                # Histogram of points per averaging bin, aggregated once per file
+                diag.observe_many('points_per_bin', points_per_bin)
+                diag.count('bins_averaged', len(averaged_pupil_diameter_ratios))
+
+                # Create an iterator for the pupil diameter ratios list
+                pupil_diameters_iter = iter(averaged_pupil_diameter_ratios)
+                # Add the pupil diameter ratio values to the DataFrame starting from the first row
+                pupil_diameters_to_add = [next(pupil_diameters_iter, '') for _ in range(1198)]
+                if len(averaged_pupil_diameter_ratios) < 1198:
+                    diag.count('rows_without_pupil', 1198 - len(averaged_pupil_diameter_ratios))
+                df['Pupil Diameter Ratio'] = pupil_diameters_to_add
+                # Save the modified DataFrame to the output folder
+                output_file_path = os.path.join(output_folder, file)
+                df.to_csv(output_file_path, index=False)
+                diag.count('files_written')
 
 def process_folders(filtered_folder, untouched_base_folder, output_base_folder):
     for filtered_file in os.listdir(filtered_folder):
@@ -114,7 +133,7 @@ def process_folders(filtered_folder, untouched_base_folder, output_base_folder):
             filtered_file_path = os.path.join(filtered_folder, filtered_file)
             stimulation = None
             if 'contra' in filtered_file:
-                logging.info(f"Skipping {filtered_file} due to unknown stimulation type.")
+                logger.info(f"Skipping {filtered_file} due to unknown stimulation type.")
                 continue
             elif 'burst' in filtered_file:
                 stimulation = "stimcondition_2"
@@ -127,7 +146,7 @@ def process_folders(filtered_folder, untouched_base_folder, output_base_folder):
             elif 'line' in filtered_file:
                 stimulation = 'stimcondition_5'
             if not stimulation:
-                logging.info(f"Skipping {filtered_file} due to unknown stimulation type.")
+                logger.info(f"Skipping {filtered_file} due to unknown stimulation type.")
                 continue
 
             if '890' in filtered_file:
@@ -135,21 +154,21 @@ def process_folders(filtered_folder, untouched_base_folder, output_base_folder):
             elif '889' in filtered_file:
                 animal = '889'
             else:
-                logging.info(f"Skipping {filtered_file} due to unknown animal ID.")
+                logger.info(f"Skipping {filtered_file} due to unknown animal ID.")
                 continue
 
             match = re.search(r"trial(\d)|t(\d)", filtered_file)
             if match:
                 trial = match.group(1) or match.group(2)
             else:
-                logging.info(f"Skipping {filtered_file} due to unknown trial number.")
+                logger.info(f"Skipping {filtered_file} due to unknown trial number.")
                 continue
 
             match = re.search(r"d\d{3}", filtered_file)
             if match:
                 day = match.group()
             else:
-                logging.info(f"Skipping {filtered_file} due to unknown day.")
+                logger.info(f"Skipping {filtered_file} due to unknown day.")
                 continue
 
             untouched_folder = os.path.join(untouched_base_folder, animal, day, "trial_" + trial, stimulation)
@@ -162,8 +181,16 @@ def process_folders(filtered_folder, untouched_base_folder, output_base_folder):
                 add_pupil_diameters_to_untouched(untouched_folder, df_filtered, total_pupil_points, output_folder)
 
 # Example usage
-filtered_folder = r"C:\Users\ASH213\Documents\Pupil activity\890"
-untouched_base_folder = r"C:\Users\ASH213\Documents\Calcium activity"
-output_base_folder = r"C:\Users\ASH213\Documents\Correlated"
+if __name__ == "__main__":
+    filtered_folder = r"C:\Users\ASH213\Documents\Pupil activity\890"
+    untouched_base_folder = r"C:\Users\ASH213\Documents\Calcium activity"
+    output_base_folder = r"C:\Users\ASH213\Documents\Correlated"
+
+    # Set verbose=True and trace_every=N to log every Nth averaging window for debugging
+    configure_diagnostics_logging('pupil_diameter_averaging.log', verbose=False)
+    diagnostics.trace_every = 0
+
+    process_folders(filtered_folder, untouched_base_folder, output_base_folder)
 
-process_folders(filtered_folder, untouched_base_folder, output_base_folder)
+    # One cohort-level summary record after all per-file records
+    diagnostics.close()
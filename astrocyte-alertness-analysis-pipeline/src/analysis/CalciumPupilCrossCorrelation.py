@@ -1,19 +1,22 @@
 # CalciumPupilCrossCorrelation.py
 # -------------------------------------------------------------------------
 # Origin: "Cross-correlation.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Computes cross-correlation between calcium and pupil signals for pre-, stim-, post-stim, and entire recording periods. Records max correlation and lag per section for all trials and stim conditions.
+#   - process_file and process_folder both normalize the correlations by default (normalize=False gives the raw np.correlate scale). A segment whose averaged curve is all NaN is reported with NaN max correlation and lag.
 #
 # Inputs:
 #   - Calcium and pupil CSVs segmented by time section
 #
 # Outputs:
-#   - Text file with max correlation and lag per section
+#   - Text file with max correlation and lag per section (plus p-value when surrogates are requested)
+#   - 'correlation_cube.csv' with the trial-averaged correlation per (stimcondition, segment, lag)
 #
 # File Relationships:
 #   - Works alongside SlidingWindowCorrelationDistribution.
+#   - Correlations are computed by CrossCorrelationEngine (batched real FFTs); significance by SurrogateNullEngine.
 #
 # Dependencies:
 #   - pandas, numpy, os, matplotlib
@@ -24,8 +27,12 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 
+from CrossCorrelationEngine import (SEGMENT_NAMES, SEGMENTS, batched_cross_correlation, cohort_cross_correlation,
+                                    discover_sessions, load_signal_matrix, peak_summary)
+from SurrogateNullEngine import run_null_tests
 
-def process_file(file_path):
+
+def process_file(file_path, normalize=True):
     # Load the data from the CSV file
     data = pd.read_csv(file_path)
 
@@ -43,68 +50,99 @@ def process_file(file_path):
             ca_segment = calcium_activity[start:end + 1]
 
             # Compute the cross-correlation for the segment
-            correlation = np.correlate(pd_segment - np.mean(pd_segment), ca_segment - np.mean(ca_segment), mode='full')
-            lags = np.arange(-len(pd_segment) + 1, len(pd_segment))
+            lags, correlation = batched_cross_correlation(pd_segment, ca_segment, normalize=normalize)
 
-            correlations.append((lags, correlation))
+            correlations.append((lags, correlation[0]))
 
     return correlations
 
 
-def process_folder(input_folder, output_folder):
+def process_folder(input_folder, output_folder, normalize=True, n_surrogates=0, surrogate_method='circular_shift',
+                   seed=0, n_workers=None):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
     stimconditions = ['stimcondition_1', 'stimcondition_2', 'stimcondition_3', 'stimcondition_4', 'stimcondition_5']
-    trial_folders = [f'trial_{i}' for i in range(1, 4)]
 
-    segment_names = ['pre', 'stim', 'post-stim', 'post', 'overall']  # Adjust segment names as needed
+    # Read every trial x stimcondition once and correlate all segments in batched FFTs
+    records = [record for record in discover_sessions(input_folder) if record['stimcondition'] in stimconditions]
+    if not records:
+        print(f"No bindist_2000.csv files found under {input_folder}")
+        return pd.DataFrame()
+    signals, lengths = load_signal_matrix(records)
+    cube, _ = cohort_cross_correlation(records, normalize=normalize, signals=signals, lengths=lengths)
+    if cube.empty:
+        print(f"No segment is covered by the files under {input_folder}")
+        return cube
+
+    peaks = peak_summary(cube).set_index(['stimcondition', 'segment'])
     results = []
 
+    # Optional surrogate nulls: one test per (stimcondition, segment), run across a process pool
+    null_results = {}
+    if n_surrogates > 0:
+        tasks = []
+        for stimcondition in stimconditions:
+            for (start, end), segment_name in zip(SEGMENTS, SEGMENT_NAMES):
+                rows = [i for i, record in enumerate(records)
+                        if record['stimcondition'] == stimcondition and lengths[i] > end]
+                if rows:
+                    tasks.append(((stimcondition, segment_name),
+                                  signals['Pupil Diameter Ratio'][rows, start:end + 1],
+                                  signals['calcium'][rows, start:end + 1]))
+        null_results = run_null_tests(tasks, seed=seed, n_workers=n_workers, n_surrogates=n_surrogates,
+                                      method=surrogate_method, normalize=normalize)
+        cube['p_value'] = np.nan
+        cube['null_lower'] = np.nan
+        cube['null_upper'] = np.nan
+        for (stimcondition, segment_name), null in null_results.items():
+            cube.loc[(stimcondition, segment_name), 'null_lower'] = null['null_lower']
+            cube.loc[(stimcondition, segment_name), 'null_upper'] = null['null_upper']
+            cube.loc[(stimcondition, segment_name), 'p_value'] = null['p_value']
+
     for stimcondition in stimconditions:
-        all_correlations = {i: [] for i in range(5)}  # Dictionary to hold correlations for each segment
-        for trial_folder in trial_folders:
-            trial_path = os.path.join(input_folder, trial_folder, stimcondition)
-            if os.path.exists(trial_path):
-                for filename in os.listdir(trial_path):
-                    if filename == 'bindist_2000.csv':
-                        file_path = os.path.join(trial_path, filename)
-                        segment_correlations = process_file(file_path)
-                        for i, (lags, correlation) in enumerate(segment_correlations):
-                            all_correlations[i].append(correlation)
-
-        for i, segment in all_correlations.items():
-            if segment:
-                # Average the correlations for this segment
-                avg_correlation = np.mean(segment, axis=0)
-
-                # Get the lags from the first segment's lags (assuming all have the same length)
-                lags = segment_correlations[i][0]
-
-                # Find the max correlation and corresponding lag
-                max_corr = np.max(avg_correlation)
-                max_lag = lags[np.argmax(avg_correlation)]
-
-                results.append(
-                    f"{stimcondition} Segment {segment_names[i]}: Max Correlation = {max_corr}, Lag = {max_lag} samples")
-
-                # Plot the average cross-correlation for this segment
-                plt.figure(figsize=(10, 5))
-                plt.plot(lags, avg_correlation)
-                plt.xlabel('Lag (samples)')
-                plt.ylabel('Cross-correlation')
-                plt.title(f'Average Cross-correlation for {stimcondition} - Segment {segment_names[i]}')
+        for segment_name in SEGMENT_NAMES:
+            if (stimcondition, segment_name) not in peaks.index:
+                continue
+
+            # Lags come from the result cube itself, not from whichever file was read last
+            curve = cube.loc[(stimcondition, segment_name)]
+            lags = curve.index.to_numpy()
+            avg_correlation = curve['correlation'].to_numpy()
+
+            # Find the max correlation and corresponding lag
+            max_corr = peaks.loc[(stimcondition, segment_name), 'max_correlation']
+            max_lag = peaks.loc[(stimcondition, segment_name), 'lag']
+
+            result = f"{stimcondition} Segment {segment_name}: Max Correlation = {max_corr}, Lag = {max_lag} samples"
+            null = null_results.get((stimcondition, segment_name))
+            if null is not None:
+                result += (f", p = {null['p_value']:.4g} ({n_surrogates} {surrogate_method} surrogates, "
+                           f"95% null peak = {null['null_peak_threshold']:.4g})")
+            results.append(result)
+
+            # Plot the average cross-correlation for this segment
+            plt.figure(figsize=(10, 5))
+            plt.plot(lags, avg_correlation)
+            if null is not None:
+                plt.fill_between(lags, null['null_lower'], null['null_upper'], color='gray', alpha=0.3,
+                                 label='95% surrogate band')
+            plt.xlabel('Lag (samples)')
+            plt.ylabel('Normalized cross-correlation' if normalize else 'Cross-correlation')
+            plt.title(f'Average Cross-correlation for {stimcondition} - Segment {segment_name}')
+            if not np.isnan(max_lag):
                 plt.axvline(max_lag, color='r', linestyle='--', label=f'Lag={max_lag:.1f} samples')
+            if plt.gca().get_legend_handles_labels()[0]:
                 plt.legend()
 
-                # Save the plot
-                plot_filename = os.path.join(output_folder,
-                                             f'{stimcondition}_{segment_names[i]}_average_cross_correlation.png')
-                plt.savefig(plot_filename)
-                plt.close()
+            # Save the plot
+            plot_filename = os.path.join(output_folder,
+                                         f'{stimcondition}_{segment_name}_average_cross_correlation.png')
+            plt.savefig(plot_filename)
+            plt.close()
 
-                print(
-                    f"Processed {stimcondition} Segment {segment_names[i]}. The average cross-correlation plot has been saved.")
+            print(
+                f"Processed {stimcondition} Segment {segment_name}. The average cross-correlation plot has been saved.")
 
     # Write the results to a text file
     results_filename = os.path.join(output_folder, 'correlation_results.txt')
@@ -112,9 +150,15 @@ def process_folder(input_folder, output_folder):
         for result in results:
             f.write(result + '\n')
 
+    # Keep the full (stimcondition, segment, lag) cube alongside the summary
+    cube.to_csv(os.path.join(output_folder, 'correlation_cube.csv'))
+    return cube
+
 
-input_folder = r'C:\Users\ASH213\Documents\Correlated\890\d084'
-output_folder = r'C:\Users\ASH213\Documents\Correlated\890\d084\average_cross_correlations'
+if __name__ == "__main__":
+    input_folder = r'C:\Users\ASH213\Documents\Correlated\890\d084'
+    output_folder = r'C:\Users\ASH213\Documents\Correlated\890\d084\average_cross_correlations'
 
-# Process all relevant files and create averaged cross-correlation graphs
-process_folder(input_folder, output_folder)
+    # Process all relevant files and create averaged cross-correlation graphs
+    # (set n_surrogates, e.g. 1000, to add p-values and surrogate confidence bands)
+    process_folder(input_folder, output_folder, n_surrogates=0)
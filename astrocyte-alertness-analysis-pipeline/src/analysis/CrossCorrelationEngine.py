@@ -0,0 +1,141 @@
+# CrossCorrelationEngine.py
+# -------------------------------------------------------------------------
+# Origin: Split out of "Cross-correlation.py"
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Batched FFT cross-correlation between pupil and calcium signals. All trials x segments of a cohort are stacked into one matrix per segment and correlated with real FFTs, returning a tidy (group, segment, lag) result cube with explicit lags.
+#
+# Inputs:
+#   - 'bindist_2000.csv' files (Pupil Diameter Ratio and calcium columns)
+#
+# Outputs:
+#   - pandas DataFrame indexed by (stimcondition, segment, lag) with the trial-averaged correlation
+#
+# File Relationships:
+#   - Used by CalciumPupilCrossCorrelation; the per-lag layout matches np.correlate(mode='full').
+#
+# Dependencies:
+#   - pandas, numpy, os
+# -------------------------------------------------------------------------
+
+import os
+import numpy as np
+import pandas as pd
+
+# Segment bounds are inclusive, as in the original per-file loop
+SEGMENTS = [(0, 299), (299, 598), (598, 898), (898, 1198), (0, 1198)]
+SEGMENT_NAMES = ['pre', 'stim', 'post-stim', 'post', 'overall']
+
+
+def fft_length(n):
+    # Smallest power of two that holds a full linear correlation of two length-n signals
+    return 1 << int(np.ceil(np.log2(max(2 * n - 1, 1))))
+
+
+def batched_cross_correlation(x, y, normalize=True, max_lag=None, demean=True):
+    # x, y: (n_series, n_samples). Row i of the result equals
+    # np.correlate(x[i] - mean, y[i] - mean, mode='full'), optionally scaled to [-1, 1].
+    # Pass demean=False when the rows are already centred (e.g. by SlidingCorrelationEngine).
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    n = x.shape[1]
+    if demean:
+        x = x - x.mean(axis=1, keepdims=True)
+        y = y - y.mean(axis=1, keepdims=True)
+
+    nfft = fft_length(n)
+    spectrum = np.fft.rfft(x, nfft, axis=1) * np.conj(np.fft.rfft(y, nfft, axis=1))
+    circular = np.fft.irfft(spectrum, nfft, axis=1)
+
+    # Unwrap the circular result into lags -(n-1) .. (n-1)
+    if max_lag is None or max_lag > n - 1:
+        max_lag = n - 1
+    lags = np.arange(-max_lag, max_lag + 1)
+    correlation = np.concatenate([circular[:, nfft - max_lag:], circular[:, :max_lag + 1]], axis=1)
+
+    if normalize:
+        scale = np.sqrt(np.sum(x * x, axis=1) * np.sum(y * y, axis=1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlation = correlation / scale[:, None]
+    return lags, correlation
+
+
+def discover_sessions(input_folder, filename='bindist_2000.csv'):
+    # One record per trial/stimcondition folder that contains the input file
+    records = []
+    for trial_folder in sorted(os.listdir(input_folder)):
+        trial_path = os.path.join(input_folder, trial_folder)
+        if not trial_folder.startswith('trial_') or not os.path.isdir(trial_path):
+            continue
+        for stimcondition in sorted(os.listdir(trial_path)):
+            file_path = os.path.join(trial_path, stimcondition, filename)
+            if os.path.isfile(file_path):
+                records.append({'day': os.path.basename(os.path.normpath(input_folder)),
+                                'trial': trial_folder, 'stimcondition': stimcondition, 'path': file_path})
+    return records
+
+
+def load_signal_matrix(records, columns=('Pupil Diameter Ratio', 'calcium')):
+    # Read every session once into NaN-padded (n_sessions, n_samples) arrays
+    frames = [pd.read_csv(record['path'], usecols=list(columns)) for record in records]
+    lengths = np.array([len(frame) for frame in frames], dtype=int)
+    n_samples = int(lengths.max()) if len(lengths) else 0
+    signals = {}
+    for column in columns:
+        matrix = np.full((len(frames), n_samples), np.nan)
+        for i, frame in enumerate(frames):
+            matrix[i, :lengths[i]] = frame[column].to_numpy(dtype=float)
+        signals[column] = matrix
+    return signals, lengths
+
+
+def cohort_cross_correlation(records, segments=SEGMENTS, segment_names=SEGMENT_NAMES,
+                             group_by=('stimcondition',), normalize=True, max_lag=None, signals=None, lengths=None):
+    # Returns (cube, per_session): cube is indexed by (*group_by, segment, lag)
+    # and holds the mean correlation over sessions in each group.
+    # Pass `signals`/`lengths` from load_signal_matrix to reuse data that is already in memory.
+    records = list(records)
+    if not records:
+        return pd.DataFrame(), pd.DataFrame()
+    if signals is None:
+        signals, lengths = load_signal_matrix(records)
+    pupil = signals['Pupil Diameter Ratio']
+    calcium = signals['calcium']
+    meta = pd.DataFrame(records).drop(columns=['path'])
+
+    per_session = []
+    for (start, end), name in zip(segments, segment_names):
+        # Sessions that are too short for this segment are left out, as before
+        keep = np.flatnonzero(lengths > end)
+        if keep.size == 0:
+            continue
+        lags, correlation = batched_cross_correlation(pupil[keep, start:end + 1], calcium[keep, start:end + 1],
+                                                      normalize=normalize, max_lag=max_lag)
+        block = meta.iloc[np.repeat(keep, len(lags))].reset_index(drop=True)
+        block['session'] = np.repeat(keep, len(lags))
+        block['segment'] = name
+        block['lag'] = np.tile(lags, keep.size)
+        block['correlation'] = correlation.ravel()
+        per_session.append(block)
+
+    if not per_session:
+        return pd.DataFrame(), pd.DataFrame()
+    per_session = pd.concat(per_session, ignore_index=True)
+    keys = list(group_by) + ['segment', 'lag']
+    cube = per_session.groupby(keys, sort=False).agg(correlation=('correlation', 'mean'),
+                                                     n_sessions=('correlation', 'size'))
+    return cube.sort_index(), per_session
+
+
+def peak_summary(cube):
+    # Max correlation and its lag for every (group, segment) curve in the cube.
+    # A curve that is all NaN (e.g. flat signals under normalize=True) gets a row with NaN max_correlation and lag.
+    frame = cube.reset_index()
+    keys = [name for name in cube.index.names if name != 'lag']
+    has_value = frame.groupby(keys, sort=False)['correlation'].transform('count') > 0
+    peaks = frame.loc[frame[has_value].groupby(keys, sort=False)['correlation'].idxmax()]
+    if not has_value.all():
+        empty = frame[~has_value].drop_duplicates(keys).assign(lag=np.nan)
+        peaks = pd.concat([peaks, empty]).sort_index()
+    return peaks.rename(columns={'correlation': 'max_correlation'}).reset_index(drop=True)
@@ -1,10 +1,10 @@
 # DerivativePeakTimingAnalysis.py
 # -------------------------------------------------------------------------
 # Origin: "Time of derivative.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
-#   - Finds max positive/negative pupil derivatives and reports the corresponding calcium values and timestamps.
+#   - Finds the top-k positive/negative pupil derivatives of every session of every day and reports the corresponding calcium values and timestamps. All sessions are read once into a stacked array and the derivative is computed once.
 #
 # Inputs:
 #   - Pupil derivative and calcium CSVs
@@ -14,93 +14,94 @@
 #
 # File Relationships:
 #   - Often run before or alongside event detection modules.
+#   - Sessions are loaded through utils/CohortSessionLoader.
 #
 # Dependencies:
-#   - pandas, numpy, matplotlib, os
+#   - numpy, matplotlib, os, sys
 # -------------------------------------------------------------------------
 
 import os
-import pandas as pd
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from CohortSessionLoader import discover_cohort_sessions, load_session_stack, stacked_gradient
+
+
+def load_derivative_stack(base_folder, days=None):
+    # Read every session of every day once and compute all derivatives in one stacked call
+    records = discover_cohort_sessions(base_folder, days=days)
+    records, stack, lengths = load_session_stack(records)
+    stack['Derivative'] = stacked_gradient(stack['Pupil Diameter Ratio'], stack['time'], lengths)
+    return records, stack, lengths
+
+
+def extract_derivative_extrema(derivative, time, calcium, k=1):
+    # Top-k positive and negative derivative extrema of every session, vectorised over sessions.
+    # Returns two (n_sessions, k) dicts of derivative/time/calcium values, ordered by rank.
+    k = min(k, derivative.shape[1])
+    rows = np.arange(derivative.shape[0])[:, None]
+    extrema = {}
+    for polarity, sign in (('positive', 1), ('negative', -1)):
+        # Rank by signed derivative; padding and missing samples never win
+        order = np.where(np.isnan(derivative), -np.inf, sign * derivative)
+        # argpartition picks the k largest in O(n); only those k are then sorted
+        top = np.argpartition(-order, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-order[rows, top], axis=1), axis=1)
+        valid = np.isfinite(order[rows, top])
+        extrema[polarity] = {
+            'index': np.where(valid, top, -1),
+            'derivative': np.where(valid, derivative[rows, top], np.nan),
+            'time': np.where(valid, time[rows, top], np.nan),
+            'calcium': np.where(valid, calcium[rows, top], np.nan),
+        }
+    return extrema['positive'], extrema['negative']
 
-def find_max_positive_derivative(csv_file):
-    # Load the data from the CSV file
-    data = pd.read_csv(csv_file)
-
-    # Ensure the CSV contains the required columns
-    if not {'time', 'Pupil Diameter Ratio', 'calcium'}.issubset(data.columns):
-        raise ValueError("CSV file must contain 'time', 'Pupil Diameter Ratio', and 'calcium' columns")
-
-    # Compute the derivative of the Pupil Diameter Ratio with respect to time
-    data['Derivative'] = np.gradient(data['Pupil Diameter Ratio'], data['time'])
 
-    # Find the maximum positive derivative
-    max_positive_derivative = data['Derivative'].max()
-
-    # Find the corresponding calcium level and time
-    max_derivative_row = data.loc[data['Derivative'].idxmax()]
-
-    time_at_max_derivative = max_derivative_row['time']
-    calcium_at_max_derivative = max_derivative_row['calcium']
-
-    return max_positive_derivative, time_at_max_derivative, calcium_at_max_derivative
+def find_max_positive_derivative(csv_file):
+    # Single-file helper kept for interactive use; see process_folders for the cohort path
+    positive, _ = _single_file_extrema(csv_file)
+    return positive['derivative'][0, 0], positive['time'][0, 0], positive['calcium'][0, 0]
 
 
 def find_max_negative_derivative(csv_file):
-    # Load the data from the CSV file
-    data = pd.read_csv(csv_file)
+    _, negative = _single_file_extrema(csv_file)
+    return negative['derivative'][0, 0], negative['time'][0, 0], negative['calcium'][0, 0]
 
-    # Ensure the CSV contains the required columns
-    if not {'time', 'Pupil Diameter Ratio', 'calcium'}.issubset(data.columns):
-        raise ValueError("CSV file must contain 'time', 'Pupil Diameter Ratio', and 'calcium' columns")
-
-    # Compute the derivative of the Pupil Diameter Ratio with respect to time
-    data['Derivative'] = np.gradient(data['Pupil Diameter Ratio'], data['time'])
-
-    # Find the maximum negative derivative
-    max_negative_derivative = data['Derivative'].min()
-
-    # Find the corresponding calcium level and time
-    min_derivative_row = data.loc[data['Derivative'].idxmin()]
 
-    time_at_min_derivative = min_derivative_row['time']
-    calcium_at_min_derivative = min_derivative_row['calcium']
+def _single_file_extrema(csv_file):
+    records, stack, lengths = load_session_stack([{'path': csv_file}], report_missing_columns=False)
+    if not records:
+        raise ValueError("CSV file must contain 'time', 'Pupil Diameter Ratio', and 'calcium' columns")
+    derivative = stacked_gradient(stack['Pupil Diameter Ratio'], stack['time'], lengths)
+    return extract_derivative_extrema(derivative, stack['time'], stack['calcium'])
 
-    return max_negative_derivative, time_at_min_derivative, calcium_at_min_derivative
 
+def process_folders(base_folder, days=None, k=1):
+    # base_folder is an animal folder (e.g. .../890); every day under it is processed unless
+    # `days` is given. Returns one result per session and rank for each polarity.
+    records, stack, lengths = load_derivative_stack(base_folder, days=days)
+    if not records:
+        return [], []
+    positive, negative = extract_derivative_extrema(stack['Derivative'], stack['time'], stack['calcium'], k=k)
 
-def process_folders(base_folder):
     pos_results = []
     neg_results = []
-
-    # Iterate through the folders and subfolders
-    for trial_folder in os.listdir(base_folder):
-        trial_path = os.path.join(base_folder, trial_folder)
-        if os.path.isdir(trial_path):
-            for stim_folder in os.listdir(trial_path):
-                stim_path = os.path.join(trial_path, stim_folder)
-                if os.path.isdir(stim_path):
-                    csv_file = os.path.join(stim_path, 'bindist_2000.csv')
-                    if os.path.exists(csv_file):
-                        try:
-                            max_pos_derivative, pos_time, pos_calcium = find_max_positive_derivative(csv_file)
-                            pos_results.append({
-                                'trial': trial_folder,
-                                'stim_condition': stim_folder,
-                                'time': pos_time,
-                                'calcium': pos_calcium
-                            })
-                            max_neg_derivative, neg_time, neg_calcium = find_max_negative_derivative(csv_file)
-                            neg_results.append({
-                                'trial': trial_folder,
-                                'stim_condition': stim_folder,
-                                'time': neg_time,
-                                'calcium': neg_calcium
-                            })
-                        except Exception as e:
-                            print(f"Error processing {csv_file}: {e}")
+    for extrema, results in ((positive, pos_results), (negative, neg_results)):
+        for i, record in enumerate(records):
+            for rank in range(extrema['index'].shape[1]):
+                if extrema['index'][i, rank] < 0:
+                    continue
+                results.append({
+                    'day': record['day'],
+                    'trial': record['trial'],
+                    'stim_condition': record['stimcondition'],
+                    'rank': rank + 1,
+                    'derivative': extrema['derivative'][i, rank],
+                    'time': extrema['time'][i, rank],
+                    'calcium': extrema['calcium'][i, rank]
+                })
 
     return pos_results, neg_results
 
@@ -136,22 +137,37 @@ def plot_results(results, output_folder, plot_name):
     plt.close()
 
 
+def process_day(day_folder, output_folder=None):
+    # One day of one animal, with plots in <day>/time_of_max_derivative_graphs as before
+    animal_folder, day = os.path.split(os.path.normpath(day_folder))
+    pos_results, neg_results = process_folders(animal_folder, days=[day])
+    if output_folder is None:
+        output_folder = os.path.join(day_folder, 'time_of_max_derivative_graphs')
+    if pos_results:
+        plot_results(pos_results, output_folder, "Maximum Positive Derivative")
+    if neg_results:
+        plot_results(neg_results, output_folder, "Maximum Negative Derivative")
+    return pos_results + neg_results
+
+
 # Example usage
-base_folder = r'C:\Users\ASH213\Documents\Correlated\890\d070'  # Replace with the path to your base folder
-pos_results, neg_results = process_folders(base_folder)
-
-# Print results
-print("Positive Derivative Results:")
-for result in pos_results:
-    print(f"Trial: {result['trial']}, Stim Condition: {result['stim_condition']}, "
-          f"Time: {result['time']}, Calcium: {result['calcium']}")
-
-print("\nNegative Derivative Results:")
-for result in neg_results:
-    print(f"Trial: {result['trial']}, Stim Condition: {result['stim_condition']}, "
-          f"Time: {result['time']}, Calcium: {result['calcium']}")
-
-# Plot the results
-output_folder = r'C:\Users\ASH213\Documents\Correlated\890\d070\time_of_max_derivative_graphs'
-plot_results(pos_results, output_folder, "Maximum Positive Derivative")
-plot_results(neg_results, output_folder, "Maximum Negative Derivative")
+if __name__ == "__main__":
+    base_folder = r'C:\Users\ASH213\Documents\Correlated\890'  # Animal folder containing d084, d070, ...
+    pos_results, neg_results = process_folders(base_folder, k=1)
+
+    # Print results
+    print("Positive Derivative Results:")
+    for result in pos_results:
+        print(f"Day: {result['day']}, Trial: {result['trial']}, Stim Condition: {result['stim_condition']}, "
+              f"Time: {result['time']}, Calcium: {result['calcium']}")
+
+    print("\nNegative Derivative Results:")
+    for result in neg_results:
+        print(f"Day: {result['day']}, Trial: {result['trial']}, Stim Condition: {result['stim_condition']}, "
+              f"Time: {result['time']}, Calcium: {result['calcium']}")
+
+    # Plot the results, one folder per day as before
+    for day in sorted(set(result['day'] for result in pos_results + neg_results)):
+        output_folder = os.path.join(base_folder, day, 'time_of_max_derivative_graphs')
+        plot_results([r for r in pos_results if r['day'] == day], output_folder, "Maximum Positive Derivative")
+        plot_results([r for r in neg_results if r['day'] == day], output_folder, "Maximum Negative Derivative")
@@ -0,0 +1,138 @@
+# SlidingCorrelationEngine.py
+# -------------------------------------------------------------------------
+# Origin: Split out of "Correlation bin distribution.py"
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Bounded-lag sliding-window cross-correlation between pupil and calcium signals. Windows are strided views of the signal (no copies per window), window means and energies come from running sums, and all windows of all files are correlated at once, giving a (file, window, lag) cube.
+#
+# Inputs:
+#   - Pupil and calcium arrays (one row per session), e.g. from CrossCorrelationEngine.load_signal_matrix
+#
+# Outputs:
+#   - Window starts, lags and the correlation cube; peak correlation/lag per window
+#
+# File Relationships:
+#   - Used by SlidingWindowCorrelationDistribution; shares the FFT core with CrossCorrelationEngine.
+#
+# Dependencies:
+#   - numpy, pandas
+# -------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from CrossCorrelationEngine import batched_cross_correlation, load_signal_matrix
+
+# Above this many lags a batched FFT is cheaper than summing each lag directly
+DIRECT_LAG_LIMIT = 32
+
+
+def window_starts(n_samples, window, step, stop=None):
+    # Start index of every full window; `stop` caps the start positions (exclusive)
+    last = n_samples - window
+    if stop is not None:
+        last = min(last, stop - 1)
+    return np.arange(0, last + 1, step) if last >= 0 else np.arange(0)
+
+
+def running_window_stats(signal, window, starts):
+    # Window sums and centred energies from cumulative sums: O(n) regardless of window size.
+    # NaNs only poison the windows that contain them, not every later window.
+    def window_sum(values):
+        csum = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(values, axis=-1)], axis=-1)
+        return csum[..., starts + window] - csum[..., starts]
+
+    missing = np.isnan(signal)
+    clean = np.where(missing, 0.0, signal)
+    sums = window_sum(clean)
+    sums2 = window_sum(clean * clean)
+    means = sums / window
+    energy = np.maximum(sums2 - sums * means, 0.0)
+    has_nan = window_sum(missing.astype(float)) > 0
+    means[has_nan] = np.nan
+    energy[has_nan] = np.nan
+    return means, energy
+
+
+def sliding_cross_correlation(x, y, window=100, step=5, max_lag=None, normalize=False, stop=None, method='auto'):
+    # x, y: (n_series, n_samples) or 1-D. Returns (starts, lags, correlation) where
+    # correlation has shape (n_series, n_windows, n_lags); lag k matches
+    # np.correlate(x_window - mean, y_window - mean, mode='full')[k + window - 1].
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    n_series, n_samples = x.shape
+    if max_lag is None or max_lag > window - 1:
+        max_lag = window - 1
+    starts = window_starts(n_samples, window, step, stop)
+    lags = np.arange(-max_lag, max_lag + 1)
+    if starts.size == 0:
+        return starts, lags, np.empty((n_series, 0, lags.size))
+
+    # Strided (n_series, n_windows, window) views, centred with the running-sum means
+    mean_x, energy_x = running_window_stats(x, window, starts)
+    mean_y, energy_y = running_window_stats(y, window, starts)
+    x_windows = sliding_window_view(x, window, axis=-1)[:, starts] - mean_x[..., None]
+    y_windows = sliding_window_view(y, window, axis=-1)[:, starts] - mean_y[..., None]
+
+    if method == 'auto':
+        method = 'direct' if lags.size <= DIRECT_LAG_LIMIT else 'fft'
+
+    if method == 'direct':
+        # One vectorised multiply-add per lag over every window of every series
+        correlation = np.empty((n_series, starts.size, lags.size))
+        for j, lag in enumerate(lags):
+            if lag >= 0:
+                correlation[..., j] = np.einsum('swn,swn->sw', x_windows[..., lag:], y_windows[..., :window - lag])
+            else:
+                correlation[..., j] = np.einsum('swn,swn->sw', x_windows[..., :window + lag], y_windows[..., -lag:])
+    else:
+        _, flat = batched_cross_correlation(x_windows.reshape(-1, window), y_windows.reshape(-1, window),
+                                            normalize=False, max_lag=max_lag, demean=False)
+        correlation = flat.reshape(n_series, starts.size, lags.size)
+
+    if normalize:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlation = correlation / np.sqrt(energy_x * energy_y)[..., None]
+    return starts, lags, correlation
+
+
+def peak_per_window(lags, correlation):
+    # Max correlation and its lag along the last axis; windows that are all-NaN stay NaN
+    valid = ~np.all(np.isnan(correlation), axis=-1)
+    filled = np.where(np.isnan(correlation), -np.inf, correlation)
+    best = np.argmax(filled, axis=-1)
+    max_correlations = np.where(valid, np.take_along_axis(filled, best[..., None], axis=-1)[..., 0], np.nan)
+    max_lags = np.where(valid, lags[best], np.nan)
+    return max_correlations, max_lags
+
+
+def cohort_sliding_correlation(records, window=100, step=5, max_lag=None, normalize=False, stop=None):
+    # Read every session once and return (signals, lengths, starts, lags, correlation)
+    signals, lengths = load_signal_matrix(records)
+    starts, lags, correlation = sliding_cross_correlation(signals['Pupil Diameter Ratio'], signals['calcium'],
+                                                          window=window, step=step, max_lag=max_lag,
+                                                          normalize=normalize, stop=stop)
+    return signals, lengths, starts, lags, correlation
+
+
+def parameter_sweep(records, windows, steps, max_lag=None, normalize=True):
+    # Peak correlation/lag per (window, step, session, window start) with the data read only once
+    signals, _ = load_signal_matrix(records)
+    meta = pd.DataFrame(records).drop(columns=['path'])
+    rows = []
+    for window in windows:
+        for step in steps:
+            starts, lags, correlation = sliding_cross_correlation(signals['Pupil Diameter Ratio'], signals['calcium'],
+                                                                  window=window, step=step, max_lag=max_lag,
+                                                                  normalize=normalize)
+            max_correlations, max_lags = peak_per_window(lags, correlation)
+            block = meta.iloc[np.repeat(np.arange(len(meta)), starts.size)].reset_index(drop=True)
+            block['window'] = window
+            block['step'] = step
+            block['start'] = np.tile(starts, len(meta))
+            block['max_correlation'] = max_correlations.ravel()
+            block['max_lag'] = max_lags.ravel()
+            rows.append(block)
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
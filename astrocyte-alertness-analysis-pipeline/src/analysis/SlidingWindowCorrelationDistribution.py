@@ -1,7 +1,7 @@
 # SlidingWindowCorrelationDistribution.py
 # -------------------------------------------------------------------------
 # Origin: "Correlation bin distribution.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Computes and visualizes rolling correlations between calcium and pupil signals using a sliding window of 100 samples, stepping every 5 points. Highlights lag polarity with color-coded bins.
@@ -11,9 +11,11 @@
 #
 # Outputs:
 #   - Plots of sliding window correlation distributions
+#   - Optional per-window significance CSV (p-value, surrogate band and trial count) via SurrogateNullEngine; with the null enabled, the averages use the same NaN-free trials as the test
 #
 # File Relationships:
 #   - Complements CalciumPupilCrossCorrelation analysis.
+#   - Window correlations are computed by SlidingCorrelationEngine; `max_lag` bounds the lags searched.
 #
 # Dependencies:
 #   - pandas, numpy, matplotlib, os
@@ -24,7 +26,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 
-def process_file(file_path):
+from CrossCorrelationEngine import discover_sessions
+from SlidingCorrelationEngine import cohort_sliding_correlation, peak_per_window, sliding_cross_correlation
+from SurrogateNullEngine import finite_trials, run_null_tests, sliding_null_test
+
+def process_file(file_path, window=100, step=5, max_lag=None):
     # Load the data from the CSV file
     data = pd.read_csv(file_path)
 
@@ -32,26 +38,14 @@ def process_file(file_path):
     pupil_diameter = data['Pupil Diameter Ratio'].values
     calcium_activity = data['calcium'].values
 
-    # Define the segment ranges (bins)
-    segment_ranges = [(i, i + 100) for i in range(0, 1200, 5)]
-    max_correlations = []
-    max_lags = []
-
-    for start, end in segment_ranges:
-        if end <= len(pupil_diameter) and end <= len(calcium_activity):
-            pd_segment = pupil_diameter[start:end]
-            ca_segment = calcium_activity[start:end]
-
-            # Compute the cross-correlation for the segment
-            correlation = np.correlate(pd_segment - np.mean(pd_segment), ca_segment - np.mean(ca_segment), mode='full')
-            lag = np.argmax(correlation) - (len(pd_segment) - 1)
+    # Correlate every window (starts 0, 5, 10, ... below 1200) in one batched call
+    starts, lags, correlation = sliding_cross_correlation(pupil_diameter, calcium_activity, window=window,
+                                                          step=step, max_lag=max_lag, stop=1200)
 
-            # Record the maximum correlation value and its lag
-            max_correlation = np.max(correlation)
-            max_correlations.append(max_correlation)
-            max_lags.append(lag)
+    # Record the maximum correlation value and its lag for each window
+    max_correlations, max_lags = peak_per_window(lags, correlation[0])
 
-    return list(range(0, 1200, 5))[:len(max_correlations)], max_correlations, max_lags, pupil_diameter
+    return starts.tolist(), max_correlations.tolist(), max_lags.tolist(), pupil_diameter
 
 def assign_color(lag):
     if lag >= -5 and lag <= 5:
@@ -71,28 +65,49 @@ def assign_color(lag):
     else:
         return 'black'  # Default color, should not occur with above conditions
 
-def process_folder(input_folder, output_folder):
+def process_folder(input_folder, output_folder, window=100, step=5, max_lag=None, n_surrogates=0,
+                   surrogate_method='circular_shift', seed=0, n_workers=None):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
     stimconditions = ['stimcondition_1', 'stimcondition_2', 'stimcondition_3', 'stimcondition_4', 'stimcondition_5']
-    trial_folders = [f'trial_{i}' for i in range(1, 4)]
+
+    # Read every trial x stimcondition once and correlate all windows of all files together
+    records = [record for record in discover_sessions(input_folder) if record['stimcondition'] in stimconditions]
+    if not records:
+        print(f"No bindist_2000.csv files found under {input_folder}")
+        return
+    signals, lengths, starts, lags, correlation = cohort_sliding_correlation(records, window=window, step=step,
+                                                                              max_lag=max_lag, stop=1200)
+    max_correlations, max_lags = peak_per_window(lags, correlation)
+    windows_per_file = np.searchsorted(starts, lengths - window, side='right')
+
+    # Optional per-window p-values against surrogate nulls, one pool task per stimcondition
+    null_results = {}
+    if n_surrogates > 0:
+        tasks = []
+        for stimcondition in stimconditions:
+            rows = [i for i, record in enumerate(records) if record['stimcondition'] == stimcondition]
+            if rows:
+                common = int(lengths[rows].min())
+                tasks.append((stimcondition, signals['Pupil Diameter Ratio'][rows, :common],
+                              signals['calcium'][rows, :common]))
+        null_results = run_null_tests(tasks, test=sliding_null_test, seed=seed, n_workers=n_workers,
+                                      window=window, step=step, max_lag=max_lag, n_surrogates=n_surrogates,
+                                      method=surrogate_method, stop=1200)
 
     for stimcondition in stimconditions:
-        all_max_correlations = []
-        all_max_lags = []
-        all_pupil_diameter_ratios = []
-
-        for trial_folder in trial_folders:
-            trial_path = os.path.join(input_folder, trial_folder, stimcondition)
-            if os.path.exists(trial_path):
-                for filename in os.listdir(trial_path):
-                    if filename == 'bindist_2000.csv':
-                        file_path = os.path.join(trial_path, filename)
-                        segment_lengths, max_correlations, max_lags, pupil_diameter = process_file(file_path)
-                        all_max_correlations.append(max_correlations)
-                        all_max_lags.append(max_lags)
-                        all_pupil_diameter_ratios.append(pupil_diameter)
+        rows = [i for i, record in enumerate(records) if record['stimcondition'] == stimcondition]
+        null = null_results.get(stimcondition)
+        if null is not None:
+            # The null test drops trials containing NaN; average the same trials so observed and null match
+            common = int(lengths[rows].min())
+            rows = [i for i, keep in zip(rows, finite_trials(signals['Pupil Diameter Ratio'][rows, :common],
+                                                             signals['calcium'][rows, :common])) if keep]
+        all_max_correlations = [max_correlations[i, :windows_per_file[i]] for i in rows]
+        all_max_lags = [max_lags[i, :windows_per_file[i]] for i in rows]
+        all_pupil_diameter_ratios = [signals['Pupil Diameter Ratio'][i, :lengths[i]] for i in rows]
+        segment_lengths = starts.tolist()
 
         if all_max_correlations:
             # Convert all_max_correlations and all_pupil_diameter_ratios to numpy arrays and handle different lengths
@@ -121,11 +136,27 @@ def process_folder(input_folder, output_folder):
 
             plt.subplot(2, 1, 1)
             plt.scatter(segment_lengths, avg_max_correlations, c=colors)
+            if null is not None:
+                # The tested statistic is the peak of the trial-averaged curve; draw it with the band it is
+                # compared against and ring the windows whose peak beats the surrogate null
+                significant = null['p_value'] < 0.05
+                plt.plot(null['starts'], null['max_correlation'], color='black', lw=0.8,
+                         label=f"Peak of trial-averaged curve (n={null['n_trials']} trials)")
+                plt.scatter(null['starts'][significant], null['max_correlation'][significant], s=80,
+                            facecolors='none', edgecolors='black', label='p < 0.05')
+                plt.fill_between(null['starts'], null['null_lower'], null['null_upper'], color='gray', alpha=0.3,
+                                 label='95% surrogate band')
+                plt.legend()
+                significance = pd.DataFrame({key: null[key] for key in ('starts', 'max_correlation', 'max_lag',
+                                                                        'p_value', 'null_lower', 'null_upper')})
+                significance['n_trials'] = null['n_trials']
+                significance.to_csv(os.path.join(output_folder, f'{stimcondition}_sliding_correlation_significance.csv'),
+                                    index=False)
             plt.axvline(x=300, color='red', linestyle='--')
             plt.axvline(x=601, color='red', linestyle='--')
             plt.xlabel('Segment Start (points)')
             plt.ylabel('Maximum Cross-correlation')
-            plt.title(f'Average Maximum Cross-correlation for {stimcondition}')
+            plt.title(f'Average Maximum Cross-correlation for {stimcondition} ({len(rows)} trials)')
             plt.grid(True)
 
             # Plot the average pupil diameter ratio for each segment length
@@ -146,8 +177,11 @@ def process_folder(input_folder, output_folder):
 
             print(f"Processed {stimcondition}. The average maximum cross-correlation and pupil diameter ratio plot has been saved.")
 
-input_folder = r'C:\Users\ASH213\Documents\Correlated\890\d084'
-output_folder = r'C:\Users\ASH213\Documents\Correlated\890\d084\bin_cross_correlations'
+if __name__ == "__main__":
+    input_folder = r'C:\Users\ASH213\Documents\Correlated\890\d084'
+    output_folder = r'C:\Users\ASH213\Documents\Correlated\890\d084\bin_cross_correlations'
+
+    # Process all relevant files and create averaged maximum cross-correlation graphs
+    # (set n_surrogates, e.g. 1000, to add per-window p-values against surrogate nulls)
+    process_folder(input_folder, output_folder, n_surrogates=0)
 
-# Process all relevant files and create averaged maximum cross-correlation graphs
-process_folder(input_folder, output_folder)
@@ -0,0 +1,216 @@
+# SurrogateNullEngine.py
+# -------------------------------------------------------------------------
+# Origin: New module for significance testing of the correlation analyses
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Builds surrogate null distributions for pupil-calcium coupling statistics (circular shift, phase randomization, trial shuffle). Thousands of surrogates per group are generated and correlated as batched FFT computations, spread over a process pool with deterministic per-task seeds, and turned into p-values and pointwise confidence bands.
+#   - Trials containing NaN are dropped before testing; p-values count only finite null peaks, and curves that are all NaN give NaN statistics instead of raising.
+#
+# Inputs:
+#   - Pupil and calcium arrays (one row per trial) for each group being tested
+#
+# Outputs:
+#   - Observed max correlation and lag, p-value, and null confidence band per group (or per window)
+#
+# File Relationships:
+#   - Used by CalciumPupilCrossCorrelation and SlidingWindowCorrelationDistribution; built on CrossCorrelationEngine and SlidingCorrelationEngine.
+#
+# Dependencies:
+#   - numpy, warnings, concurrent.futures
+# -------------------------------------------------------------------------
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from CrossCorrelationEngine import batched_cross_correlation
+from SlidingCorrelationEngine import peak_per_window, sliding_cross_correlation
+
+SURROGATE_METHODS = ('circular_shift', 'phase', 'trial_shuffle')
+
+
+def make_surrogates(y, n_surrogates, method, rng, min_shift=None):
+    # y: (n_trials, n_samples) -> (n_surrogates, n_trials, n_samples) surrogate copies of y
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    n_trials, n_samples = y.shape
+
+    if method == 'circular_shift':
+        # Independent random rotation per surrogate and trial, avoiding near-zero shifts
+        if min_shift is None:
+            min_shift = max(1, n_samples // 10)
+        shifts = rng.integers(min_shift, n_samples - min_shift + 1, size=(n_surrogates, n_trials))
+        index = (np.arange(n_samples)[None, None, :] - shifts[..., None]) % n_samples
+        return np.take_along_axis(np.broadcast_to(y, (n_surrogates, n_trials, n_samples)), index, axis=-1)
+
+    if method == 'phase':
+        # Keep each trial's amplitude spectrum, randomize the phases (DC and Nyquist stay real)
+        spectrum = np.fft.rfft(y - y.mean(axis=1, keepdims=True), axis=-1)
+        phases = rng.uniform(0, 2 * np.pi, size=(n_surrogates,) + spectrum.shape)
+        phases[..., 0] = 0
+        if n_samples % 2 == 0:
+            phases[..., -1] = 0
+        surrogate = np.fft.irfft(np.abs(spectrum) * np.exp(1j * phases), n_samples, axis=-1)
+        return surrogate + y.mean(axis=1, keepdims=True)
+
+    if method == 'trial_shuffle':
+        # Pair each trial with the calcium trace of a different trial from the same group
+        if n_trials < 2:
+            raise ValueError("trial_shuffle needs at least two trials per group")
+        offsets = rng.integers(1, n_trials, size=(n_surrogates, n_trials))
+        partners = (np.arange(n_trials)[None, :] + offsets) % n_trials
+        return y[partners]
+
+    raise ValueError(f"Unknown surrogate method '{method}', expected one of {SURROGATE_METHODS}")
+
+
+def finite_trials(x, y):
+    # Trials whose pupil and calcium are both free of NaN/inf; a NaN anywhere would make the
+    # trial's whole FFT correlation NaN
+    return np.isfinite(x).all(axis=1) & np.isfinite(y).all(axis=1)
+
+
+def trial_mean(curves, axis):
+    # Mean over trials that skips NaN (e.g. a flat trial under normalize=True), like the pandas
+    # mean of the result cube; NaN where no trial is finite
+    valid = ~np.isnan(curves)
+    counts = valid.sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(valid, curves, 0.0).sum(axis=axis) / counts
+    return np.where(counts > 0, means, np.nan)
+
+
+def null_p_values(null_peaks, observed_peaks):
+    # (1 + #finite null peaks >= observed) / (1 + #finite null peaks) along axis 0.
+    # NaN null peaks are left out of both counts; no finite null or a NaN observed peak gives NaN.
+    finite = np.isfinite(null_peaks)
+    n_null = finite.sum(axis=0)
+    exceed = np.sum(finite & (np.where(finite, null_peaks, -np.inf) >= observed_peaks), axis=0)
+    p_values = (1 + exceed) / (1 + n_null)
+    return np.where((n_null > 0) & np.isfinite(observed_peaks), p_values, np.nan), n_null
+
+
+def null_percentiles(null, percentiles):
+    # np.nanpercentile along axis 0 without the all-NaN warning (those columns stay NaN)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanpercentile(null, percentiles, axis=0)
+
+
+def group_null_test(x, y, n_surrogates=1000, method='circular_shift', seed=0, normalize=True,
+                    max_lag=None, alpha=0.05, chunk_size=250):
+    # Tests the trial-averaged cross-correlation peak of one group against surrogates.
+    # x, y: (n_trials, n_samples) pupil and calcium for the same segment.
+    # Trials containing NaN are dropped (n_trials reports how many were used); a group whose
+    # averaged curve is all NaN gets NaN statistics instead of an error.
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    keep = finite_trials(x, y)
+    x, y = x[keep], y[keep]
+    n_trials, n_samples = x.shape
+    rng = np.random.default_rng(seed)
+
+    lags, observed = batched_cross_correlation(x, y, normalize=normalize, max_lag=max_lag)
+    observed = trial_mean(observed, axis=0)
+    max_correlation, max_lag_found = peak_per_window(lags, observed)
+    if np.isnan(max_correlation):
+        empty = np.full(lags.size, np.nan)
+        return {
+            'lags': lags,
+            'correlation': observed,
+            'max_correlation': np.nan,
+            'max_lag': np.nan,
+            'p_value': np.nan,
+            'null_lower': empty,
+            'null_upper': empty.copy(),
+            'null_peak_threshold': np.nan,
+            'n_trials': int(n_trials),
+            'n_null': 0,
+        }
+
+    null_curves = []
+    for start in range(0, n_surrogates, chunk_size):
+        n_chunk = min(chunk_size, n_surrogates - start)
+        surrogate_y = make_surrogates(y, n_chunk, method, rng)
+        # All surrogates x trials of the chunk go through one batched FFT
+        tiled_x = np.broadcast_to(x, (n_chunk, n_trials, n_samples)).reshape(-1, n_samples)
+        _, null = batched_cross_correlation(tiled_x, surrogate_y.reshape(-1, n_samples),
+                                            normalize=normalize, max_lag=max_lag)
+        null_curves.append(trial_mean(null.reshape(n_chunk, n_trials, -1), axis=1))
+    null_curves = np.concatenate(null_curves, axis=0)
+
+    # The peak statistic is compared with the null peak, which controls for the search over lags
+    null_peaks = peak_per_window(lags, null_curves)[0]
+    p_value, n_null = null_p_values(null_peaks, max_correlation)
+    lower, upper = null_percentiles(null_curves, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return {
+        'lags': lags,
+        'correlation': observed,
+        'max_correlation': float(max_correlation),
+        'max_lag': int(max_lag_found),
+        'p_value': float(p_value),
+        'null_lower': lower,
+        'null_upper': upper,
+        'null_peak_threshold': float(null_percentiles(null_peaks, 100 * (1 - alpha))),
+        'n_trials': int(n_trials),
+        'n_null': int(n_null),
+    }
+
+
+def sliding_null_test(x, y, window=100, step=5, max_lag=None, n_surrogates=1000, method='circular_shift',
+                      seed=0, normalize=False, stop=None, alpha=0.05, chunk_size=20):
+    # Per-window p-values for the trial-averaged sliding-window peak correlation.
+    # Surrogates are built from the whole calcium trace and then windowed, like the real data.
+    # NaN handling follows group_null_test: trials with NaN are dropped, and windows whose
+    # observed or null peaks are all NaN get a NaN p-value.
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    keep = finite_trials(x, y)
+    x, y = x[keep], y[keep]
+    n_trials, n_samples = x.shape
+    rng = np.random.default_rng(seed)
+
+    starts, lags, observed = sliding_cross_correlation(x, y, window=window, step=step, max_lag=max_lag,
+                                                       normalize=normalize, stop=stop)
+    observed_peaks, observed_lags = peak_per_window(lags, trial_mean(observed, axis=0))
+
+    null_peaks = []
+    for start in range(0, n_surrogates if n_trials else 0, chunk_size):
+        n_chunk = min(chunk_size, n_surrogates - start)
+        surrogate_y = make_surrogates(y, n_chunk, method, rng).reshape(-1, n_samples)
+        tiled_x = np.broadcast_to(x, (n_chunk, n_trials, n_samples)).reshape(-1, n_samples)
+        _, _, null = sliding_cross_correlation(tiled_x, surrogate_y, window=window, step=step, max_lag=max_lag,
+                                               normalize=normalize, stop=stop)
+        null = trial_mean(null.reshape(n_chunk, n_trials, starts.size, lags.size), axis=1)
+        null_peaks.append(peak_per_window(lags, null)[0])
+    null_peaks = np.concatenate(null_peaks, axis=0) if null_peaks else np.full((1, starts.size), np.nan)
+
+    p_values, n_null = null_p_values(null_peaks, observed_peaks)
+    lower, upper = null_percentiles(null_peaks, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return {
+        'starts': starts,
+        'max_correlation': observed_peaks,
+        'max_lag': observed_lags,
+        'p_value': p_values,
+        'null_lower': lower,
+        'null_upper': upper,
+        'n_trials': int(n_trials),
+        'n_null': n_null,
+    }
+
+
+def _run_task(args):
+    test, key, arrays, kwargs = args
+    return key, test(*arrays, **kwargs)
+
+
+def run_null_tests(tasks, test=group_null_test, seed=0, n_workers=None, **kwargs):
+    # tasks: list of (key, x, y). Each task gets its own child seed spawned from `seed`, so
+    # results are reproducible no matter how tasks are scheduled across workers.
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    jobs = [(test, key, (x, y), dict(kwargs, seed=child)) for (key, x, y), child in zip(tasks, seeds)]
+    if n_workers == 1 or len(jobs) <= 1:
+        return dict(_run_task(job) for job in jobs)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return dict(executor.map(_run_task, jobs))
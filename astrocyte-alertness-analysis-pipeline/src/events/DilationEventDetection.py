@@ -1,10 +1,11 @@
 # DilationEventDetection.py
 # -------------------------------------------------------------------------
 # Origin: "Dilation events.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Detects pupil dilation events exceeding a dynamic threshold based on standard deviation of derivatives. Generates per-condition plots.
+#   - Mean, std and the derivative histogram come from mergeable streaming accumulators (StreamingStatistics; the histogram bins span the full derivative range, so no value is left out of the plot), folded in session by session from the loader's stacked derivatives.
 #
 # Inputs:
 #   - Pupil derivative data across trials and stim conditions
@@ -14,24 +15,29 @@
 #
 # File Relationships:
 #   - Upstream of EventThresholdDetection and EventThresholdDetectionNormalized.
+#   - Data comes from DilationEventLoader; detect_dilation_events/plot_derivative_analysis are shared with DilationEventDetectionShifted.
+#   - Uses DerivativeThresholdAccumulator from StreamingStatistics; EventThresholds builds the same accumulators from the CSVs one session at a time when the cohort does not fit in memory.
 #
 # Dependencies:
-#   - pandas, numpy, matplotlib, os
+#   - numpy, matplotlib, os, sys
 # -------------------------------------------------------------------------
 
 import os
-import pandas as pd
+import sys
+
 import matplotlib.pyplot as plt
 import numpy as np
 
+from DilationEventLoader import DETECTION_DAYS, load_condition_arrays
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from StreamingStatistics import DerivativeThresholdAccumulator
+
 # Base directory where d084, d070, etc. folders are located
 base_dir = r"C:\Users\ASH213\Documents\Correlated\890"
 
 # Subfolders for each day containing trials
-days = ['d084', 'd070', 'd014', 'd007', 'd003', 'd001', 'd021', 'd028', 'd056']
-
-# Trials
-trials = ['trial_1', 'trial_2', 'trial_3']
+days = DETECTION_DAYS
 
 # Subfolders for each stim condition
 stim_conditions = ['stimcondition_1', 'stimcondition_2', 'stimcondition_3', 'stimcondition_4', 'stimcondition_5']
@@ -45,93 +51,57 @@ bindist_file = 'bindist_2000.csv'
 # Time points for red lines
 time_markers = [-0.016464, 30.067352]
 
-# Initialize dictionaries to store aggregated data
-agg_derivatives = {stim: [] for stim in stim_conditions}
-agg_time_derivatives = {stim: [] for stim in stim_conditions}
-agg_calcium_values = {stim: [] for stim in stim_conditions}
-
-# Iterate over each day
-for day in days:
-    day_dir = os.path.join(base_dir, day)
-
-    # Iterate over each trial
-    for trial in trials:
-        trial_dir = os.path.join(day_dir, trial)
-
-        # Iterate over each stim condition
-        for stim in stim_conditions:
-            # Collect all Pupil Diameter Ratio data and compute derivatives
-            csv_path = os.path.join(trial_dir, stim, bindist_file)
-            if os.path.exists(csv_path):
-                df = pd.read_csv(csv_path)
-                if 'Pupil Diameter Ratio' in df.columns and 'time' in df.columns and 'calcium' in df.columns:
-                    pupil_diameter_ratio = df['Pupil Diameter Ratio']
-                    time = df['time']
-                    calcium = df['calcium']
-
-                    # Compute the derivative of the Pupil Diameter Ratio
-                    pupil_derivative = np.gradient(pupil_diameter_ratio, time)
-
-                    # Collect the time and calcium values for the derivatives
-                    time_derivatives = time
-                    calcium_values = calcium
-
-                    # Aggregate the data
-                    agg_derivatives[stim].extend(pupil_derivative)
-                    agg_time_derivatives[stim].extend(time_derivatives)
-                    agg_calcium_values[stim].extend(calcium_values)
-                else:
-                    print(f"Missing required columns in {csv_path}")
-            else:
-                print(f"File not found: {csv_path}")
-
-# Plot aggregated data for each stim condition
-for stim in stim_conditions:
-    if not agg_derivatives[stim]:
-        print(f"No Pupil Diameter Ratio data found for any trial in {stim}")
-        continue
-
-    # Use all derivatives
-    all_derivatives = np.array(agg_derivatives[stim])
-    all_times = np.array(agg_time_derivatives[stim])
-    all_calcium_values = np.array(agg_calcium_values[stim])
-
-    # Calculate mean and standard deviation of the derivatives
-    mean_derivative = np.mean(all_derivatives)
-    std_derivative = np.std(all_derivatives)
-
-    # Filter derivatives that are 4 standard deviations away from the mean
-    threshold = 2 * std_derivative
-    indices = np.where(np.abs(all_derivatives - mean_derivative) >= threshold)[0]
-    filtered_derivatives = all_derivatives[indices] if len(indices) > 0 else np.array([])
-    filtered_times = all_times[indices] if len(indices) > 0 else np.array([])
-    filtered_calcium_values = all_calcium_values[indices] if len(indices) > 0 else np.array([])
-
-    # Debugging outputs
-    print(f"Stim Condition: {stim}")
-    print(f"Total Derivatives: {len(all_derivatives)}")
-    print(f"Filtered Derivatives: {len(filtered_derivatives)}")
+
+def accumulate_derivative_statistics(arrays, stim_conditions=stim_conditions):
+    # One accumulator per condition, folded in session by session from the stacked derivatives
+    lengths = arrays['lengths']
+    derivatives = arrays['stack']['Derivative']
+    session_stims = [record['stimcondition'] for record in arrays['records']]
+    statistics = {stim: DerivativeThresholdAccumulator() for stim in stim_conditions}
+    for i, stim in enumerate(session_stims):
+        if stim in statistics:
+            statistics[stim].update(derivatives[i, :lengths[i]])
+    return statistics
+
+
+def detect_dilation_events(all_derivatives, sigma, statistics=None):
+    # Derivatives at least `sigma` standard deviations away from the mean
+    if statistics is None:
+        statistics = DerivativeThresholdAccumulator().update(all_derivatives)
+    mean_derivative = statistics.mean
+    std_derivative = statistics.std
+    threshold = sigma * std_derivative
+    indices = np.flatnonzero(np.abs(all_derivatives - mean_derivative) >= threshold)
 
     # Find the lowest positive and largest negative derivatives that exceed the threshold
+    filtered_derivatives = all_derivatives[indices]
     positive_derivatives = filtered_derivatives[filtered_derivatives > 0]
     negative_derivatives = filtered_derivatives[filtered_derivatives < 0]
-
-    if len(positive_derivatives) > 0:
-        lowest_positive_derivative = np.min(positive_derivatives)
-    else:
-        lowest_positive_derivative = None
-
-    if len(negative_derivatives) > 0:
-        largest_negative_derivative = np.max(negative_derivatives)
-    else:
-        largest_negative_derivative = None
+    return {
+        'sigma': sigma,
+        'statistics': statistics,
+        'mean': mean_derivative,
+        'std': std_derivative,
+        'indices': indices,
+        'lowest_positive': np.min(positive_derivatives) if len(positive_derivatives) > 0 else None,
+        'largest_negative': np.max(negative_derivatives) if len(negative_derivatives) > 0 else None,
+    }
+
+
+def plot_derivative_analysis(stim, all_derivatives, all_times, all_calcium_values, detection, stim_output_dir):
+    indices = detection['indices']
+    sigma = detection['sigma']
+    filtered_derivatives = all_derivatives[indices]
+    filtered_times = all_times[indices]
+    filtered_calcium_values = all_calcium_values[indices]
 
     # Create plots
     fig, axs = plt.subplots(1, 2, figsize=(14, 7))
     fig.suptitle(f'Derivative Analysis for {stim} - {bindist_file}', fontsize=16)
 
-    # Plot the distribution of all derivative values of Pupil Diameter Ratio
-    axs[0].hist(all_derivatives, bins=30, color='g', alpha=0.7)
+    # Plot the distribution of all derivative values of Pupil Diameter Ratio (bins cover the whole range)
+    histogram = detection['statistics'].histogram
+    axs[0].stairs(histogram.counts, histogram.edges, fill=True, color='g', alpha=0.7)
     axs[0].set_title('Distribution of All Pupil Diameter Ratio Derivatives')
     axs[0].set_xlabel('Pupil Diameter Ratio Derivative')
     axs[0].set_ylabel('Frequency')
@@ -140,7 +110,7 @@ for stim in stim_conditions:
     if len(filtered_derivatives) > 0:
         # Plot the time and calcium value for each filtered derivative
         sc = axs[1].scatter(filtered_times, filtered_calcium_values, c=filtered_derivatives, cmap='viridis', alpha=0.7)
-        axs[1].set_title('Derivatives 2 Std Dev Away from Mean with Time and Calcium Values')
+        axs[1].set_title(f'Derivatives {sigma:g} Std Dev Away from Mean with Time and Calcium Values')
         axs[1].set_xlabel('Time')
         axs[1].set_ylabel('Calcium Value')
         cbar = plt.colorbar(sc, ax=axs[1])
@@ -148,7 +118,7 @@ for stim in stim_conditions:
     else:
         axs[1].text(0.5, 0.5, 'No derivatives exceed the threshold', horizontalalignment='center',
                     verticalalignment='center')
-        axs[1].set_title('No Derivatives 4 Std Dev Away from Mean')
+        axs[1].set_title(f'No Derivatives {sigma:g} Std Dev Away from Mean')
         axs[1].set_xlabel('Time')
         axs[1].set_ylabel('Calcium Value')
 
@@ -158,13 +128,13 @@ for stim in stim_conditions:
 
     # Annotate the lowest positive and largest negative derivatives
     annotation_text = ''
-    if lowest_positive_derivative is not None:
-        annotation_text += f'Lowest Positive Derivative: {lowest_positive_derivative:.4f}\n'
+    if detection['lowest_positive'] is not None:
+        annotation_text += f"Lowest Positive Derivative: {detection['lowest_positive']:.4f}\n"
     else:
         annotation_text += 'Lowest Positive Derivative: None\n'
 
-    if largest_negative_derivative is not None:
-        annotation_text += f'Largest Negative Derivative: {largest_negative_derivative:.4f}'
+    if detection['largest_negative'] is not None:
+        annotation_text += f"Largest Negative Derivative: {detection['largest_negative']:.4f}"
     else:
         annotation_text += 'Largest Negative Derivative: None'
 
@@ -174,10 +144,40 @@ for stim in stim_conditions:
     plt.tight_layout(rect=[0, 0.05, 1, 0.95])
 
     # Create the output directory for the current stim condition if it does not exist
-    stim_output_dir = os.path.join(output_dir, f'd_events_{stim}')
     os.makedirs(stim_output_dir, exist_ok=True)
 
     # Save the figure to a file
     output_file = os.path.join(stim_output_dir, f'{bindist_file}.png')
     plt.savefig(output_file)
     plt.close(fig)
+
+
+def run_detection(arrays, sigma=2, output_dir=output_dir, folder_prefix='d_events_', calcium_key='calcium'):
+    # Runs on the in-memory condition arrays; any sigma can be tried without re-reading the CSVs
+    detections = {}
+    statistics = accumulate_derivative_statistics(arrays)
+    for stim in stim_conditions:
+        condition = arrays['conditions'][stim]
+        all_derivatives = condition['derivative']
+        if len(all_derivatives) == 0:
+            print(f"No Pupil Diameter Ratio data found for any trial in {stim}")
+            continue
+
+        detection = detect_dilation_events(all_derivatives, sigma, statistics[stim])
+        detections[stim] = detection
+
+        # Debugging outputs
+        print(f"Stim Condition: {stim}")
+        print(f"Total Derivatives: {len(all_derivatives)}")
+        print(f"Filtered Derivatives: {len(detection['indices'])}")
+
+        plot_derivative_analysis(stim, all_derivatives, condition['time'], condition[calcium_key], detection,
+                                 os.path.join(output_dir, f'{folder_prefix}{stim}'))
+    return detections
+
+
+if __name__ == "__main__":
+    # Read every session once (cached next to the outputs) and detect at 2 standard deviations
+    arrays = load_condition_arrays(base_dir, days=days, stim_conditions=stim_conditions, bindist_file=bindist_file,
+                                   cache_file=os.path.join(output_dir, 'dilation_event_arrays.npz'))
+    run_detection(arrays, sigma=2)
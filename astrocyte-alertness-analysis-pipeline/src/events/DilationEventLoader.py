@@ -0,0 +1,85 @@
+# DilationEventLoader.py
+# -------------------------------------------------------------------------
+# Origin: Shared loading step factored out of "Dilation events.py" and "Dilation events shifted.py"
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Reads every day/trial/stimcondition 'bindist_2000.csv' once, computes all pupil derivatives in one stacked call and builds per-condition arrays of derivative, time and calcium (one allocation per array). Optionally caches the result to an .npz file that is reused while the inputs are unchanged.
+#
+# Inputs:
+#   - Animal folder with <day>/<trial>/<stimcondition>/bindist_2000.csv
+#
+# Outputs:
+#   - Dict with the stacked session arrays and per-condition flattened arrays
+#
+# File Relationships:
+#   - Shared by DilationEventDetection and DilationEventDetectionShifted.
+#
+# Dependencies:
+#   - numpy, os, sys, json
+# -------------------------------------------------------------------------
+
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from CohortSessionLoader import (STIM_CONDITIONS, TRIALS, discover_cohort_sessions, load_session_stack,
+                                 stacked_gradient)
+
+# Day order used by the detection scripts (controls the order of the aggregated samples)
+DETECTION_DAYS = ['d084', 'd070', 'd014', 'd007', 'd003', 'd001', 'd021', 'd028', 'd056']
+
+
+def _input_signature(records):
+    # Paths, sizes and modification times of every input; a cache is only valid for the same signature
+    return json.dumps([[r['path'], os.path.getsize(r['path']), os.path.getmtime(r['path'])] for r in records])
+
+
+def build_condition_arrays(records, stack, lengths, stim_conditions=STIM_CONDITIONS):
+    # Flatten the valid samples of each condition's sessions, in session order
+    valid = np.arange(stack['time'].shape[1])[None, :] < lengths[:, None]
+    session_stims = np.array([r['stimcondition'] for r in records])
+    conditions = {}
+    for stim in stim_conditions:
+        rows = np.flatnonzero(session_stims == stim)
+        mask = valid[rows]
+        conditions[stim] = {
+            'derivative': stack['Derivative'][rows][mask],
+            'time': stack['time'][rows][mask],
+            'calcium': stack['calcium'][rows][mask],
+            'session': np.repeat(rows, lengths[rows]),
+            'sample': np.concatenate([np.arange(n) for n in lengths[rows]]) if rows.size else np.arange(0),
+        }
+    return conditions
+
+
+def load_condition_arrays(base_dir, days=DETECTION_DAYS, trials=TRIALS, stim_conditions=STIM_CONDITIONS,
+                          bindist_file='bindist_2000.csv', cache_file=None):
+    records = discover_cohort_sessions(base_dir, days=days, trials=trials, stim_conditions=stim_conditions,
+                                       filename=bindist_file, report_missing=True)
+    signature = _input_signature(records)
+
+    if cache_file and os.path.exists(cache_file):
+        # Closed on return: the arrays read from the archive are in memory, the file handle is not kept open
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if str(cached['signature']) == signature:
+                keep = cached['kept'].astype(bool)
+                records = [record for record, k in zip(records, keep) if k]
+                lengths = cached['lengths']
+                stack = {key: cached[key] for key in ('time', 'Pupil Diameter Ratio', 'calcium', 'Derivative')}
+                return {'records': records, 'lengths': lengths, 'stack': stack,
+                        'conditions': build_condition_arrays(records, stack, lengths, stim_conditions)}
+
+    kept, stack, lengths = load_session_stack(records)
+    # One derivative computation for the whole cohort
+    stack['Derivative'] = stacked_gradient(stack['Pupil Diameter Ratio'], stack['time'], lengths)
+
+    if cache_file:
+        kept_paths = {record['path'] for record in kept}
+        np.savez(cache_file, signature=np.array(signature), lengths=lengths,
+                 kept=np.array([record['path'] in kept_paths for record in records]), **stack)
+
+    return {'records': kept, 'lengths': lengths, 'stack': stack,
+            'conditions': build_condition_arrays(kept, stack, lengths, stim_conditions)}
@@ -1,22 +1,24 @@
 # DilationLagComputation.py
 # -------------------------------------------------------------------------
 # Origin: "Dilation Lag.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Computes average time lag between calcium and pupil events across approved trials, providing mean and standard deviation summaries.
+#   - The curated filenames become a keyed frame matched against time_differences.csv with one merge on (Day, Trial, StimCondition, Index); with return_grouped=True the same call also returns count/mean/std per condition and subset type (lag_summary).
+#   - calculate_avg_std_from_store reads the curated events straight from the EventStore instead of the folder. The 'good' folder is imported into the store only while the store has no curated events, so curation done in the store is never overwritten.
 #
 # Inputs:
-#   - Folder of approved event CSVs
+#   - Folder of approved event CSVs, or the event store (events.sqlite) with curation flags
 #
 # Outputs:
-#   - Lag statistics and plots
+#   - Lag statistics (overall and per condition and subset type)
 #
 # File Relationships:
 #   - Summarizes results post-event alignment.
 #
 # Dependencies:
-#   - pandas, numpy, os, re
+#   - pandas, numpy, os, re, EventStore
 # -------------------------------------------------------------------------
 
 import pandas as pd
@@ -24,6 +26,13 @@ import numpy as np
 import os
 import re
 
+from EventStore import EventStore
+
+# Columns identifying one event in time_differences.csv
+KEY_COLUMNS = ['Day', 'Trial', 'StimCondition', 'Index']
+GROUP_COLUMNS = ('StimCondition', 'SubsetType')
+
+
 def extract_info_from_filename(filename):
     match = re.search(r'(d\d+)_trial_(\d+)_stimcondition_(\d+)_index_(\d+)', filename)
     if match:
@@ -34,15 +43,23 @@ def extract_info_from_filename(filename):
         return day, trial, stimcondition, index
     return None
 
-def calculate_avg_std(csv_file, folder_path):
-    # Extract the relevant parts from filenames in the folder
+
+def curated_keys(folder_path):
+    # One row per curated event file, keyed like time_differences.csv; a key listed twice counts once
     file_info = []
     for filename in os.listdir(folder_path):
         info = extract_info_from_filename(filename)
         if info:
             file_info.append(info)
+    return pd.DataFrame(file_info, columns=KEY_COLUMNS).drop_duplicates(ignore_index=True)
 
-    print(f"Extracted information from filenames: {file_info}")
+
+def calculate_avg_std(csv_file, folder_path, group_by=GROUP_COLUMNS, return_grouped=False):
+    # (average, std) of the curated lags; return_grouped=True adds the per condition and subset type table
+    # Extract the relevant parts from filenames in the folder
+    keys = curated_keys(folder_path)
+
+    print(f"Extracted information from {len(keys)} filenames")
 
     # Read the CSV file into a pandas DataFrame
     df = pd.read_csv(csv_file)
@@ -56,38 +73,66 @@ def calculate_avg_std(csv_file, folder_path):
     print("First few rows of the CSV DataFrame:")
     print(df.head())
 
-    # Filter the DataFrame based on the extracted information
-    filtered_df = pd.DataFrame()
-    for day, trial, stimcondition, index in file_info:
-        temp_df = df[(df['Day'] == day) &
-                     (df['Trial'] == trial) &
-                     (df['StimCondition'] == stimcondition) &
-                     (df['Index'] == index)]
-        if not temp_df.empty:
-            filtered_df = pd.concat([filtered_df, temp_df])
-
-    print(f"Filtered DataFrame:\n{filtered_df}")
+    # One keyed merge instead of a mask scan per curated file
+    filtered_df = df.merge(keys, on=KEY_COLUMNS, how='inner')
 
-    # Extract the TimeDifference column from the filtered DataFrame
-    time_differences = filtered_df['TimeDifference']
+    print(f"Filtered DataFrame: {len(filtered_df)} matching events")
+    print(filtered_df.head())
 
     # Ensure TimeDifference column is numeric
-    time_differences = pd.to_numeric(time_differences, errors='coerce')
-    time_differences = time_differences.dropna()
+    filtered_df['TimeDifference'] = pd.to_numeric(filtered_df['TimeDifference'], errors='coerce')
+    filtered_df = filtered_df.dropna(subset=['TimeDifference'])
+    time_differences = filtered_df['TimeDifference']
 
     if time_differences.empty:
         raise ValueError("No matching time differences found after filtering and converting to numeric values")
 
+    average, std_deviation, grouped = lag_summary(filtered_df, group_by)
+    return (average, std_deviation, grouped) if return_grouped else (average, std_deviation)
+
+
+def lag_summary(filtered_df, group_by=GROUP_COLUMNS):
     # Calculate average and standard deviation
+    time_differences = filtered_df['TimeDifference']
     average = np.mean(time_differences)
     std_deviation = np.std(time_differences)
 
-    return average, std_deviation
+    # Same statistics per condition and subset type (SubsetType only exists in newer time_differences.csv files)
+    group_by = [col for col in group_by if col in filtered_df.columns]
+    grouped = filtered_df.groupby(group_by)['TimeDifference'].agg(
+        count='count', mean='mean', std=lambda values: values.std(ddof=0)).reset_index()
+
+    return average, std_deviation, grouped
+
+
+def calculate_avg_std_from_store(store_path, group_by=GROUP_COLUMNS, return_grouped=False, **query):
+    # Same statistics from the event store: curated events by default, narrowed by any EventStore.query argument
+    query.setdefault('curated', True)
+    with EventStore(store_path) as store:
+        selected = store.query(**query)
+    filtered_df = selected.rename(columns={'stimcondition': 'StimCondition', 'subset': 'SubsetType',
+                                           'time_difference': 'TimeDifference'})
+    filtered_df = filtered_df.dropna(subset=['TimeDifference'])
+    if filtered_df.empty:
+        raise ValueError("No curated events with a time difference in the event store")
+    average, std_deviation, grouped = lag_summary(filtered_df, group_by)
+    return (average, std_deviation, grouped) if return_grouped else (average, std_deviation)
 
 # Example usage:
 if __name__ == "__main__":
     csv_file = r"C:\Users\ASH213\Documents\Correlated\890\dilation+constriction_events\time_differences.csv"  # Replace with your CSV file path
     folder_path = r"C:\Users\ASH213\Documents\Correlated\890\dilation+constriction_events\good"  # Replace with your folder path
-    avg, std = calculate_avg_std(csv_file, folder_path)
+    avg, std, grouped = calculate_avg_std(csv_file, folder_path, return_grouped=True)
     print(f"Average TimeDifference: {avg}")
     print(f"Standard Deviation of TimeDifference: {std}")
+    print(f"TimeDifference by condition and subset type:\n{grouped}")
+
+    # With the event store, import the curation folder once (only into a store without any curated events, so
+    # flags set later with EventStore.set_curated are kept) and query from then on
+    store_path = r"C:\Users\ASH213\Documents\Correlated\890\dilation+constriction_events\events.sqlite"
+    if os.path.exists(store_path):
+        with EventStore(store_path) as store:
+            if store.query(curated=True).empty:
+                print(f"Curated events imported into the store: {store.import_curation(folder_path, reset=False)}")
+        avg, std = calculate_avg_std_from_store(store_path)
+        print(f"Store - Average TimeDifference: {avg}, Standard Deviation: {std}")
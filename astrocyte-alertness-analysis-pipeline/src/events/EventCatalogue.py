@@ -0,0 +1,63 @@
+# EventCatalogue.py
+# -------------------------------------------------------------------------
+# Origin: New index of the per-event files written by EventTimeAlignmentPlotting
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Scans an events folder once and parses every event filename once into structured fields (day, trial, stimcondition, subset type, onset index), so group-bys run on a table instead of repeated substring tests over the path list.
+#   - Parses both the aligned CSVs ('d084_trial_1_stimcondition_1_stim_index_350.csv') and the event figures ('d084_trial_1_stimcondition_1_index_350.png', no subset type). Anything else in the folder (time_differences.csv, rasters, sheets) is ignored.
+#
+# Inputs:
+#   - Folder of event CSVs / PNGs (from EventTimeAlignmentPlotting)
+#
+# Outputs:
+#   - Catalogue DataFrame: path, day, trial, stimcondition, subset, index
+#
+# File Relationships:
+#   - Used by EventResponseAveraging and by EventStore to import curation folders.
+#
+# Dependencies:
+#   - pandas, os, re
+# -------------------------------------------------------------------------
+
+import os
+import re
+
+import pandas as pd
+
+EVENT_FILENAME = re.compile(
+    r'^(?P<day>d\d+)_(?P<trial>trial_\d+)_(?P<stimcondition>stimcondition_\d+)'
+    r'(?:_(?P<subset>stim|baseline))?_index_(?P<index>\d+)\.(?P<extension>csv|png)$')
+
+CATALOGUE_COLUMNS = ['path', 'day', 'trial', 'stimcondition', 'subset', 'index']
+
+# Conditions with no stimulation; all their events count as baseline
+BASELINE_CONDITIONS = ('stimcondition_5',)
+
+
+def parse_event_filename(filename):
+    # Fields of one event filename, or None if it is not an event file
+    match = EVENT_FILENAME.match(os.path.basename(filename))
+    if match is None:
+        return None
+    fields = match.groupdict()
+    fields['index'] = int(fields['index'])
+    return fields
+
+
+def build_catalogue(directory, extension='csv'):
+    # One directory scan, one parse per filename; extension=None keeps CSVs and PNGs
+    rows = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            fields = parse_event_filename(entry.name)
+            if fields is not None and extension in (None, fields['extension']):
+                rows.append({'path': entry.path, **fields})
+    catalogue = pd.DataFrame(rows, columns=CATALOGUE_COLUMNS)
+    return catalogue.sort_values(['day', 'trial', 'stimcondition', 'index'], ignore_index=True)
+
+
+def averaging_group(catalogue, baseline_conditions=BASELINE_CONDITIONS):
+    # 'baseline' for baseline events and every event of a no-stim condition, otherwise the stimcondition
+    baseline = (catalogue['subset'] == 'baseline') | catalogue['stimcondition'].isin(baseline_conditions)
+    return catalogue['stimcondition'].where(~baseline, 'baseline')
@@ -0,0 +1,200 @@
+# EventClipExtractor.py
+# -------------------------------------------------------------------------
+# Origin: New batch review tool for detected dilation events
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Cuts a short video clip around every event of an EventTimeAlignmentPlotting event table (time_differences.csv, or events.sqlite for filtered / curated selections) from the preprocessed pupil videos, so events can be reviewed without scrubbing whole sessions in DualVideoPlayer.
+#   - A clip spans the event's peri-event window (WINDOW_BEFORE samples before to WINDOW_AFTER samples after the onset, as in PeriEventEngine). Session times are mapped onto the video timeline by scaling the session length to the video duration, matching the uniform retiming done by PupilEventVideoPreparation.
+#   - Each cut starts ffmpeg at the keyframe at or before the clip (from the video's VideoKeyframeIndex) and trims the rest, so only one GOP is decoded before the clip and the cut is frame-accurate.
+#   - Videos are processed in parallel (one job per session video, the work runs in ffmpeg subprocesses); with tile=True each clip is placed side by side with the same window of the session's EventGraphAnimation video in one review clip.
+#
+# Inputs:
+#   - Event table (time_differences.csv or events.sqlite) and the session CSVs (bindist_2040.csv) for the time column
+#   - Preprocessed pupil videos, found with a path pattern ('{day}', '{trial}', '{stimcondition}' placeholders)
+#   - Optional EventGraphAnimation videos ('<day>/animations/animation_<trial>_<stimcondition>.mp4')
+#
+# Outputs:
+#   - '<day>_<trial>_<stimcondition>_<subset>_index_<onset>.mp4' per event in the clip folder
+#
+# File Relationships:
+#   - Reads the outputs of EventTimeAlignmentPlotting (EventStore) and EventGraphAnimation; uses VideoKeyframeIndex (utils).
+#
+# Usage:
+#   python EventClipExtractor.py EVENTS_FILE MAIN_DIRECTORY OUTPUT_DIRECTORY
+#   python EventClipExtractor.py events.sqlite C:\...\890 C:\...\event_clips --curated --tile --workers 8
+#
+# Dependencies:
+#   - pandas, numpy, argparse, os, subprocess, sys, concurrent.futures, matplotlib (rcParams for the ffmpeg path), EventStore, EventGraphAnimation, PeriEventEngine, VideoKeyframeIndex, ffmpeg and ffprobe executables
+# -------------------------------------------------------------------------
+
+import argparse
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from EventGraphAnimation import FPS, FRAME_REPEAT
+from EventStore import EVENT_COLUMNS, EventStore
+from PeriEventEngine import WINDOW_AFTER, WINDOW_BEFORE
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from VideoKeyframeIndex import VideoKeyframeIndex, ffmpeg_executables
+
+# Relative to the animal folder; PupilEventVideoPreparation writes the retimed pupil videos to '<day>/dual video playing'
+PUPIL_VIDEO_PATTERN = os.path.join('{day}', 'dual video playing', 'f_{trial}_{stimcondition}.mp4')
+# EventGraphAnimation.animate_directory output
+ANIMATION_PATTERN = os.path.join('{day}', 'animations', 'animation_{trial}_{stimcondition}.mp4')
+
+SESSION_KEYS = ['Day', 'Trial', 'StimCondition']
+CLIP_HEIGHT = 480
+
+
+def load_event_table(events_file, **query):
+    # time_differences.csv as is; an EventStore is queried (e.g. curated=True) and renamed to the same columns
+    if os.path.splitext(events_file)[1] == '.csv':
+        return pd.read_csv(events_file)
+    with EventStore(events_file) as store:
+        events = store.query(**query)
+    return events.rename(columns={column: name for name, column in EVENT_COLUMNS.items()})
+
+
+def clip_filename(event):
+    return f"{event['Day']}_{event['Trial']}_{event['StimCondition']}_{event['SubsetType']}_index_{event['Index']}.mp4"
+
+
+def clip_windows(times, onsets, before=WINDOW_BEFORE, after=WINDOW_AFTER):
+    # Session seconds of each event's peri-event window [first row, row after the last]
+    times = np.asarray(times, dtype=float)
+    step = np.median(np.diff(times)) if len(times) > 1 else 1.0
+    onsets = np.asarray(onsets, dtype=int)
+    start = np.maximum(onsets - before, 0)
+    end = np.minimum(onsets + after, len(times))
+    return times[start] - times[0], times[end - 1] - times[0] + step, len(times) * step
+
+
+def _trim(input_number, offset, duration, height):
+    # Drop the frames between the keyframe and the clip start, restart timestamps, scale to a common height
+    return (f'[{input_number}:v]trim=start={offset:.6f}:duration={duration:.6f},setpts=PTS-STARTPTS,'
+            f'scale=-2:{height}')
+
+
+def clip_command(ffmpeg_path, output_path, sources, height=CLIP_HEIGHT, codec='h264'):
+    # sources: (video_path, keyframe_time, clip_start, duration) per input; several inputs are stacked left to right
+    args = [ffmpeg_path, '-y', '-loglevel', 'error']
+    for video_path, keyframe_time, _, _ in sources:
+        # Input seek to a keyframe: ffmpeg starts decoding right there
+        args += ['-ss', f'{keyframe_time:.6f}', '-i', video_path]
+    filters = [_trim(i, start - keyframe_time, duration, height) + f'[v{i}]'
+               for i, (_, keyframe_time, start, duration) in enumerate(sources)]
+    if len(sources) > 1:
+        filters.append(''.join(f'[v{i}]' for i in range(len(sources))) + f'hstack=inputs={len(sources)}[v]')
+    else:
+        filters[0] = filters[0][:-len('[v0]')] + '[v]'
+    return args + ['-filter_complex', ';'.join(filters), '-map', '[v]', '-an',
+                   '-vcodec', codec, '-pix_fmt', 'yuv420p', output_path]
+
+
+def _source(video_path, index, start, end):
+    keyframe = index.keyframe_at_or_before(index.frame_at_time(start))
+    return video_path, index.frame_time(keyframe), start, end - start
+
+
+def extract_session_clips(job):
+    # All clips of one session video; returns one status row per event
+    ffmpeg_path = job['ffmpeg_path']
+    pupil_index = VideoKeyframeIndex.load(job['video'], ffmpeg_path=ffmpeg_path)
+    animation_index = None
+    if job['animation'] is not None:
+        animation_index = VideoKeyframeIndex.load(job['animation'], ffmpeg_path=ffmpeg_path)
+
+    # Session time -> pupil video time: the whole session spans the whole (retimed) video
+    scale = pupil_index.duration / job['session_duration']
+    rows = []
+    for event, start, end in zip(job['events'], job['starts'], job['ends']):
+        output_path = os.path.join(job['output_directory'], clip_filename(event))
+        row = {**event, 'clip': output_path}
+        if os.path.exists(output_path) and not job['overwrite']:
+            rows.append({**row, 'status': 'exists'})
+            continue
+        sources = [_source(job['video'], pupil_index, start * scale, end * scale)]
+        if animation_index is not None:
+            # EventGraphAnimation shows session sample n at n * FRAME_REPEAT / FPS seconds
+            sample_seconds = FRAME_REPEAT / FPS / job['sample_step']
+            sources.append(_source(job['animation'], animation_index, start * sample_seconds, end * sample_seconds))
+        command = clip_command(ffmpeg_path, output_path, sources, job['height'])
+        result = subprocess.run(command, capture_output=True, text=True)
+        rows.append({**row, 'status': 'ok' if result.returncode == 0 else result.stderr.strip()[-300:]})
+    return rows
+
+
+def clip_jobs(events, main_directory, output_directory, video_pattern=PUPIL_VIDEO_PATTERN, tile=False,
+              animation_pattern=ANIMATION_PATTERN, bindist_file='bindist_2040.csv', ffmpeg_path=None,
+              height=CLIP_HEIGHT, overwrite=False):
+    # One job per session video holding the clip windows of all its events
+    ffmpeg_path, _ = ffmpeg_executables(ffmpeg_path)
+    jobs = []
+    for (day, trial, stim), session_events in events.groupby(SESSION_KEYS, sort=True):
+        names = {'day': day, 'trial': trial, 'stimcondition': stim}
+        video = os.path.join(main_directory, video_pattern.format(**names))
+        csv_file = os.path.join(main_directory, day, trial, stim, bindist_file)
+        animation = os.path.join(main_directory, animation_pattern.format(**names)) if tile else None
+        missing = [path for path in (video, csv_file, animation) if path is not None and not os.path.exists(path)]
+        if missing:
+            print(f"Skipping {day} {trial} {stim}, file not found: {missing[0]}")
+            continue
+
+        times = pd.read_csv(csv_file, usecols=['time'])['time'].to_numpy()
+        starts, ends, session_duration = clip_windows(times, session_events['Index'])
+        jobs.append({'video': video, 'animation': animation, 'output_directory': output_directory,
+                     'events': session_events.to_dict('records'), 'starts': starts, 'ends': ends,
+                     'session_duration': session_duration, 'sample_step': session_duration / len(times),
+                     'ffmpeg_path': ffmpeg_path, 'height': height, 'overwrite': overwrite})
+    return jobs
+
+
+def extract_event_clips(events, main_directory, output_directory, n_workers=None, **options):
+    # Session videos run concurrently; each job spends its time waiting on ffmpeg, so threads are enough
+    os.makedirs(output_directory, exist_ok=True)
+    jobs = clip_jobs(events, main_directory, output_directory, **options)
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+        rows = [row for job_rows in executor.map(extract_session_clips, jobs) for row in job_rows]
+    clips = pd.DataFrame(rows)
+    if len(clips):
+        print(f"Wrote {(clips['status'] == 'ok').sum()} of {len(clips)} event clips to {output_directory}")
+    return clips
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cut a video clip around every detected event.")
+    parser.add_argument('events_file', help="time_differences.csv or events.sqlite from EventTimeAlignmentPlotting")
+    parser.add_argument('main_directory', help="Animal folder with <day>/<trial>/<stimcondition>/ sessions")
+    parser.add_argument('output_directory')
+    parser.add_argument('--video-pattern', default=PUPIL_VIDEO_PATTERN,
+                        help="Pupil video path relative to the animal folder, with {day} {trial} {stimcondition}")
+    parser.add_argument('--tile', action='store_true', help="Stack each clip with its EventGraphAnimation segment")
+    parser.add_argument('--animation-pattern', default=ANIMATION_PATTERN)
+    parser.add_argument('--stimcondition', nargs='+', default=None, help="Event store only")
+    parser.add_argument('--curated', action='store_true', help="Event store only: curated events")
+    parser.add_argument('--max-abs-lag', type=float, default=None, help="Event store only")
+    parser.add_argument('--height', type=int, default=CLIP_HEIGHT)
+    parser.add_argument('--workers', type=int, default=None, help="Defaults to all cores")
+    parser.add_argument('--ffmpeg', default=None, help="ffmpeg executable, if it is not on PATH (ffprobe next to it)")
+    parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--results-file', default=None)
+    args = parser.parse_args()
+
+    query = {}
+    if os.path.splitext(args.events_file)[1] != '.csv':
+        query = {'stimcondition': args.stimcondition, 'curated': True if args.curated else None,
+                 'max_abs_lag': args.max_abs_lag}
+    events = load_event_table(args.events_file, **query)
+    clips = extract_event_clips(events, args.main_directory, args.output_directory, n_workers=args.workers,
+                                video_pattern=args.video_pattern, tile=args.tile,
+                                animation_pattern=args.animation_pattern, ffmpeg_path=args.ffmpeg,
+                                height=args.height, overwrite=args.overwrite)
+    if args.results_file:
+        clips.to_csv(args.results_file, index=False)
@@ -1,10 +1,14 @@
 # EventGraphAnimation.py
 # -------------------------------------------------------------------------
 # Origin: "Pupil event graph animation.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Animates pupil ratio, calcium, and pupil derivative traces over time and highlights threshold crossings.
+#   - Threshold markers are drawn as one vlines collection per axis and baked into the static background; each unique data frame is sent to ffmpeg once at 10 fps and ffmpeg repeats it to the 30 fps output (the original rendered every frame three times). Sessions render in parallel processes.
+#   - 'raw' mode (default): RawFrameWriter.TraceCompositor redraws only the band of pixel columns the newly added samples touch and the raw RGB frame is piped to ffmpeg. Frames match 'fast' to within one intensity level on a few dozen pixels.
+#   - 'fast' mode: the three growing traces are blitted onto the cached background and the Agg buffer is fed to matplotlib's FFMpegWriter.
+#   - 'classic' keeps the original FuncAnimation path (one full figure draw per frame).
 #
 # Inputs:
 #   - Event detection CSV (e.g., bindist_2040.csv)
@@ -14,123 +18,239 @@
 #
 # File Relationships:
 #   - Uses EventThresholdDetectionNormalized outputs.
+#   - Writer speed is compared by utils/AnimationWriterBenchmark.
 #
 # Dependencies:
-#   - matplotlib.animation, pandas, numpy, os, matplotlib.pyplot
+#   - matplotlib.animation, pandas, numpy, os, concurrent.futures, matplotlib (pyplot for 'classic', Agg canvas otherwise), EventLabeler, RawFrameWriter
 # -------------------------------------------------------------------------
 
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib.animation import FFMpegWriter
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 from matplotlib.animation import FuncAnimation
 
+from EventLabeler import threshold_mask
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from RawFrameWriter import RawFrameWriter, TraceCompositor
+
 # Set the path to the ffmpeg executable
 os.environ["IMAGEIO_FFMPEG_EXE"] = r"C:\Users\ASH213\Documents\FFmpeg\bin"
 
 # Base directory containing trials and stimconditions
 base_dir = r"C:\Users\ASH213\Documents\Correlated\890\d084"
 
-# Create the "animations" folder if it doesn't exist
-animations_folder = os.path.join(base_dir, "animations")
-os.makedirs(animations_folder, exist_ok=True)
-
-# Traverse through each trial and stimcondition directory
-for trial_dir in sorted(os.listdir(base_dir)):
-    trial_path = os.path.join(base_dir, trial_dir)
-    if os.path.isdir(trial_path):
-        for stimcondition_dir in sorted(os.listdir(trial_path)):
-            stimcondition_path = os.path.join(trial_path, stimcondition_dir)
-            if os.path.isdir(stimcondition_path):
+required_columns = ['Pupil Diameter Ratio', 'time', 'calcium', 'Pupil Diameter Ratio Derivative', 'threshold']
+
+# 3600 output frames at 30 fps, one new sample every 3 frames
+FPS = 30
+FRAME_REPEAT = 3
+TOTAL_FRAMES = 3600
+
+RENDER_MODES = ('raw', 'fast', 'classic')
+
+TRACE_COLUMNS = ('Pupil Diameter Ratio', 'calcium', 'Pupil Diameter Ratio Derivative')
+
+
+class BufferFFMpegWriter(FFMpegWriter):
+    """FFMpegWriter fed with an already drawn Agg buffer instead of a savefig per frame."""
+
+    def grab_buffer(self, buffer):
+        self._proc.stdin.write(buffer)
+
+
+def setup_axes(fig, df, fast=True):
+    # The three trace panels, their (empty) animated lines and the threshold markers
+    pupil_diameter_ratio = df['Pupil Diameter Ratio']
+    calcium = df['calcium']
+    pupil_diameter_ratio_derivative = df['Pupil Diameter Ratio Derivative']
+    ax1, ax2, ax3 = fig.subplots(3, 1)
+
+    # Set up the first plot for Pupil Diameter Ratio
+    ax1.set_xlim([0, len(pupil_diameter_ratio) - 1])
+    ax1.set_ylim([0, 1])
+    animated_plot_pupil, = ax1.plot([], [], lw=2, label='Pupil Diameter Ratio', color='blue', animated=fast)
+    ax1.set_xlabel('Index')
+    ax1.set_ylabel('Pupil Diameter Ratio', color='blue')
+    ax1.tick_params(axis='y', labelcolor='blue')
+
+    # Set up the second plot for calcium
+    abs_max_calcium = max(abs(calcium.min()), abs(calcium.max()))
+    y_lim_calcium = [-0.05, 0.05] if abs_max_calcium <= 0.05 else [-abs_max_calcium, abs_max_calcium]
+    ax2.set_xlim([0, len(calcium) - 1])
+    ax2.set_ylim(y_lim_calcium)
+    animated_plot_calcium, = ax2.plot([], [], lw=2, label='Calcium', color='red', animated=fast)
+    ax2.set_xlabel('Index')
+    ax2.set_ylabel('Calcium', color='red')
+    ax2.tick_params(axis='y', labelcolor='red')
+
+    # Set up the third plot for Pupil Diameter Ratio Derivative
+    abs_max_derivative = max(abs(pupil_diameter_ratio_derivative.min()), abs(pupil_diameter_ratio_derivative.max()))
+    y_lim_derivative = [-0.5, 0.5] if abs_max_derivative <= 0.5 else [-abs_max_derivative, abs_max_derivative]
+    ax3.set_xlim([0, len(pupil_diameter_ratio_derivative) - 1])
+    ax3.set_ylim(y_lim_derivative)
+    animated_plot_derivative, = ax3.plot([], [], lw=2, label='Pupil Diameter Ratio Derivative', color='green',
+                                         animated=fast)
+    ax3.set_xlabel('Index')
+    ax3.set_ylabel('Pupil Diameter Ratio Derivative', color='green')
+    ax3.tick_params(axis='y', labelcolor='green')
+
+    # Identify indices where threshold is set (boolean or legacy 'yes'/'no' column)
+    threshold_indices = df.index[threshold_mask(df['threshold'])].tolist()
+
+    # Add threshold lines to all plots without adding them to the legend
+    for ax in (ax1, ax2, ax3):
+        if fast:
+            # One collection per axis instead of one artist per crossing
+            ax.vlines(threshold_indices, 0, 1, transform=ax.get_xaxis_transform(), colors='red', linestyles='--',
+                      lw=0.5, label='_nolegend_')
+        else:
+            for idx in threshold_indices:
+                ax.axvline(x=idx, color='red', linestyle='--', lw=0.5, label='_nolegend_')
+
+    # Adding legends
+    ax1.legend(loc='upper right')
+    ax2.legend(loc='upper right')
+    ax3.legend(loc='upper right')
+    return animated_plot_pupil, animated_plot_calcium, animated_plot_derivative
+
+
+def animate_classic(df, save_path, total_frames=TOTAL_FRAMES):
+    # Original path: FuncAnimation redraws the whole figure for each of the 3600 frames
+    pupil_diameter_ratio = df['Pupil Diameter Ratio']
+    calcium = df['calcium']
+    pupil_diameter_ratio_derivative = df['Pupil Diameter Ratio Derivative']
+
+    # Create a figure and axes for the three separate plots
+    fig = plt.figure(figsize=(10, 8))
+    animated_plot_pupil, animated_plot_calcium, animated_plot_derivative = setup_axes(fig, df, fast=False)
+
+    def init():
+        animated_plot_pupil.set_data([], [])
+        animated_plot_calcium.set_data([], [])
+        animated_plot_derivative.set_data([], [])
+        return animated_plot_pupil, animated_plot_calcium, animated_plot_derivative
+
+    def update_data(frame):
+        frame //= FRAME_REPEAT  # Add every 3 frames
+        max_length = len(pupil_diameter_ratio)
+        if frame > max_length:
+            frame = max_length
+        x = range(frame)
+        y_pupil = pupil_diameter_ratio[:frame]
+        y_calcium = calcium[:frame]
+        y_derivative = pupil_diameter_ratio_derivative[:frame]
+        animated_plot_pupil.set_data(x, y_pupil)
+        animated_plot_calcium.set_data(x, y_calcium)
+        animated_plot_derivative.set_data(x, y_derivative)
+        return animated_plot_pupil, animated_plot_calcium, animated_plot_derivative
+
+    animation = FuncAnimation(fig, update_data, frames=total_frames, init_func=init, interval=1000/FPS, blit=True)
+
+    writer = FFMpegWriter(fps=FPS, metadata=dict(artist='Me'), bitrate=1800)
+    animation.save(save_path, writer=writer)
+
+    # Close the plot to free memory
+    plt.close(fig)
+
+
+def animate_fast(df, save_path, dpi=100, total_frames=TOTAL_FRAMES):
+    # Cached background + blitted traces; one ffmpeg frame per unique data frame, repeated by ffmpeg
+    fig = Figure(figsize=(10, 8), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    lines = setup_axes(fig, df, fast=True)
+    traces = [df[column].to_numpy(dtype=float) for column in TRACE_COLUMNS]
+    x = np.arange(len(df))
+
+    writer = BufferFFMpegWriter(fps=FPS / FRAME_REPEAT, metadata=dict(artist='Me'), bitrate=1800,
+                                extra_args=['-pix_fmt', 'yuv420p', '-r', str(FPS)])
+    with writer.saving(fig, save_path, dpi=dpi):
+        # Static parts (axes, labels, legends, threshold markers) are rasterized once
+        canvas.draw()
+        background = canvas.copy_from_bbox(fig.bbox)
+        shown = None
+        for frame in range(total_frames // FRAME_REPEAT):
+            frame = min(frame, len(df))
+            if frame != shown:
+                canvas.restore_region(background)
+                for line, trace in zip(lines, traces):
+                    line.set_data(x[:frame], trace[:frame])
+                    line.axes.draw_artist(line)
+                shown = frame
+            writer.grab_buffer(canvas.buffer_rgba())
+    return save_path
+
+
+def animate_raw(df, save_path, dpi=100, total_frames=TOTAL_FRAMES):
+    # Static figure rasterized once, only new trace segments drawn per frame, raw RGB piped to ffmpeg
+    fig = Figure(figsize=(10, 8), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    lines = setup_axes(fig, df, fast=True)
+    compositor = TraceCompositor(canvas, lines, np.arange(len(df)),
+                                 [df[column].to_numpy(dtype=float) for column in TRACE_COLUMNS])
+    width, height = compositor.size
+    with RawFrameWriter(save_path, width, height, fps=FPS / FRAME_REPEAT, output_fps=FPS, bitrate=1800,
+                        extra_args=['-metadata', 'artist=Me']) as writer:
+        for frame in range(total_frames // FRAME_REPEAT):
+            writer.write(compositor.advance(min(frame, len(df))).frame())
+    return save_path
+
+
+def animate_session(csv_file, save_path, mode='raw', total_frames=TOTAL_FRAMES):
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode '{mode}', expected one of {RENDER_MODES}")
+    df = pd.read_csv(csv_file)
+
+    # Check if the required columns are present in the DataFrame
+    if not all(column in df.columns for column in required_columns):
+        print(f"Required columns are not present in the CSV file: {csv_file}")
+        return None
+    if mode == 'raw':
+        return animate_raw(df, save_path, total_frames=total_frames)
+    if mode == 'fast':
+        return animate_fast(df, save_path, total_frames=total_frames)
+    animate_classic(df, save_path, total_frames=total_frames)
+    return save_path
+
+
+def _animate_job(job):
+    return animate_session(*job)
+
+
+def animation_jobs(base_dir, animations_folder, mode='raw', bindist_file='bindist_2040.csv'):
+    # Traverse through each trial and stimcondition directory
+    jobs = []
+    for trial_dir in sorted(os.listdir(base_dir)):
+        trial_path = os.path.join(base_dir, trial_dir)
+        if os.path.isdir(trial_path):
+            for stimcondition_dir in sorted(os.listdir(trial_path)):
+                stimcondition_path = os.path.join(trial_path, stimcondition_dir)
                 # Look for bindist_2040.csv in each stimcondition directory
-                csv_file = os.path.join(stimcondition_path, "bindist_2040.csv")
-                if os.path.isfile(csv_file):
-                    df = pd.read_csv(csv_file)
-
-                    # Check if the required columns are present in the DataFrame
-                    required_columns = ['Pupil Diameter Ratio', 'time', 'calcium', 'Pupil Diameter Ratio Derivative', 'threshold']
-                    if all(column in df.columns for column in required_columns):
-                        pupil_diameter_ratio = df['Pupil Diameter Ratio']
-                        calcium = df['calcium']
-                        pupil_diameter_ratio_derivative = df['Pupil Diameter Ratio Derivative']
-                        threshold = df['threshold']
-
-                        # Create a figure and axes for the three separate plots
-                        fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(10, 8))
-
-                        # Set up the first plot for Pupil Diameter Ratio
-                        ax1.set_xlim([0, len(pupil_diameter_ratio) - 1])
-                        ax1.set_ylim([0, 1])
-                        animated_plot_pupil, = ax1.plot([], [], lw=2, label='Pupil Diameter Ratio', color='blue')
-                        ax1.set_xlabel('Index')
-                        ax1.set_ylabel('Pupil Diameter Ratio', color='blue')
-                        ax1.tick_params(axis='y', labelcolor='blue')
-
-                        # Set up the second plot for calcium
-                        abs_max_calcium = max(abs(calcium.min()), abs(calcium.max()))
-                        y_lim_calcium = [-0.05, 0.05] if abs_max_calcium <= 0.05 else [-abs_max_calcium, abs_max_calcium]
-                        ax2.set_xlim([0, len(calcium) - 1])
-                        ax2.set_ylim(y_lim_calcium)
-                        animated_plot_calcium, = ax2.plot([], [], lw=2, label='Calcium', color='red')
-                        ax2.set_xlabel('Index')
-                        ax2.set_ylabel('Calcium', color='red')
-                        ax2.tick_params(axis='y', labelcolor='red')
-
-                        # Set up the third plot for Pupil Diameter Ratio Derivative
-                        abs_max_derivative = max(abs(pupil_diameter_ratio_derivative.min()), abs(pupil_diameter_ratio_derivative.max()))
-                        y_lim_derivative = [-0.5, 0.5] if abs_max_derivative <= 0.5 else [-abs_max_derivative, abs_max_derivative]
-                        ax3.set_xlim([0, len(pupil_diameter_ratio_derivative) - 1])
-                        ax3.set_ylim(y_lim_derivative)
-                        animated_plot_derivative, = ax3.plot([], [], lw=2, label='Pupil Diameter Ratio Derivative', color='green')
-                        ax3.set_xlabel('Index')
-                        ax3.set_ylabel('Pupil Diameter Ratio Derivative', color='green')
-                        ax3.tick_params(axis='y', labelcolor='green')
-
-                        # Identify indices where threshold is "yes"
-                        threshold_indices = df.index[df['threshold'] == 'yes'].tolist()
-
-                        # Add threshold lines to all plots without adding them to the legend
-                        for idx in threshold_indices:
-                            ax1.axvline(x=idx, color='red', linestyle='--', lw=0.5, label='_nolegend_')
-                            ax2.axvline(x=idx, color='red', linestyle='--', lw=0.5, label='_nolegend_')
-                            ax3.axvline(x=idx, color='red', linestyle='--', lw=0.5, label='_nolegend_')
-
-                        def init():
-                            animated_plot_pupil.set_data([], [])
-                            animated_plot_calcium.set_data([], [])
-                            animated_plot_derivative.set_data([], [])
-                            return animated_plot_pupil, animated_plot_calcium, animated_plot_derivative
-
-                        def update_data(frame):
-                            frame //= 3  # Add every 3 frames
-                            max_length = len(pupil_diameter_ratio)
-                            if frame > max_length:
-                                frame = max_length
-                            x = range(frame)
-                            y_pupil = pupil_diameter_ratio[:frame]
-                            y_calcium = calcium[:frame]
-                            y_derivative = pupil_diameter_ratio_derivative[:frame]
-                            animated_plot_pupil.set_data(x, y_pupil)
-                            animated_plot_calcium.set_data(x, y_calcium)
-                            animated_plot_derivative.set_data(x, y_derivative)
-                            return animated_plot_pupil, animated_plot_calcium, animated_plot_derivative
-
-                        total_frames = 3600
-                        animation = FuncAnimation(fig, update_data, frames=total_frames, init_func=init, interval=1000/30, blit=True)
-
-                        # Adding legends
-                        ax1.legend(loc='upper right')
-                        ax2.legend(loc='upper right')
-                        ax3.legend(loc='upper right')
-
-                        # Save the animation as an MP4 file in the "animations" folder
-                        save_filename = f"animation_{trial_dir}_{stimcondition_dir}.mp4"
-                        save_path = os.path.join(animations_folder, save_filename)
-                        writer = FFMpegWriter(fps=30, metadata=dict(artist='Me'), bitrate=1800)
-                        animation.save(save_path, writer=writer)
-
-                        # Close the plot to free memory
-                        plt.close(fig)
-
-                    else:
-                        print(f"Required columns are not present in the CSV file: {csv_file}")
+                csv_file = os.path.join(stimcondition_path, bindist_file)
+                if os.path.isdir(stimcondition_path) and os.path.isfile(csv_file):
+                    save_filename = f"animation_{trial_dir}_{stimcondition_dir}.mp4"
+                    jobs.append((csv_file, os.path.join(animations_folder, save_filename), mode))
+    return jobs
+
+
+def animate_directory(base_dir, mode='raw', n_workers=None):
+    # Create the "animations" folder if it doesn't exist
+    animations_folder = os.path.join(base_dir, "animations")
+    os.makedirs(animations_folder, exist_ok=True)
+
+    # Every session is an independent job; raw and fast renders use the Agg canvas only, so they run in worker processes
+    jobs = animation_jobs(base_dir, animations_folder, mode)
+    if mode == 'classic' or n_workers == 1 or len(jobs) <= 1:
+        return [_animate_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(_animate_job, jobs))
+
+
+if __name__ == "__main__":
+    animate_directory(base_dir)
@@ -0,0 +1,152 @@
+# EventLabeler.py
+# -------------------------------------------------------------------------
+# Origin: Vectorized replacement for the per-row 'yes'/'no' labeling in "Pupil Derivative thresholding.py"
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Labels pupil-derivative samples of a whole stacked cohort (session x sample) in one pass:
+#       primary       derivative above the primary threshold
+#       secondary_run running count of consecutive samples above the secondary threshold >= min_run
+#                     (same rule as the original groupby/cumsum trick)
+#       threshold     primary | secondary_run (the label the downstream scripts use)
+#       hysteresis    switches on above the primary threshold and stays on until the derivative
+#                     drops back below the secondary threshold
+#   - Labels are boolean arrays; they can be bit-packed for storage and turned into an event-interval table (start, end, peak).
+#
+# Inputs:
+#   - Stacked derivative arrays with per-session lengths and per-session thresholds
+#
+# Outputs:
+#   - Boolean label arrays, packed label arrays and event-interval DataFrames
+#
+# File Relationships:
+#   - Used by EventThresholdDetection and EventThresholdDetectionNormalized; threshold_mask is used by the scripts that read their 'threshold' column.
+#
+# Dependencies:
+#   - numpy, pandas
+# -------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+LABELS = ('primary', 'secondary_run', 'threshold', 'hysteresis')
+
+
+def threshold_mask(column):
+    # Boolean mask from a 'threshold' column, accepting the legacy 'yes'/'no' strings as well as booleans
+    values = np.asarray(column)
+    if values.dtype == bool:
+        return values
+    if values.dtype.kind in 'OUS':
+        return np.char.lower(values.astype(str)) == 'yes' if values.size else np.zeros(0, dtype=bool)
+    return values.astype(bool)
+
+
+def _valid_mask(shape, lengths):
+    if lengths is None:
+        return np.ones(shape, dtype=bool)
+    return np.arange(shape[1])[None, :] < np.asarray(lengths)[:, None]
+
+
+def _last_position(mask):
+    # Index of the most recent True at or before each sample (-1 if none yet), row-wise
+    positions = np.where(mask, np.arange(mask.shape[1])[None, :], -1)
+    return np.maximum.accumulate(positions, axis=1)
+
+
+def run_lengths(mask):
+    # Running count of consecutive True samples ending at each sample (0 where False)
+    position = np.arange(mask.shape[1])[None, :]
+    return np.where(mask, position - _last_position(~mask), 0)
+
+
+def secondary_run_mask(above, min_run=5):
+    return run_lengths(above) >= min_run
+
+
+def hysteresis_mask(derivative, high, low, valid=None):
+    # On from a sample above `high` until the first sample not above `low`
+    above_low = derivative > low
+    above_high = derivative > high
+    if valid is not None:
+        above_low &= valid
+        above_high &= valid
+    return above_low & (_last_position(above_high) > _last_position(~above_low))
+
+
+def label_stack(derivative, upper_primary, upper_secondary, lengths=None, min_run=5):
+    # derivative: (sessions, samples); thresholds are scalars or one value per session
+    derivative = np.atleast_2d(np.asarray(derivative, dtype=float))
+    valid = _valid_mask(derivative.shape, lengths)
+    high = np.broadcast_to(np.asarray(upper_primary, dtype=float), derivative.shape[:1])[:, None]
+    low = np.broadcast_to(np.asarray(upper_secondary, dtype=float), derivative.shape[:1])[:, None]
+
+    with np.errstate(invalid='ignore'):
+        primary = (derivative > high) & valid
+        secondary_run = secondary_run_mask((derivative > low) & valid, min_run)
+        hysteresis = hysteresis_mask(derivative, high, low, valid)
+    return {'primary': primary, 'secondary_run': secondary_run, 'threshold': primary | secondary_run,
+            'hysteresis': hysteresis}
+
+
+def add_label_columns(df, labels, row=0):
+    # Boolean label columns for one session (one row of the stacked label arrays)
+    n = len(df)
+    for name in LABELS:
+        df[name] = labels[name][row, :n]
+    return df
+
+
+def pack_labels(labels, lengths):
+    # Bit-pack every label along the sample axis (8 samples per byte)
+    packed = {f'{name}_bits': np.packbits(mask, axis=1) for name, mask in labels.items()}
+    packed['lengths'] = np.asarray(lengths)
+    packed['n_samples'] = np.array(next(iter(labels.values())).shape[1])
+    return packed
+
+
+def unpack_labels(packed):
+    n_samples = int(packed['n_samples'])
+    return {key[:-len('_bits')]: np.unpackbits(packed[key], axis=1, count=n_samples).astype(bool)
+            for key in packed if key.endswith('_bits')}
+
+
+def event_intervals(mask, values, lengths=None, time=None):
+    # One row per run of True samples: session row, start, end (inclusive), peak index/value and length
+    mask = np.atleast_2d(mask) & _valid_mask(np.shape(np.atleast_2d(mask)), lengths)
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    n_rows, n_samples = mask.shape
+    padded = np.zeros((n_rows, n_samples + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    start_rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    ends = ends - 1
+    columns = ['session', 'start', 'end', 'n_samples', 'peak', 'peak_value']
+    if time is not None:
+        columns += ['start_time', 'end_time', 'peak_time']
+    if starts.size == 0:
+        return pd.DataFrame(columns=columns)
+
+    # Peak of each run from one reduceat over the flattened samples of all runs
+    sizes = ends - starts + 1
+    offsets = np.r_[0, np.cumsum(sizes)[:-1]]
+    flat_index = np.repeat(start_rows * n_samples + starts - offsets, sizes) + np.arange(sizes.sum())
+    run_values = values.ravel()[flat_index]
+    peak_values = np.fmax.reduceat(run_values, offsets)
+    run_id = np.repeat(np.arange(starts.size), sizes)
+    hits = np.flatnonzero(run_values == peak_values[run_id])
+    _, first = np.unique(run_id[hits], return_index=True)
+    peaks = np.full(starts.size, -1)
+    peaks[run_id[hits[first]]] = flat_index[hits[first]] % n_samples
+    # All-NaN runs have no peak; fall back to the run start
+    peaks = np.where(peaks < 0, starts, peaks)
+
+    table = pd.DataFrame({'session': start_rows, 'start': starts, 'end': ends, 'n_samples': sizes,
+                          'peak': peaks, 'peak_value': peak_values})
+    if time is not None:
+        time = np.atleast_2d(time)
+        table['start_time'] = time[start_rows, starts]
+        table['end_time'] = time[start_rows, ends]
+        table['peak_time'] = time[start_rows, peaks]
+    return table
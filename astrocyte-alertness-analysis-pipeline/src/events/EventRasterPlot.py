@@ -0,0 +1,156 @@
+# EventRasterPlot.py
+# -------------------------------------------------------------------------
+# Origin: New event-raster view alongside "Dilation event plotting.py" and "Dilation event average plotting.py"
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Renders the whole peri-event tensor as event x time heatmaps (one image per condition, calcium and pupil side by side), rows sorted by lag, amplitude or onset, with the mean trace on top. Built straight from the in-memory array with one imshow per signal, so tens of thousands of events render in about a second.
+#   - When there are more events than image rows, neighbouring sorted events are averaged into one row (NaN-aware) so every event contributes instead of being dropped by the resampler. Each subset-type block is binned on its own, so a row never mixes stim and baseline events.
+#
+# Inputs:
+#   - Event table and (event, time, signal) tensor from PeriEventEngine
+#
+# Outputs:
+#   - 'event_raster_{stimcondition}_{sort}.png' per condition
+#
+# File Relationships:
+#   - Used by EventTimeAlignmentPlotting; a population view complementing the per-event figures (PeriEventRenderer) and the mean +/- SD plots (EventResponseAverageVisualization).
+#
+# Dependencies:
+#   - matplotlib (Agg canvas), numpy, pandas, os
+# -------------------------------------------------------------------------
+
+import os
+import warnings
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from PeriEventEngine import WINDOW_BEFORE
+
+SORT_KEYS = ('lag', 'amplitude', 'onset')
+
+# signal -> (colormap, symmetric colour limits)
+RASTER_SIGNALS = {
+    'calcium': ('RdBu_r', True),
+    'Pupil Diameter Ratio': ('viridis', False),
+}
+
+
+def sort_order(events, tensor, signals, sort_by='lag'):
+    # Row order for the raster: by calcium-pupil lag, by peak calcium amplitude, or by onset
+    if sort_by == 'lag':
+        key = events['TimeDifference'].to_numpy(dtype=float)
+    elif sort_by == 'amplitude':
+        calcium = tensor[..., signals.index('calcium')]
+        finite = np.isfinite(calcium).any(axis=1)
+        key = np.full(len(calcium), -np.inf)
+        key[finite] = np.nanmax(calcium[finite], axis=1)
+    elif sort_by == 'onset':
+        key = events['Index'].to_numpy(dtype=float)
+    else:
+        raise ValueError(f"Unknown sort key '{sort_by}', expected one of {SORT_KEYS}")
+    # NaN keys go last
+    return np.argsort(np.where(np.isnan(key), np.inf, key), kind='stable')
+
+
+def _colour_limits(values, symmetric, percentile=99):
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return (-1, 1) if symmetric else (0, 1)
+    if symmetric:
+        limit = np.percentile(np.abs(finite), percentile)
+        return -limit, limit
+    return np.percentile(finite, 100 - percentile), np.percentile(finite, percentile)
+
+
+def bin_rows(values, max_rows, groups=None):
+    # Average consecutive rows so about `max_rows` remain. Returns the image, the events per row and the event row
+    # at which each block after the first starts. Rows of different groups (e.g. subset types) are never averaged
+    # together: each block is padded with NaN to a multiple of the events per row and binned on its own.
+    per_row = max(int(np.ceil(len(values) / max_rows)), 1)
+    boundaries = np.flatnonzero(groups[1:] != groups[:-1]) + 1 if groups is not None else np.array([], dtype=int)
+    binned, starts, position = [], [], 0
+    for block in np.split(values, boundaries):
+        n_binned = -(-len(block) // per_row)
+        padded = np.full((n_binned * per_row, values.shape[1]), np.nan)
+        padded[:len(block)] = block
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            binned.append(np.nanmean(padded.reshape(n_binned, per_row, values.shape[1]), axis=1))
+        starts.append(position)
+        position += n_binned * per_row
+    return np.concatenate(binned), per_row, starts[1:]
+
+
+def plot_event_raster(tensor, signals, events, title, output_file, sort_by='lag', split_by='SubsetType', dpi=100,
+                      max_rows=1000):
+    # One figure: a mean-trace panel above an event x time image for every raster signal
+    order = sort_order(events, tensor, signals, sort_by)
+    groups = events[split_by].to_numpy()[order] if split_by in events else None
+    if groups is not None:
+        # Keep each subset type in its own block, sorted within the block
+        order = order[np.argsort(groups, kind='stable')]
+        groups = events[split_by].to_numpy()[order]
+
+    offsets = np.arange(tensor.shape[1]) - WINDOW_BEFORE
+    x_limits = (offsets[0] - 0.5, offsets[-1] + 0.5)
+    n_rows = len(order)
+    shown = [name for name in RASTER_SIGNALS if name in signals]
+
+    fig = Figure(figsize=(6 * len(shown), 9), dpi=dpi)
+    FigureCanvasAgg(fig)
+    # Fixed margins instead of tight_layout, which would cost an extra full draw of the images
+    grid = fig.add_gridspec(2, len(shown), height_ratios=(1, 4), left=0.07, right=0.95, bottom=0.06, top=0.92,
+                            wspace=0.4, hspace=0.15)
+    for column, name in enumerate(shown):
+        values = tensor[order][..., signals.index(name)]
+        cmap, symmetric = RASTER_SIGNALS[name]
+
+        mean_axis = fig.add_subplot(grid[0, column])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            if groups is not None:
+                for group in dict.fromkeys(groups):
+                    rows = values[groups == group]
+                    mean_axis.plot(offsets, np.nanmean(rows, axis=0), label=f'{group} (n={len(rows)})')
+                mean_axis.legend(loc='upper right', fontsize=8)
+            else:
+                mean_axis.plot(offsets, np.nanmean(values, axis=0))
+        mean_axis.axvline(0, color='k', linestyle='--', lw=0.8)
+        mean_axis.set_xlim(*x_limits)
+        mean_axis.set_title(f'{name}')
+
+        raster_axis = fig.add_subplot(grid[1, column], sharex=mean_axis)
+        binned, per_row, block_starts = bin_rows(values, max_rows, groups)
+        vmin, vmax = _colour_limits(binned, symmetric)
+        # Rows are in event units; with padded blocks the image can be a few rows taller than the event count
+        image_rows = len(binned) * per_row
+        image = raster_axis.imshow(np.ma.masked_invalid(binned), aspect='auto', interpolation='nearest', cmap=cmap,
+                                   vmin=vmin, vmax=vmax, extent=(*x_limits, image_rows - 0.5, -0.5))
+        raster_axis.set_ylim(image_rows - 0.5, -0.5)
+        raster_axis.axvline(0, color='k', linestyle='--', lw=0.8)
+        # Horizontal separators between subset-type blocks, at the binned block edges
+        for start in block_starts:
+            raster_axis.axhline(start - 0.5, color='k', lw=1)
+        raster_axis.set_xlabel('Samples from event onset')
+        raster_axis.set_ylabel(f'Event (sorted by {sort_by})' + (f', {per_row} per row' if per_row > 1 else ''))
+        # The colorbar takes space from both panels so their time axes stay aligned
+        fig.colorbar(image, ax=[mean_axis, raster_axis], label=name, fraction=0.05)
+
+    fig.suptitle(f'{title} - {n_rows} events')
+    fig.savefig(output_file)
+    return output_file
+
+
+def render_rasters(events, tensor, signals, output_directory, sort_by='lag', group_by='StimCondition'):
+    # One raster figure per condition
+    os.makedirs(output_directory, exist_ok=True)
+    signals = list(signals)
+    outputs = []
+    for condition, positions in events.reset_index(drop=True).groupby(group_by, sort=True).indices.items():
+        subset = events.iloc[positions].reset_index(drop=True)
+        output_file = os.path.join(output_directory, f'event_raster_{condition}_{sort_by}.png')
+        outputs.append(plot_event_raster(tensor[positions], signals, subset, str(condition), output_file, sort_by))
+    return outputs
@@ -1,10 +1,12 @@
 # EventResponseAveraging.py
 # -------------------------------------------------------------------------
 # Origin: "Dilation event averaging.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Computes average pupil and calcium activity across baseline and stimulation events. Produces separate CSVs for each condition.
+#   - Event files are folded one at a time into a per-timepoint count/sum/M2 accumulator (StreamingStatistics.TimepointMoments) instead of being padded and stacked, so memory no longer grows with the number of events; chunks of files can be accumulated in parallel workers and merged.
+#   - Files are grouped through EventCatalogue (filenames parsed once into day, trial, stimcondition, subset and index); every group-by works on that table and each file is read exactly once, even when it feeds several aggregates.
 #
 # Inputs:
 #   - Event-aligned CSVs (from EventTimeAlignmentPlotting)
@@ -16,91 +18,102 @@
 #   - Used before EventResponseAverageVisualization.
 #
 # Dependencies:
-#   - pandas, numpy, glob, os
+#   - pandas, os, sys, concurrent.futures, EventCatalogue, StreamingStatistics
 # -------------------------------------------------------------------------
 
 import pandas as pd
-import glob
 import os
-import numpy as np
-
-def pad_array(array, max_length):
-    """Pads an array with NaN values to match the max_length."""
-    pad_length = max_length - array.shape[0]
-    if pad_length > 0:
-        padding = np.full((pad_length, array.shape[1]), np.nan)
-        array = np.vstack([array, padding])
-    return array
-
-def average_and_std_rows_from_csvs(files, columns_to_average):
-    all_arrays = []
-    max_length = 0
-
-    for file in files:
-        df = pd.read_csv(file)
-        if all(col in df.columns for col in columns_to_average):
-            array = df[columns_to_average].to_numpy()
-            all_arrays.append(array)
-            max_length = max(max_length, array.shape[0])
-
-    # Pad all arrays to have the same length
-    padded_arrays = [pad_array(array, max_length) for array in all_arrays]
-
-    # Stack arrays along a new axis and compute the mean and standard deviation along that axis
-    stacked_arrays = np.stack(padded_arrays)
-    averaged_array = np.nanmean(stacked_arrays, axis=0)
-    std_array = np.nanstd(stacked_arrays, axis=0)
-
-    # Create DataFrame from the averaged array
-    averaged_df = pd.DataFrame(averaged_array, columns=columns_to_average)
-
-    # Add standard deviation columns to the DataFrame
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from EventCatalogue import averaging_group, build_catalogue
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from StreamingStatistics import TimepointMoments
+
+
+def accumulate_event_groups(paths, memberships, columns_to_average):
+    # memberships[i]: the (aggregate, key) groups file i contributes to. Each file is read once and folded into
+    # every one of its groups; files missing a column are skipped
+    accumulators = {}
+    for path, groups in zip(paths, memberships):
+        if not groups:
+            continue
+        df = pd.read_csv(path)
+        if not all(col in df.columns for col in columns_to_average):
+            continue
+        trace = df[columns_to_average].to_numpy(dtype=float)
+        for group in groups:
+            accumulators.setdefault(group, TimepointMoments(len(columns_to_average))).update(trace)
+    return accumulators
+
+
+def _accumulate_chunk(job):
+    return accumulate_event_groups(*job)
+
+
+def moments_frame(moments, columns_to_average):
+    # Mean columns followed by '<column> Std' columns (population std, as np.nanstd)
+    averaged_df = pd.DataFrame(moments.mean(), columns=columns_to_average)
+    std_array = moments.std()
     for col in columns_to_average:
         averaged_df[f'{col} Std'] = std_array[:, columns_to_average.index(col)]
-
     return averaged_df
 
-# Define input and output directories
-input_directory = r"C:\Users\ASH213\Documents\Correlated\890\dilation+constriction_events"
-output_directory = r"C:\Users\ASH213\Documents\Correlated\890"
-
-# Ensure output directory exists
-os.makedirs(output_directory, exist_ok=True)
-
-# Get list of all CSV files in the input directory
-all_csv_files = glob.glob(os.path.join(input_directory, "*.csv"))
-
-# Separate files into baseline and stim groups
-baseline_files = [file for file in all_csv_files if "baseline" in file or "stimcondition_5" in file]
-stimcondition_1_files = [file for file in all_csv_files if "stimcondition_1" in file and "baseline" not in file]
-stimcondition_2_files = [file for file in all_csv_files if "stimcondition_2" in file and "baseline" not in file]
-stimcondition_3_files = [file for file in all_csv_files if "stimcondition_3" in file and "baseline" not in file]
-stimcondition_4_files = [file for file in all_csv_files if "stimcondition_4" in file and "baseline" not in file]
-
-# Print the number of files in each group
-print(f"Number of baseline files: {len(baseline_files)}")
-print(f"Number of stimcondition_1 files: {len(stimcondition_1_files)}")
-print(f"Number of stimcondition_2 files: {len(stimcondition_2_files)}")
-print(f"Number of stimcondition_3 files: {len(stimcondition_3_files)}")
-print(f"Number of stimcondition_4 files: {len(stimcondition_4_files)}")
-
-# Define columns to be used
-columns_to_average = ["Pupil Diameter Ratio", "calcium"]
-
-# Compute averages and standard deviations for baseline files
-baseline_averages = average_and_std_rows_from_csvs(baseline_files, columns_to_average)
-baseline_averages.to_csv(os.path.join(output_directory, "baseline_averaged_results.csv"), index=False)
-
-# Compute averages and standard deviations for each stimulation condition
-stim_conditions = {
-    "stimcondition_1": stimcondition_1_files,
-    "stimcondition_2": stimcondition_2_files,
-    "stimcondition_3": stimcondition_3_files,
-    "stimcondition_4": stimcondition_4_files,
-}
-
-for condition, files in stim_conditions.items():
-    stim_averages = average_and_std_rows_from_csvs(files, columns_to_average)
-    stim_averages.to_csv(os.path.join(output_directory, f"{condition}_averaged_results.csv"), index=False)
-
-print("Averaged values and standard deviations saved to 'baseline_averaged_results.csv' and respective stimulation condition files")
+
+def average_event_groups(catalogue, groupings, columns_to_average, n_workers=None, chunk_size=200):
+    # groupings: aggregate name -> Series of group keys aligned with the catalogue (NaN = not in that aggregate).
+    # Returns {(aggregate, key): averaged DataFrame}. Serial by default; with n_workers, chunks of files are
+    # accumulated in parallel and the partials merged
+    keys = pd.DataFrame(groupings, index=catalogue.index)
+    memberships = [[(name, key) for name, key in row.items() if pd.notna(key)] for row in keys.to_dict('records')]
+    paths = catalogue['path'].tolist()
+
+    if n_workers is None or n_workers == 1 or len(paths) <= chunk_size:
+        accumulators = accumulate_event_groups(paths, memberships, columns_to_average)
+    else:
+        jobs = [(paths[start:start + chunk_size], memberships[start:start + chunk_size], columns_to_average)
+                for start in range(0, len(paths), chunk_size)]
+        accumulators = {}
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for partial in executor.map(_accumulate_chunk, jobs):
+                for group, moments in partial.items():
+                    accumulators.setdefault(group, TimepointMoments(len(columns_to_average))).merge(moments)
+    return {group: moments_frame(moments, columns_to_average) for group, moments in accumulators.items()}
+
+
+def average_and_std_rows_from_csvs(files, columns_to_average, n_workers=None, chunk_size=200):
+    # Mean +/- std of one list of event files
+    catalogue = pd.DataFrame({'path': list(files)})
+    averages = average_event_groups(catalogue, {'all': pd.Series('all', index=catalogue.index)}, columns_to_average,
+                                    n_workers=n_workers, chunk_size=chunk_size)
+    return averages.get(('all', 'all'), moments_frame(TimepointMoments(len(columns_to_average)), columns_to_average))
+
+
+if __name__ == "__main__":
+    # Define input and output directories
+    input_directory = r"C:\Users\ASH213\Documents\Correlated\890\dilation+constriction_events"
+    output_directory = r"C:\Users\ASH213\Documents\Correlated\890"
+
+    # Ensure output directory exists
+    os.makedirs(output_directory, exist_ok=True)
+
+    # One scan of the input directory; day, trial, stimcondition, subset and index parsed once per file
+    catalogue = build_catalogue(input_directory)
+
+    # Baseline events (and every stimcondition_5 event) form the baseline group, stim events their stimcondition
+    groups = averaging_group(catalogue)
+
+    # Print the number of files in each group
+    for group, count in groups.value_counts().sort_index().items():
+        print(f"Number of {group} files: {count}")
+
+    # Define columns to be used
+    columns_to_average = ["Pupil Diameter Ratio", "calcium"]
+
+    # Compute averages and standard deviations for every group from a single read of each file
+    averages = average_event_groups(catalogue, {'condition': groups}, columns_to_average)
+    for (_, group), averaged_df in averages.items():
+        averaged_df.to_csv(os.path.join(output_directory, f"{group}_averaged_results.csv"), index=False)
+
+    print("Averaged values and standard deviations saved to 'baseline_averaged_results.csv' and respective stimulation condition files")
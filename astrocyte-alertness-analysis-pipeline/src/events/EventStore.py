@@ -0,0 +1,215 @@
+# EventStore.py
+# -------------------------------------------------------------------------
+# Origin: New event store replacing the filename-encoded event metadata of EventTimeAlignmentPlotting
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Embedded SQLite store with one row per peri-event: keys (day, trial, stimcondition, subset type, onset index), initial and final window bounds, calcium/pupil peak times, lag, peak amplitudes and a curation flag. The peri-event windows sit in a companion .npy array whose row is the event_id.
+#   - Selections such as "stim-period events of stimcondition_4 with lag < 2 s" are indexed SQL queries instead of directory scans; curation is a flag instead of a 'good' folder (an existing folder can be imported once).
+#   - Rebuilding the store keeps curation: flags are carried over by (day, trial, stimcondition, onset) to the re-extracted events; flags of events that are no longer detected are dropped.
+#
+# Inputs:
+#   - Event table and (event, time, signal) tensor from PeriEventEngine
+#   - Optional curation folder of event PNGs/CSVs ('good')
+#
+# Outputs:
+#   - 'events.sqlite' and 'events_windows.npy'
+#
+# File Relationships:
+#   - Written by EventTimeAlignmentPlotting; read by DilationLagComputation.
+#
+# Dependencies:
+#   - sqlite3, json, numpy, pandas, os, EventCatalogue
+# -------------------------------------------------------------------------
+
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from EventCatalogue import build_catalogue
+
+STORE_VERSION = 1
+
+# DataFrame column (PeriEventEngine / EventTimeAlignmentPlotting) -> store column
+EVENT_COLUMNS = {
+    'Day': 'day',
+    'Trial': 'trial',
+    'StimCondition': 'stimcondition',
+    'SubsetType': 'subset',
+    'Index': 'onset',
+    'start': 'window_start',
+    'end': 'window_end',
+    'final_start': 'final_start',
+    'final_end': 'final_end',
+    'shrunk': 'shrunk',
+    'MaxCalciumTime': 'max_calcium_time',
+    'MaxPupilTime': 'max_pupil_time',
+    'TimeDifference': 'time_difference',
+}
+
+SCHEMA = """
+CREATE TABLE events (
+    event_id INTEGER PRIMARY KEY,
+    day TEXT NOT NULL,
+    trial TEXT NOT NULL,
+    stimcondition TEXT NOT NULL,
+    subset TEXT NOT NULL,
+    onset INTEGER NOT NULL,
+    window_start INTEGER,
+    window_end INTEGER,
+    final_start INTEGER,
+    final_end INTEGER,
+    shrunk INTEGER,
+    max_calcium_time REAL,
+    max_pupil_time REAL,
+    time_difference REAL,
+    peak_calcium REAL,
+    peak_pupil REAL,
+    curated INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX events_key ON events (day, trial, stimcondition, onset);
+CREATE INDEX events_condition_lag ON events (stimcondition, subset, time_difference);
+CREATE INDEX events_curated ON events (curated, stimcondition, subset);
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def store_paths(store_path):
+    # 'events.sqlite' -> ('events.sqlite', 'events_windows.npy')
+    root, _ = os.path.splitext(store_path)
+    return store_path, f'{root}_windows.npy'
+
+
+def _peaks(tensor, signals, name):
+    values = tensor[..., signals.index(name)]
+    peaks = np.full(len(values), np.nan)
+    found = np.isfinite(values).any(axis=1)
+    peaks[found] = np.nanmax(values[found], axis=1)
+    return peaks
+
+
+def curated_keys(database_path):
+    # (day, trial, stimcondition, onset) of every curated event in an existing store; empty if there is none
+    if not os.path.exists(database_path):
+        return []
+    connection = sqlite3.connect(database_path)
+    try:
+        return connection.execute(
+            'SELECT day, trial, stimcondition, onset FROM events WHERE curated = 1').fetchall()
+    finally:
+        connection.close()
+
+
+def write_event_store(store_path, events, tensor, signals, window_before=None, keep_curation=True):
+    # (Re)build the store from one extraction run; event_id is the row of the window array.
+    # Curation flags of the previous store carry over to the events with the same
+    # (day, trial, stimcondition, onset), so re-running the extraction does not lose curation.
+    database_path, windows_path = store_paths(store_path)
+    signals = list(signals)
+    curated = curated_keys(database_path) if keep_curation else []
+    for path in (database_path, windows_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    table = events.reset_index(drop=True)[list(EVENT_COLUMNS)].rename(columns=EVENT_COLUMNS)
+    table.insert(0, 'event_id', np.arange(len(table)))
+    table['shrunk'] = table['shrunk'].astype(int)
+    table['peak_calcium'] = _peaks(tensor, signals, 'calcium')
+    table['peak_pupil'] = _peaks(tensor, signals, 'Pupil Diameter Ratio')
+
+    np.save(windows_path, np.ascontiguousarray(tensor, dtype=float))
+    with sqlite3.connect(database_path) as connection:
+        connection.executescript(SCHEMA)
+        table.to_sql('events', connection, if_exists='append', index=False)
+        metadata = {'version': STORE_VERSION, 'signals': signals, 'window_before': window_before,
+                    'windows_file': os.path.basename(windows_path)}
+        connection.executemany('INSERT INTO metadata VALUES (?, ?)',
+                               [(key, json.dumps(value)) for key, value in metadata.items()])
+        before = connection.total_changes
+        connection.executemany(
+            'UPDATE events SET curated = 1 WHERE day = ? AND trial = ? AND stimcondition = ? AND onset = ?', curated)
+        restored = connection.total_changes - before
+    connection.close()
+    if curated:
+        print(f"Kept {restored} of {len(curated)} curated events ({len(curated) - restored} no longer detected)")
+    return database_path, windows_path
+
+
+class EventStore:
+    """Query interface over an events.sqlite file and its window array."""
+
+    def __init__(self, store_path):
+        self.database_path, self.windows_path = store_paths(store_path)
+        if not os.path.exists(self.database_path):
+            raise FileNotFoundError(f"No event store at {self.database_path}")
+        self.connection = sqlite3.connect(self.database_path)
+        self.metadata = {key: json.loads(value) for key, value in
+                         self.connection.execute('SELECT key, value FROM metadata')}
+        self.signals = self.metadata['signals']
+        self._windows = None
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def select(self, where='1', params=()):
+        # Raw filtered read, e.g. select('stimcondition = ? AND peak_calcium > ?', ('stimcondition_4', 0.5))
+        return pd.read_sql_query(f'SELECT * FROM events WHERE {where} ORDER BY event_id', self.connection,
+                                 params=list(params))
+
+    def query(self, day=None, trial=None, stimcondition=None, subset=None, curated=None, min_lag=None, max_lag=None,
+              max_abs_lag=None):
+        # Every argument narrows the selection; lags are TimeDifference (calcium peak time - pupil peak time)
+        clauses, params = [], []
+        for column, value in (('day', day), ('trial', trial), ('stimcondition', stimcondition), ('subset', subset)):
+            if value is not None:
+                values = [value] if isinstance(value, str) else list(value)
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        if curated is not None:
+            clauses.append('curated = ?')
+            params.append(int(curated))
+        if min_lag is not None:
+            clauses.append('time_difference >= ?')
+            params.append(float(min_lag))
+        if max_lag is not None:
+            clauses.append('time_difference < ?')
+            params.append(float(max_lag))
+        if max_abs_lag is not None:
+            clauses.append('time_difference > ? AND time_difference < ?')
+            params.extend([-float(max_abs_lag), float(max_abs_lag)])
+        return self.select(' AND '.join(clauses) or '1', params)
+
+    def windows(self, event_ids=None):
+        # Peri-event windows (events, time, signals), memory-mapped so a query only touches its own rows
+        if self._windows is None:
+            self._windows = np.load(self.windows_path, mmap_mode='r')
+        if event_ids is None:
+            return self._windows
+        return np.asarray(self._windows[np.asarray(event_ids, dtype=int)])
+
+    def set_curated(self, keys, curated=True):
+        # keys: DataFrame with day, trial, stimcondition and onset columns; returns the number of events flagged
+        rows = [(int(curated), k['day'], k['trial'], k['stimcondition'], int(k['onset']))
+                for k in keys[['day', 'trial', 'stimcondition', 'onset']].to_dict('records')]
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                'UPDATE events SET curated = ? WHERE day = ? AND trial = ? AND stimcondition = ? AND onset = ?', rows)
+            return self.connection.total_changes - before
+
+    def import_curation(self, folder_path, reset=True):
+        # Flag every event that has a file in a curation folder (e.g. the old 'good' folder of PNGs)
+        catalogue = build_catalogue(folder_path, extension=None).rename(columns={'index': 'onset'})
+        if reset:
+            with self.connection:
+                self.connection.execute('UPDATE events SET curated = 0')
+        return self.set_curated(catalogue.drop_duplicates(['day', 'trial', 'stimcondition', 'onset']))
@@ -1,101 +1,152 @@
 # EventThresholdDetection.py
 # -------------------------------------------------------------------------
-# Origin: "Pupil Derivative thresholding.py"
-# Last Updated: 2025-10-27
+# Origin: "Pupil Derivative thresholding.py" (now also covers "Dilation Derivative thresholding normalized.py")
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Labels pupil derivative time points that exceed primary/secondary thresholds (std-dev based) and writes event markers.
+#   - Every session is read once and its derivative computed once; the stacked cohort is labeled in one vectorized call (EventLabeler) and every calcium variant (raw, max-normalized, z-score, dF/F) is written from that single pass. Labels are boolean columns (threshold, primary, secondary_run, hysteresis).
 #
 # Inputs:
 #   - Derivative and calcium CSVs (from dilation event detection)
 #
 # Outputs:
-#   - 'bindist_2040.csv' with binary event labels
+#   - 'bindist_2040.csv' (raw calcium) and 'bindist_2020.csv' (calcium / max) with boolean event labels, plus any extra variants requested
+#   - 'derivative_threshold_labels.npz' (bit-packed labels) and 'derivative_threshold_event_intervals.csv' (start, end, peak per event)
 #
 # File Relationships:
-#   - Input to EventGraphAnimation and EventTimeAlignmentPlotting.
+#   - Input to EventGraphAnimation and EventTimeAlignmentPlotting; EventThresholdDetectionNormalized is a thin wrapper around it.
+#   - Thresholds are loaded from the EventThresholds artifact (primary/secondary per stimcondition, animal or day).
 #
 # Dependencies:
-#   - pandas, numpy, os
+#   - pandas, numpy, os, sys, EventThresholds, EventLabeler
 # -------------------------------------------------------------------------
 
 import pandas as pd
 import numpy as np
 import os
-
-def calculate_derivative_and_threshold(input_csv, output_csv, stimcondition):
-    # Read the CSV file
+import sys
+
+from EventLabeler import add_label_columns, event_intervals, label_stack, pack_labels
+from EventThresholds import load_or_compute_thresholds, lookup_thresholds
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from CohortSessionLoader import discover_cohort_sessions
+
+# Output file -> calcium normalization written into it
+DEFAULT_VARIANTS = {
+    'bindist_2040.csv': 'raw',
+    'bindist_2020.csv': 'max',
+}
+
+# Extra variants that can be requested, e.g. process_directory(..., variants={**DEFAULT_VARIANTS, **EXTRA_VARIANTS})
+EXTRA_VARIANTS = {
+    'bindist_2040_zscore.csv': 'zscore',
+    'bindist_2040_dff.csv': 'dff',
+}
+
+# Pre-stim samples used as F0 for dF/F
+BASELINE = (0, 299)
+
+
+def normalize_calcium(calcium, method, lengths=None, baseline=BASELINE):
+    # calcium: (sessions, samples), NaN padded; every statistic is taken per session
+    calcium = np.atleast_2d(np.asarray(calcium, dtype=float))
+    if method == 'raw':
+        return calcium
+    if method == 'max':
+        # Normalize the "calcium" column to its maximum value
+        return calcium / np.nanmax(calcium, axis=1, keepdims=True)
+    if method == 'zscore':
+        return (calcium - np.nanmean(calcium, axis=1, keepdims=True)) / np.nanstd(calcium, axis=1, keepdims=True)
+    if method == 'dff':
+        f0 = np.nanmean(calcium[:, baseline[0]:baseline[1]], axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (calcium - f0) / f0
+    raise ValueError(f"Unknown calcium normalization '{method}', expected 'raw', 'max', 'zscore' or 'dff'")
+
+
+def calculate_derivative_and_threshold(input_csv, output_csv, thresholds, normalization='raw'):
+    # Single-file version of the labeling pass
     df = pd.read_csv(input_csv)
 
-    # Normalize the "calcium" column to its maximum value
-    df['calcium'] = df['calcium']
+    df['calcium'] = normalize_calcium(df['calcium'].to_numpy(), normalization)[0]
 
     # Calculate the derivative using numpy's gradient function
     df['Pupil Diameter Ratio Derivative'] = np.gradient(df['Pupil Diameter Ratio'], df['time'])
 
-    # Define primary thresholds based on stimcondition
-    primary_thresholds = {
-        1: (0.3155, -0.3174),
-        2: (0.3174, -0.3192),
-        3: (0.3377, -0.3426),
-        4: (0.3250, -0.3317),
-        5: (0.3257, -0.3298)
-    }
-
-    # Define secondary thresholds based on stimcondition
-    secondary_thresholds = {
-        1: (0.1571, -0.1591),
-        2: (0.1569, -0.1602),
-        3: (0.1674, -0.1708),
-        4: (0.1618, -0.1644),
-        5: (0.1617, -0.1660)
-    }
-
-    # Get the thresholds for the given stimcondition
-    upper_primary_threshold, lower_primary_threshold = primary_thresholds.get(stimcondition)
-    upper_secondary_threshold, lower_secondary_threshold = secondary_thresholds.get(stimcondition)
-
-    if upper_primary_threshold is None or upper_secondary_threshold is None:
-        raise ValueError("Invalid stimcondition")
-
-    # Add the "threshold" column
-    df['threshold'] = df['Pupil Diameter Ratio Derivative'].apply(
-        lambda x: 'yes' if x > upper_primary_threshold else 'no'
-    )
-
-    # Check for the secondary threshold condition
-    above_secondary_threshold = df['Pupil Diameter Ratio Derivative'] > upper_secondary_threshold
-    consecutive_counts = (above_secondary_threshold.groupby((~above_secondary_threshold).cumsum()).cumsum() >= 5)
-    df.loc[consecutive_counts, 'threshold'] = 'yes'
+    # Thresholds come from the computed artifact (see EventThresholds), not from hand-typed tables
+    (upper_primary_threshold, lower_primary_threshold), (upper_secondary_threshold, lower_secondary_threshold) = thresholds
+
+    # Primary, "5 consecutive above secondary" and hysteresis labels as boolean columns
+    labels = label_stack(df['Pupil Diameter Ratio Derivative'].to_numpy(), upper_primary_threshold,
+                         upper_secondary_threshold)
+    add_label_columns(df, labels)
 
     # Save the modified dataframe to a new CSV file
     df.to_csv(output_csv, index=False)
 
 
-def process_directory(base_input_dir, base_output_dir):
+def process_directory(base_input_dir, base_output_dir, threshold_file=None, scope='stimcondition', variants=None):
     # Ensure the output directory exists
     os.makedirs(base_output_dir, exist_ok=True)
+    variants = variants or DEFAULT_VARIANTS
 
     days = ["d084", "d070", "d056", "d028", "d021", "d014", "d007", "d003", "d001"]
-    for day in days:
-        input_dir = os.path.join(base_input_dir, day)
-        output_dir = os.path.join(base_output_dir, day)
-        for trial in range(1, 4):
-            trial_dir = f"trial_{trial}"
-            for stimcondition in range(1, 6):
-                stimcondition_dir = f"stimcondition_{stimcondition}"
-                input_file = os.path.join(input_dir, trial_dir, stimcondition_dir, "bindist_2000.csv")
-                output_file = os.path.join(output_dir, trial_dir, stimcondition_dir, "bindist_2040.csv")
-
-                # Ensure the output subdirectory exists
-                os.makedirs(os.path.dirname(output_file), exist_ok=True)
-
-                if os.path.exists(input_file):
-                    calculate_derivative_and_threshold(input_file, output_file, stimcondition)
-                else:
-                    print(f"File {input_file} does not exist.")
-
-
-base_input_dir = r"C:\Users\ASH213\Documents\Correlated\890"
-base_output_dir = r"C:\Users\ASH213\Documents\Correlated\890"
-process_directory(base_input_dir, base_output_dir)
+
+    # Computed once per cohort and reused until the inputs change
+    threshold_file = threshold_file or os.path.join(base_output_dir, 'derivative_thresholds.json')
+    artifact = load_or_compute_thresholds(base_input_dir, threshold_file, days=days)
+
+    # Read every session once and compute its derivative once
+    records = discover_cohort_sessions(base_input_dir, days=days, report_missing=True)
+    frames = []
+    for record in records:
+        df = pd.read_csv(record['path'])
+        df['Pupil Diameter Ratio Derivative'] = np.gradient(df['Pupil Diameter Ratio'], df['time'])
+        frames.append(df)
+    if not frames:
+        return
+
+    lengths = np.array([len(df) for df in frames])
+    derivative = np.full((len(frames), lengths.max()), np.nan)
+    time = np.full(derivative.shape, np.nan)
+    calcium = np.full(derivative.shape, np.nan)
+    for i, df in enumerate(frames):
+        derivative[i, :lengths[i]] = df['Pupil Diameter Ratio Derivative'].to_numpy(dtype=float)
+        time[i, :lengths[i]] = df['time'].to_numpy(dtype=float)
+        calcium[i, :lengths[i]] = df['calcium'].to_numpy(dtype=float)
+
+    # The labels only depend on the derivative, so they are shared by every calcium variant
+    thresholds = [lookup_thresholds(artifact, r['stimcondition'], animal=r['animal'], day=r['day'], scope=scope)
+                  for r in records]
+    labels = label_stack(derivative, [t[0][0] for t in thresholds], [t[1][0] for t in thresholds], lengths)
+    for i, df in enumerate(frames):
+        add_label_columns(df, labels, i)
+
+    normalized = {method: normalize_calcium(calcium, method, lengths) for method in set(variants.values())}
+    for i, (record, df) in enumerate(zip(records, frames)):
+        output_dir = os.path.join(base_output_dir, record['day'], record['trial'], record['stimcondition'])
+        # Ensure the output subdirectory exists
+        os.makedirs(output_dir, exist_ok=True)
+        for output_name, method in variants.items():
+            df['calcium'] = normalized[method][i, :lengths[i]]
+            df.to_csv(os.path.join(output_dir, output_name), index=False)
+
+    # Cohort-level outputs: bit-packed labels and one row per labeled interval
+    session_index = pd.DataFrame(records).drop(columns='path')
+    np.savez_compressed(os.path.join(base_output_dir, 'derivative_threshold_labels.npz'),
+                        **pack_labels(labels, lengths), sessions=session_index.to_numpy(dtype=str))
+    intervals = []
+    for name in ('threshold', 'hysteresis'):
+        table = event_intervals(labels[name], derivative, lengths, time=time)
+        table.insert(0, 'label', name)
+        intervals.append(table.join(session_index, on='session'))
+    pd.concat(intervals, ignore_index=True).to_csv(
+        os.path.join(base_output_dir, 'derivative_threshold_event_intervals.csv'), index=False)
+
+
+if __name__ == "__main__":
+    base_input_dir = r"C:\Users\ASH213\Documents\Correlated\890"
+    base_output_dir = r"C:\Users\ASH213\Documents\Correlated\890"
+    process_directory(base_input_dir, base_output_dir)
@@ -0,0 +1,191 @@
+# EventThresholds.py
+# -------------------------------------------------------------------------
+# Origin: Replaces the hand-typed primary/secondary threshold tables of the thresholding scripts
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Computes the primary/secondary pupil-derivative thresholds from the derivative distribution itself. One pass over the sessions (one worker task per session) fills mergeable accumulators for every scope at once: per stimcondition across the cohort, per animal and stimcondition, and per animal, day and stimcondition.
+#   - Stores the thresholds, plus the accumulators they came from, in a versioned JSON artifact. The artifact is keyed by a cohort key (folders, days, method) and a hash of the inputs (path, size, mtime), so it is recomputed only when the cohort or the data change.
+#
+# Inputs:
+#   - One or more animal folders with <day>/<trial>/<stimcondition>/bindist_2000.csv
+#
+# Outputs:
+#   - 'derivative_thresholds.json' (or the given artifact path)
+#
+# File Relationships:
+#   - Loaded by EventThresholdDetection and EventThresholdDetectionNormalized; shares its accumulator worker with DilationEventDetection.
+#
+# Dependencies:
+#   - pandas, numpy, json, hashlib, os, sys, time, concurrent.futures
+# -------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from CohortSessionLoader import DAYS, STIM_CONDITIONS, TRIALS, discover_cohort_sessions
+from StreamingStatistics import DerivativeThresholdAccumulator
+
+# Bump whenever the artifact layout or the threshold definitions change
+THRESHOLD_ARTIFACT_VERSION = 2
+
+SCOPES = ('stimcondition', 'animal', 'day')
+
+# The original tables were the derivatives 2 (primary) and 1 (secondary) standard deviations from the mean
+DEFAULT_METHOD = 'sigma'
+DEFAULT_PRIMARY = 2
+DEFAULT_SECONDARY = 1
+
+
+def session_derivative_statistics(record):
+    # Worker: one CSV in, one small accumulator out (None if the columns are missing)
+    df = pd.read_csv(record['path'])
+    if 'Pupil Diameter Ratio' not in df.columns or 'time' not in df.columns:
+        return record, None
+    derivative = np.gradient(df['Pupil Diameter Ratio'].to_numpy(dtype=float), df['time'].to_numpy(dtype=float))
+    return record, DerivativeThresholdAccumulator().update(derivative)
+
+
+def scope_key(scope, stimcondition, animal=None, day=None):
+    if scope == 'stimcondition':
+        return stimcondition
+    if scope == 'animal':
+        return f"{animal}/{stimcondition}"
+    if scope == 'day':
+        return f"{animal}/{day}/{stimcondition}"
+    raise ValueError(f"Unknown threshold scope '{scope}', expected one of {SCOPES}")
+
+
+def discover_threshold_inputs(base_dirs, days=DAYS, trials=TRIALS, stim_conditions=STIM_CONDITIONS,
+                              filename='bindist_2000.csv'):
+    if isinstance(base_dirs, str):
+        base_dirs = [base_dirs]
+    records = []
+    for base_dir in base_dirs:
+        records.extend(discover_cohort_sessions(base_dir, days=days, trials=trials, stim_conditions=stim_conditions,
+                                                filename=filename))
+    return records
+
+
+def input_hash(records):
+    # Cheap content key: a file is considered unchanged while its size and mtime are unchanged
+    digest = hashlib.sha256()
+    for record in sorted(records, key=lambda r: r['path']):
+        digest.update(f"{record['path']}|{os.path.getsize(record['path'])}|"
+                      f"{os.path.getmtime(record['path'])}\n".encode())
+    return digest.hexdigest()
+
+
+def cohort_key(base_dirs, days, stim_conditions, filename, method, primary, secondary):
+    if isinstance(base_dirs, str):
+        base_dirs = [base_dirs]
+    return json.dumps({'animals': sorted(os.path.normpath(d) for d in base_dirs), 'days': list(days),
+                       'stim_conditions': list(stim_conditions), 'filename': filename,
+                       'method': method, 'primary': primary, 'secondary': secondary}, sort_keys=True)
+
+
+def accumulate_scopes(records, n_workers=None):
+    # Single pass: every session is folded into its stimcondition, animal and day accumulators
+    statistics = {scope: {} for scope in SCOPES}
+    if n_workers == 1:
+        results = map(session_derivative_statistics, records)
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+        results = executor.map(session_derivative_statistics, records, chunksize=8)
+    try:
+        for record, partial in results:
+            if partial is None:
+                print(f"Missing required columns in {record['path']}")
+                continue
+            for scope in SCOPES:
+                key = scope_key(scope, record['stimcondition'], record['animal'], record['day'])
+                statistics[scope].setdefault(key, DerivativeThresholdAccumulator()).merge(partial)
+    finally:
+        if n_workers != 1:
+            executor.shutdown()
+    return statistics
+
+
+def threshold_pair(accumulator, method, level):
+    # (upper, lower) derivative thresholds at the given level of the chosen method
+    if method == 'sigma':
+        return accumulator.sigma_thresholds(level)
+    if method == 'mad':
+        return accumulator.mad_thresholds(level)
+    if method == 'percentile':
+        return accumulator.percentile_thresholds(level)
+    raise ValueError(f"Unknown threshold method '{method}', expected 'sigma', 'mad' or 'percentile'")
+
+
+def build_threshold_artifact(statistics, method=DEFAULT_METHOD, primary=DEFAULT_PRIMARY, secondary=DEFAULT_SECONDARY,
+                             key=None, inputs=None):
+    thresholds = {}
+    for scope, accumulators in statistics.items():
+        thresholds[scope] = {}
+        for name, accumulator in sorted(accumulators.items()):
+            thresholds[scope][name] = {
+                'primary': [float(v) for v in threshold_pair(accumulator, method, primary)],
+                'secondary': [float(v) for v in threshold_pair(accumulator, method, secondary)],
+                'count': accumulator.count,
+                'mean': accumulator.mean,
+                'std': accumulator.std,
+                'median': accumulator.median(),
+                'mad': accumulator.mad(),
+            }
+    return {
+        'version': THRESHOLD_ARTIFACT_VERSION,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'cohort_key': key,
+        'input_hash': inputs,
+        'method': method,
+        'primary': primary,
+        'secondary': secondary,
+        'thresholds': thresholds,
+        # Kept so thresholds for another method/level can be derived without re-reading the data
+        'statistics': {scope: {name: acc.to_dict() for name, acc in sorted(accumulators.items())}
+                       for scope, accumulators in statistics.items()},
+    }
+
+
+def load_or_compute_thresholds(base_dirs, artifact_file, days=DAYS, trials=TRIALS, stim_conditions=STIM_CONDITIONS,
+                               filename='bindist_2000.csv', method=DEFAULT_METHOD, primary=DEFAULT_PRIMARY,
+                               secondary=DEFAULT_SECONDARY, n_workers=None, force=False):
+    records = discover_threshold_inputs(base_dirs, days=days, trials=trials, stim_conditions=stim_conditions,
+                                        filename=filename)
+    key = cohort_key(base_dirs, days, stim_conditions, filename, method, primary, secondary)
+    inputs = input_hash(records)
+
+    if not force and os.path.exists(artifact_file):
+        with open(artifact_file) as f:
+            artifact = json.load(f)
+        if (artifact.get('version') == THRESHOLD_ARTIFACT_VERSION and artifact.get('cohort_key') == key
+                and artifact.get('input_hash') == inputs):
+            return artifact
+        print(f"Threshold artifact '{artifact_file}' is stale, recomputing")
+
+    artifact = build_threshold_artifact(accumulate_scopes(records, n_workers=n_workers), method=method,
+                                        primary=primary, secondary=secondary, key=key, inputs=inputs)
+    os.makedirs(os.path.dirname(os.path.abspath(artifact_file)), exist_ok=True)
+    with open(artifact_file, 'w') as f:
+        json.dump(artifact, f, indent=1)
+    print(f"Thresholds for {len(records)} sessions saved to '{artifact_file}'")
+    return artifact
+
+
+def lookup_thresholds(artifact, stimcondition, animal=None, day=None, scope='stimcondition'):
+    # -> ((upper_primary, lower_primary), (upper_secondary, lower_secondary)) for one session
+    if isinstance(stimcondition, int):
+        stimcondition = f"stimcondition_{stimcondition}"
+    key = scope_key(scope, stimcondition, animal, day)
+    entry = artifact['thresholds'][scope].get(key)
+    if entry is None:
+        raise ValueError(f"No {scope} thresholds for '{key}' in the threshold artifact")
+    return tuple(entry['primary']), tuple(entry['secondary'])
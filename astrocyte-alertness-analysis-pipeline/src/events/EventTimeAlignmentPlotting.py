@@ -1,28 +1,40 @@
 # EventTimeAlignmentPlotting.py
 # -------------------------------------------------------------------------
 # Origin: "Dilation event plotting.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Plots individual dilation events aligned in time, distinguishing baseline and stimulation conditions, and outputs event-aligned CSVs.
+#   - Onset detection, window extraction and the lag metrics run for all sessions at once in PeriEventEngine; time_differences.csv is built in one shot (now with a SubsetType column); figures are rendered by PeriEventRenderer.
+#   - Every event (keys, window bounds, lag, peaks, curation flag) is also written to an indexed SQLite store with its windows in a companion array (EventStore). Re-runs rebuild the store but keep the curation flags of events that are detected again.
+#   - Event rasters (events x time heatmaps of calcium and pupil per stimcondition, from EventRasterPlot) are drawn straight from the same in-memory tensor.
 #
 # Inputs:
 #   - Event CSVs ('bindist_2020' or 'bindist_2040')
 #
 # Outputs:
-#   - Plots and aligned CSVs for each event
+#   - Plots (PNG per event, or multi-page PDFs / contact sheets) and aligned CSVs for each event
+#   - 'event_raster_{stimcondition}_{sort}.png' per stimcondition
+#   - 'events.sqlite' + 'events_windows.npy' event store
 #
 # File Relationships:
 #   - Precedes EventResponseAveraging.
 #
 # Dependencies:
-#   - pandas, numpy, matplotlib.pyplot, os
+#   - pandas, os, sys, PeriEventEngine, PeriEventRenderer, EventRasterPlot, EventStore
 # -------------------------------------------------------------------------
 
 import os
+import sys
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
+
+from EventRasterPlot import render_rasters
+from EventStore import write_event_store
+from PeriEventEngine import WINDOW_BEFORE, event_frame, extract_peri_events
+from PeriEventRenderer import render_events
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from CohortSessionLoader import discover_cohort_sessions
 
 # Define the main directory
 main_directory = r"C:\Users\ASH213\Documents\Correlated\890"
@@ -32,165 +44,50 @@ days = ['d084', 'd070', 'd056', 'd028', 'd021', 'd014', 'd007', 'd003', 'd001']
 trials = ['trial_1', 'trial_2', 'trial_3']
 stim_conditions = ['stimcondition_1', 'stimcondition_2', 'stimcondition_3', 'stimcondition_4', 'stimcondition_5']
 
-# Create a directory for saving plots and results
+# Directory for saving plots and results
 output_directory = os.path.join(main_directory, "dilation+constriction_events")
-os.makedirs(output_directory, exist_ok=True)
-
-# DataFrame to store time differences
-time_differences = pd.DataFrame(columns=['Day', 'Trial', 'StimCondition', 'Index', 'TimeDifference'])
-
-# Process each day, trial, and stimulation condition
-for day in days:
-    for trial in trials:
-        for stim_condition in stim_conditions:
-            # Construct the file path
-            file_path = os.path.join(main_directory, day, trial, stim_condition, 'bindist_2040.csv')
-
-            # Check if the file exists
-            if not os.path.isfile(file_path):
-                print(f"File not found: {file_path}")
-                continue
-
-            # Read the CSV file
-            df = pd.read_csv(file_path)
-
-            # Find indices where 'yes' appears in the 'threshold' column
-            yes_indices = []
-            last_idx = -100  # Initialize last index to a large number
-
-            for idx, row in df.iterrows():
-                if row['threshold'] == 'yes' and idx - last_idx > 50:
-                    yes_indices.append(idx)
-                    last_idx = idx
-
-            # Categorize indices
-            baseline_indices = []
-            stim_indices = []
-
-            for idx in yes_indices:
-                if idx < 299:
-                    baseline_indices.append(idx)
-                elif 299 < idx < 598:
-                    stim_indices.append(idx)
-                else:
-                    baseline_indices.append(idx)
-
-            # Process indices with "stim" category first
-            for idx in stim_indices + baseline_indices:
-                subset_type = ""
-                if idx < 299:
-                    start_idx = max(idx - 50, 0)
-                    end_idx = min(idx + 150, len(df))
-                    subset = df.iloc[start_idx:end_idx]
-                    subset_type = "baseline"
-                elif 299 < idx < 598:
-                    start_idx = max(idx - 50, 0)
-                    end_idx = min(idx + 150, len(df))
-                    subset = df.iloc[start_idx:end_idx]
-                    subset_type = "stim"
-                elif idx > 598:
-                    start_idx = max(idx - 50, 0)
-                    end_idx = min(idx + 150, len(df))
-                    subset = df.iloc[start_idx:end_idx]
-                    subset_type = "baseline"
-
-                # Store the original subset for plotting
-                original_subset = subset.copy()
-
-                # Pad the subset with NaNs if necessary to make it 200 rows long
-                if len(subset) < 200:
-                    if start_idx == 0:
-                        padding_needed = 200 - len(subset)
-                        padding = pd.DataFrame(np.nan, index=range(padding_needed), columns=subset.columns)
-                        subset = pd.concat([padding, subset]).reset_index(drop=True)
-                    elif end_idx == len(df):
-                        padding_needed = 200 - len(subset)
-                        padding = pd.DataFrame(np.nan, index=range(padding_needed), columns=subset.columns)
-                        subset = pd.concat([subset, padding]).reset_index(drop=True)
-                    else:
-                        padding_needed = 200 - len(subset)
-                        start_padding = pd.DataFrame(np.nan, index=range(padding_needed // 2), columns=subset.columns)
-                        end_padding = pd.DataFrame(np.nan, index=range(padding_needed - padding_needed // 2),
-                                                   columns=subset.columns)
-                        subset = pd.concat([start_padding, subset, end_padding]).reset_index(drop=True)
-
-                # Calculate time difference between max calcium and max pupil diameter ratio
-                max_calcium_time = subset['time'][subset['calcium'].idxmax()]
-                max_pupil_time = subset['time'][subset['Pupil Diameter Ratio'].idxmax()]
-                time_difference = (max_calcium_time - max_pupil_time)
-
-                # Adjust subset size if time_difference exceeds 5
-                while abs(time_difference) > 5 and len(subset) > 50:  # Ensure subset doesn't become too small
-                    subset_length = len(subset) // 2
-                    center_idx = (start_idx + end_idx) // 2
-                    start_idx = max(center_idx - subset_length // 2, 0)
-                    end_idx = min(center_idx + subset_length // 2, len(df))
-                    subset = df.iloc[start_idx:end_idx].reset_index(drop=True)
-
-                    # Recalculate time difference with new subset
-                    max_calcium_time = subset['time'][subset['calcium'].idxmax()]
-                    max_pupil_time = subset['time'][subset['Pupil Diameter Ratio'].idxmax()]
-                    time_difference = (max_calcium_time - max_pupil_time)
-
-                # Append the result to the DataFrame using concat
-                time_differences = pd.concat([time_differences, pd.DataFrame({
-                    'Day': [day],
-                    'Trial': [trial],
-                    'StimCondition': [stim_condition],
-                    'Index': [idx],
-                    'TimeDifference': [time_difference]
-                })], ignore_index=True)
-
-                # Generate and save plots for each subset using the original subset
-                # Create figure and axis objects
-                fig, ax1 = plt.subplots()
-
-                # Plot Calcium on primary y-axis (ax1)
-                ax1.plot(original_subset['time'], original_subset['calcium'], label='Calcium', color='blue')
-                ax1.set_xlabel('Time')
-                ax1.set_ylabel('Calcium', color='blue')
-                ax1.tick_params(axis='y', labelcolor='blue')
-
-                # Calculate y-axis limits for Calcium
-                max_abs_calcium = original_subset['calcium'].abs().max()
-                calcium_ylim = max_abs_calcium  # Adjust for some margin
-
-                ax1.set_ylim(-calcium_ylim, calcium_ylim)
-
-                # Create secondary y-axis for Pupil Diameter Ratio
-                ax2 = ax1.twinx()
-                ax2.plot(original_subset['time'], original_subset['Pupil Diameter Ratio'], label='Pupil Diameter Ratio', color='green')
-                ax2.set_ylabel('Pupil Diameter Ratio', color='green')
-                ax2.tick_params(axis='y', labelcolor='green')
-
-                # Set y-axis limits for Pupil Diameter Ratio (0 to 1)
-                max_abs_pupil = original_subset['Pupil Diameter Ratio'].abs().max()
-                ax2.set_ylim(0, max_abs_pupil)
-
-                # Mark the max calcium and max pupil times
-                ax1.axvline(x=max_calcium_time, color='red', linestyle='--', label='Max Calcium Time')
-                ax2.axvline(x=max_pupil_time, color='purple', linestyle='--', label='Max Pupil Time')
-
-                # Set title and save plot
-                plt.title(f'Plot around index {idx} for {day} - {trial} - {stim_condition}')
-                plt.tight_layout()
-
-                # Add legends
-                fig.legend(loc='upper right', bbox_to_anchor=(0.85, 0.85))
-
-                # Save the plot
-                plot_filename = f"{day}_{trial}_{stim_condition}_index_{idx}.png"
-                plot_filepath = os.path.join(output_directory, plot_filename)
-                plt.savefig(plot_filepath)
-                plt.close(fig)
-
-                # Save the subset to a CSV file
-                if not subset.empty:
-                    subset_filename = f"{day}_{trial}_{stim_condition}_{subset_type}_index_{idx}.csv"
-                    subset_filepath = os.path.join(output_directory, subset_filename)
-                    subset.to_csv(subset_filepath, index=False)
-
-            print(f"Processed {day} - {trial} - {stim_condition}")
-
-# Save time differences to CSV
-time_differences.to_csv(os.path.join(output_directory, 'time_differences.csv'), index=False)
+
+
+def process_events(main_directory, output_directory, bindist_file='bindist_2040.csv', render_mode='png',
+                   n_workers=None, raster_sort='lag',
+                   store_file='events.sqlite'):
+    os.makedirs(output_directory, exist_ok=True)
+
+    # Read every session once
+    records = discover_cohort_sessions(main_directory, days=days, trials=trials, stim_conditions=stim_conditions,
+                                       filename=bindist_file, report_missing=True)
+    frames = [pd.read_csv(record['path']) for record in records]
+
+    # Onsets, windows and lags for every event of every session in one call
+    extracted = extract_peri_events(frames)
+    events = extracted['events']
+    sessions = pd.DataFrame(records).rename(columns={'day': 'Day', 'trial': 'Trial', 'stimcondition': 'StimCondition'})
+    events = events.join(sessions[['Day', 'Trial', 'StimCondition']], on='session')
+
+    # Queryable store of every event; the per-event files below stay for browsing
+    if store_file is not None:
+        write_event_store(os.path.join(output_directory, store_file), events, extracted['tensor'],
+                          extracted['signals'], window_before=WINDOW_BEFORE)
+
+    for event, row in enumerate(events.itertuples(index=False)):
+        subset_filename = f"{row.Day}_{row.Trial}_{row.StimCondition}_{row.SubsetType}_index_{row.Index}.csv"
+        event_frame(frames[row.session], row, extracted['rows'][event]).to_csv(
+            os.path.join(output_directory, subset_filename), index=False)
+
+    # Figures come from one reusable template per Agg worker (png per event, pdf per condition or contact sheets)
+    render_events(events, extracted['tensor'], extracted['signals'], output_directory, mode=render_mode,
+                  n_workers=n_workers)
+
+    # One events x time raster per stimcondition ('lag', 'amplitude' or 'onset' row order; None to skip)
+    if raster_sort is not None and len(events):
+        render_rasters(events, extracted['tensor'], extracted['signals'], output_directory, sort_by=raster_sort)
+
+    # Save time differences to CSV
+    time_differences = events[['Day', 'Trial', 'StimCondition', 'Index', 'SubsetType', 'TimeDifference']]
+    time_differences.to_csv(os.path.join(output_directory, 'time_differences.csv'), index=False)
+    print(f"Processed {len(frames)} sessions, {len(events)} events")
+    return events
+
+
+if __name__ == "__main__":
+    process_events(main_directory, output_directory)
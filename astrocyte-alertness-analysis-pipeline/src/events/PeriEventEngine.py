@@ -0,0 +1,177 @@
+# PeriEventEngine.py
+# -------------------------------------------------------------------------
+# Origin: Vectorized core of "Dilation event plotting.py" (EventTimeAlignmentPlotting)
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Finds debounced event onsets (refractory period between accepted onsets) with searchsorted jumps instead of a row loop, gathers every peri-event window of every session into one NaN-padded (event, time, signal) tensor with a single fancy-index take, and computes the calcium/pupil peak lag (including the window-shrinking rule) for all events at once.
+#   - Window placement, padding and the shrink loop follow the original script exactly; onsets at exactly index 299 or 598, which the original left unhandled, are treated as baseline.
+#
+# Inputs:
+#   - Per-session DataFrames (from 'bindist_2040.csv' / 'bindist_2020.csv') with time, calcium, Pupil Diameter Ratio and threshold columns
+#
+# Outputs:
+#   - Event table (session, index, subset type, initial and final window bounds, peak times, time difference), row-index matrix and signal tensor
+#
+# File Relationships:
+#   - Used by EventTimeAlignmentPlotting.
+#
+# Dependencies:
+#   - numpy, pandas
+# -------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+from EventLabeler import threshold_mask
+
+REFRACTORY = 50
+WINDOW_BEFORE = 50
+WINDOW_AFTER = 150
+WINDOW_LENGTH = 200
+STIM_START, STIM_END = 299, 598
+MAX_LAG = 5
+MIN_WINDOW = 50
+
+SIGNALS = ('time', 'calcium', 'Pupil Diameter Ratio')
+
+
+def debounced_onsets(mask, refractory=REFRACTORY):
+    # Greedy debounce: an onset is kept if it is more than `refractory` samples after the last kept onset.
+    # One searchsorted per kept onset instead of one Python step per row.
+    candidates = np.flatnonzero(mask)
+    onsets = []
+    position = 0
+    while position < candidates.size:
+        onset = candidates[position]
+        onsets.append(onset)
+        position = np.searchsorted(candidates, onset + refractory, side='right')
+    return np.array(onsets, dtype=int)
+
+
+def subset_types(onsets, stim_start=STIM_START, stim_end=STIM_END):
+    return np.where((onsets > stim_start) & (onsets < stim_end), 'stim', 'baseline')
+
+
+def window_rows(onsets, n_rows, before=WINDOW_BEFORE, after=WINDOW_AFTER, length=WINDOW_LENGTH):
+    # Row of the session feeding each of the `length` window positions (-1 = NaN padding).
+    # A window clipped at the start is padded in front, one clipped at the end is padded at the back.
+    onsets = np.asarray(onsets)
+    n_rows = np.broadcast_to(n_rows, onsets.shape)
+    start = np.maximum(onsets - before, 0)
+    end = np.minimum(onsets + after, n_rows)
+    n_kept = end - start
+    base = np.where((start == 0) & (n_kept < length), n_kept - length, start)
+    rows = base[:, None] + np.arange(length)[None, :]
+    rows[(rows < start[:, None]) | (rows >= end[:, None])] = -1
+    return rows, start, end
+
+
+def gather_windows(stack, sessions, rows):
+    # stack: (sessions, samples, signals) -> (events, window, signals), NaN where rows == -1
+    tensor = stack[sessions[:, None], np.maximum(rows, 0)]
+    tensor[rows < 0] = np.nan
+    return tensor
+
+
+def _peak_times(time, calcium, pupil):
+    # Time of the first calcium maximum and of the first pupil maximum per row (NaN ignored)
+    def first_max_time(values):
+        filled = np.where(np.isnan(values), -np.inf, values)
+        position = np.argmax(filled, axis=1)
+        found = np.isfinite(filled).any(axis=1)
+        return np.where(found, time[np.arange(len(time)), position], np.nan)
+    return first_max_time(calcium), first_max_time(pupil)
+
+
+def lag_metrics(stack, sessions, lengths, tensor, start, end, max_lag=MAX_LAG, min_window=MIN_WINDOW,
+                signal_index=None):
+    # Calcium peak time minus pupil peak time on the padded window; while the lag exceeds `max_lag`
+    # the window is halved around its centre (unpadded) until it would drop to `min_window` samples.
+    signal_index = signal_index or {name: i for i, name in enumerate(SIGNALS)}
+    t, c, p = (signal_index[name] for name in SIGNALS)
+    calcium_time, pupil_time = _peak_times(tensor[..., t], tensor[..., c], tensor[..., p])
+    difference = calcium_time - pupil_time
+
+    start = start.copy()
+    end = end.copy()
+    current_length = np.full(len(sessions), tensor.shape[1])
+    n_samples = lengths[sessions]
+    shrunk = np.zeros(len(sessions), dtype=bool)
+    active = (np.abs(difference) > max_lag) & (current_length > min_window)
+    while active.any():
+        shrunk |= active
+        half = current_length[active] // 2
+        center = (start[active] + end[active]) // 2
+        start[active] = np.maximum(center - half // 2, 0)
+        end[active] = np.minimum(center + half // 2, n_samples[active])
+        current_length[active] = end[active] - start[active]
+
+        # Re-gather only the shrunk windows, without padding
+        width = max(int(current_length[active].max()), 1)
+        rows = start[active][:, None] + np.arange(width)[None, :]
+        rows[rows >= end[active][:, None]] = -1
+        window = gather_windows(stack, sessions[active], rows)
+        calcium_time[active], pupil_time[active] = _peak_times(window[..., t], window[..., c], window[..., p])
+        difference[active] = calcium_time[active] - pupil_time[active]
+        active = (np.abs(difference) > max_lag) & (current_length > min_window)
+
+    return {'max_calcium_time': calcium_time, 'max_pupil_time': pupil_time, 'time_difference': difference,
+            'final_start': start, 'final_end': end, 'shrunk': shrunk}
+
+
+def stack_sessions(frames, signals=SIGNALS):
+    # NaN-padded (sessions, samples, signals) array and session lengths from per-session DataFrames
+    lengths = np.array([len(df) for df in frames], dtype=int)
+    stack = np.full((len(frames), int(lengths.max()) if len(frames) else 0, len(signals)), np.nan)
+    for i, df in enumerate(frames):
+        stack[i, :lengths[i]] = df[list(signals)].to_numpy(dtype=float)
+    return stack, lengths
+
+
+def extract_peri_events(frames, refractory=REFRACTORY, signals=SIGNALS):
+    # All events of all sessions at once. Events are ordered per session, stim events first, as in the original.
+    stack, lengths = stack_sessions(frames, signals)
+    sessions, onsets = [], []
+    for i, df in enumerate(frames):
+        found = debounced_onsets(threshold_mask(df['threshold']), refractory)
+        order = np.argsort(subset_types(found) != 'stim', kind='stable')
+        sessions.append(np.full(found.size, i))
+        onsets.append(found[order])
+    sessions = np.concatenate(sessions) if sessions else np.zeros(0, dtype=int)
+    onsets = np.concatenate(onsets) if onsets else np.zeros(0, dtype=int)
+
+    rows, start, end = window_rows(onsets, lengths[sessions])
+    tensor = gather_windows(stack, sessions, rows)
+    metrics = lag_metrics(stack, sessions, lengths, tensor, start, end,
+                          signal_index={name: i for i, name in enumerate(signals)})
+
+    events = pd.DataFrame({'session': sessions, 'Index': onsets, 'SubsetType': subset_types(onsets),
+                           'start': start, 'end': end, 'final_start': metrics['final_start'],
+                           'final_end': metrics['final_end'], 'shrunk': metrics['shrunk'],
+                           'MaxCalciumTime': metrics['max_calcium_time'],
+                           'MaxPupilTime': metrics['max_pupil_time'], 'TimeDifference': metrics['time_difference']})
+    return {'events': events, 'rows': rows, 'tensor': tensor, 'signals': list(signals)}
+
+
+def event_frame(df, event, rows):
+    # The saved per-event CSV: the final shrunk window if the lag rule shrank it, otherwise the padded window
+    if event.shrunk:
+        return df.iloc[event.final_start:event.final_end].reset_index(drop=True)
+    return window_frame(df, rows)
+
+
+def window_frame(df, rows):
+    # Every column of the session at the window rows, NaN rows for padding
+    if (rows >= 0).all():
+        return df.iloc[rows].reset_index(drop=True)
+    valid = rows >= 0
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        taken = values[np.maximum(rows, 0)]
+        # Padded numeric columns become float, everything else (booleans, strings) object, as pd.concat would do
+        taken = taken.astype(float) if values.dtype.kind in 'iuf' else taken.astype(object)
+        taken[~valid] = np.nan
+        columns[column] = taken
+    return pd.DataFrame(columns)
@@ -0,0 +1,169 @@
+# PeriEventRenderer.py
+# -------------------------------------------------------------------------
+# Origin: Rendering part of "Dilation event plotting.py" (EventTimeAlignmentPlotting)
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Renders the per-event calcium/pupil figures from the peri-event tensor. Each worker builds the twin-axis figure once (axes, lines, markers, legend, fixed margins) and only updates line data, limits, markers and title per event. Chunks of events are spread across Agg worker processes.
+#   - Modes: 'png' (one file per event, as before), 'pdf' (one multi-page PDF per day and stimcondition) and 'contact' (contact sheets of downscaled event panels, one grid per sheet).
+#
+# Inputs:
+#   - Event table and (event, time, signal) tensor from PeriEventEngine
+#
+# Outputs:
+#   - '{day}_{trial}_{stim}_index_{idx}.png' per event, 'events_{day}_{stim}.pdf' or 'contact_{day}_{stim}_{n}.png'
+#
+# File Relationships:
+#   - Used by EventTimeAlignmentPlotting.
+#
+# Dependencies:
+#   - matplotlib (Agg canvas, no pyplot), numpy, pandas, os, concurrent.futures
+# -------------------------------------------------------------------------
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+import matplotlib.image as mpimg
+
+RENDER_MODES = ('png', 'pdf', 'contact')
+
+
+class EventFigureTemplate:
+    """One twin-axis figure reused for every event."""
+
+    def __init__(self, figsize=(6.4, 4.8), dpi=100):
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax1 = self.fig.add_subplot(111)
+
+        # Calcium on the primary y-axis
+        self.calcium_line, = ax1.plot([], [], label='Calcium', color='blue')
+        ax1.set_xlabel('Time')
+        ax1.set_ylabel('Calcium', color='blue')
+        ax1.tick_params(axis='y', labelcolor='blue')
+
+        # Pupil Diameter Ratio on the secondary y-axis
+        ax2 = ax1.twinx()
+        self.pupil_line, = ax2.plot([], [], label='Pupil Diameter Ratio', color='green')
+        ax2.set_ylabel('Pupil Diameter Ratio', color='green')
+        ax2.tick_params(axis='y', labelcolor='green')
+
+        # Max calcium and max pupil time markers
+        self.calcium_marker = ax1.axvline(x=0, color='red', linestyle='--', label='Max Calcium Time')
+        self.pupil_marker = ax2.axvline(x=0, color='purple', linestyle='--', label='Max Pupil Time')
+
+        self.title = ax2.set_title(' ')
+        self.fig.legend(loc='upper right', bbox_to_anchor=(0.85, 0.85))
+        # Fixed margins with room for both y-axes' tick labels, instead of a tight_layout fitted to the first
+        # event's labels, which could clip later events with wider ticks or longer titles
+        self.fig.subplots_adjust(left=0.14, right=0.86, bottom=0.11, top=0.9)
+        self.ax1, self.ax2 = ax1, ax2
+
+    def update(self, time, calcium, pupil, max_calcium_time, max_pupil_time, title):
+        self.calcium_line.set_data(time, calcium)
+        self.pupil_line.set_data(time, pupil)
+        self.calcium_marker.set_xdata([max_calcium_time, max_calcium_time])
+        self.pupil_marker.set_xdata([max_pupil_time, max_pupil_time])
+
+        # Same limits as before: x spans the data (5% margins), calcium symmetric, pupil from 0
+        finite = np.isfinite(time)
+        if finite.any():
+            t_min, t_max = time[finite].min(), time[finite].max()
+            margin = 0.05 * (t_max - t_min) if t_max > t_min else 0.5
+            self.ax1.set_xlim(t_min - margin, t_max + margin)
+        max_abs_calcium = np.nanmax(np.abs(calcium)) if np.isfinite(calcium).any() else 1
+        self.ax1.set_ylim(-max_abs_calcium, max_abs_calcium)
+        max_abs_pupil = np.nanmax(np.abs(pupil)) if np.isfinite(pupil).any() else 1
+        self.ax2.set_ylim(0, max_abs_pupil)
+        self.title.set_text(title)
+
+    def render(self):
+        # One Agg draw; the RGBA buffer is encoded directly instead of going through savefig (which redraws)
+        self.canvas.draw()
+        return np.asarray(self.canvas.buffer_rgba())
+
+
+def event_title(row):
+    return f'Plot around index {row["Index"]} for {row["Day"]} - {row["Trial"]} - {row["StimCondition"]}'
+
+
+def event_filename(row):
+    return f'{row["Day"]}_{row["Trial"]}_{row["StimCondition"]}_index_{row["Index"]}.png'
+
+
+def _tile(panels, shape):
+    # Contact sheet: panels laid out row-major on a white grid
+    rows, cols = shape
+    height, width = panels[0].shape[:2]
+    sheet = np.full((rows * height, cols * width, panels[0].shape[2]), 255, dtype=np.uint8)
+    for k, panel in enumerate(panels):
+        r, c = divmod(k, cols)
+        sheet[r * height:(r + 1) * height, c * width:(c + 1) * width] = panel
+    return sheet
+
+
+def _render_chunk(job):
+    # Worker: one template, many events
+    mode, rows, windows, output_path, options = job
+    template = EventFigureTemplate(figsize=options.get('figsize', (6.4, 4.8)), dpi=options.get('dpi', 100))
+    pdf = PdfPages(output_path) if mode == 'pdf' else None
+    panels = []
+    try:
+        for row, window in zip(rows, windows):
+            template.update(window[:, 0], window[:, 1], window[:, 2], row['MaxCalciumTime'], row['MaxPupilTime'],
+                            event_title(row))
+            if mode == 'png':
+                mpimg.imsave(os.path.join(output_path, event_filename(row)), template.render())
+            elif mode == 'pdf':
+                pdf.savefig(template.fig)
+            else:
+                step = options.get('downscale', 2)
+                panels.append(template.render()[::step, ::step, :3].copy())
+    finally:
+        if pdf is not None:
+            pdf.close()
+    if mode == 'contact' and panels:
+        mpimg.imsave(output_path, _tile(panels, options.get('sheet_shape', (4, 5))))
+    return len(rows)
+
+
+def _jobs(events, tensor, signals, output_directory, mode, chunk_size, options):
+    # Window columns are passed as (time, calcium, pupil) to keep the workers' payload small
+    order = [signals.index(name) for name in ('time', 'calcium', 'Pupil Diameter Ratio')]
+    windows = tensor[..., order]
+    records = events[['Day', 'Trial', 'StimCondition', 'Index', 'MaxCalciumTime', 'MaxPupilTime']].to_dict('records')
+
+    if mode == 'png':
+        for start in range(0, len(records), chunk_size):
+            yield mode, records[start:start + chunk_size], windows[start:start + chunk_size], output_directory, options
+        return
+
+    # PDFs and contact sheets are grouped per day and stimcondition
+    groups = events.groupby(['Day', 'StimCondition'], sort=False).indices
+    per_sheet = int(np.prod(options.get('sheet_shape', (4, 5))))
+    for (day, stim), positions in groups.items():
+        if mode == 'pdf':
+            yield (mode, [records[i] for i in positions], windows[positions],
+                   os.path.join(output_directory, f'events_{day}_{stim}.pdf'), options)
+            continue
+        for sheet, start in enumerate(range(0, len(positions), per_sheet), start=1):
+            chunk = positions[start:start + per_sheet]
+            yield (mode, [records[i] for i in chunk], windows[chunk],
+                   os.path.join(output_directory, f'contact_{day}_{stim}_{sheet}.png'), options)
+
+
+def render_events(events, tensor, signals, output_directory, mode='png', n_workers=None, chunk_size=50, **options):
+    # options: figsize, dpi, sheet_shape (rows, cols) and downscale for contact sheets
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode '{mode}', expected one of {RENDER_MODES}")
+    os.makedirs(output_directory, exist_ok=True)
+    events = events.reset_index(drop=True)
+    jobs = list(_jobs(events, tensor, list(signals), output_directory, mode, chunk_size, options))
+    if n_workers == 1 or len(jobs) <= 1:
+        return sum(_render_chunk(job) for job in jobs)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return sum(executor.map(_render_chunk, jobs))
@@ -0,0 +1,83 @@
+# AnimationWriterBenchmark.py
+# -------------------------------------------------------------------------
+# Origin: New benchmark for the EventGraphAnimation writers
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Renders the same session with each EventGraphAnimation mode ('classic' FuncAnimation + FFMpegWriter, 'fast' blitting, 'raw' column-band compositing piped to ffmpeg) for the same number of output frames and reports wall time, frames per second and the speedup over 'classic'.
+#
+# Inputs:
+#   - One event detection CSV (e.g., bindist_2040.csv)
+#
+# Outputs:
+#   - Printed comparison table; optional CSV with one row per mode
+#
+# File Relationships:
+#   - Benchmarks EventGraphAnimation and RawFrameWriter.
+#
+# Usage:
+#   python AnimationWriterBenchmark.py "C:\Users\ASH213\Documents\Correlated\890\d084\trial_1\stimcondition_1\bindist_2040.csv"
+#   python AnimationWriterBenchmark.py CSV --frames 3600 --modes raw fast --output-dir C:\temp\bench --results-file bench.csv
+#
+# Dependencies:
+#   - pandas, argparse, matplotlib, os, sys, tempfile, time, EventGraphAnimation, ffmpeg executable
+# -------------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'events'))
+import EventGraphAnimation
+
+
+def benchmark_writers(csv_file, output_dir, modes=EventGraphAnimation.RENDER_MODES, total_frames=300, repeats=1):
+    # Best of `repeats` wall times per mode; every mode writes the same number of output frames
+    rows = []
+    for mode in modes:
+        save_path = os.path.join(output_dir, f'benchmark_{mode}.mp4')
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            EventGraphAnimation.animate_session(csv_file, save_path, mode=mode, total_frames=total_frames)
+            times.append(time.perf_counter() - start)
+        size = os.path.getsize(save_path) if os.path.exists(save_path) else None
+        rows.append({'mode': mode, 'output_frames': total_frames, 'seconds': min(times),
+                     'frames_per_second': total_frames / min(times), 'file_bytes': size})
+
+    results = pd.DataFrame(rows)
+    if 'classic' in set(results['mode']):
+        baseline = results.loc[results['mode'] == 'classic', 'seconds'].iloc[0]
+        results['speedup_vs_classic'] = baseline / results['seconds']
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the EventGraphAnimation video writers on one session.")
+    parser.add_argument('csv_file', help="Event detection CSV with the animated columns (e.g. bindist_2040.csv)")
+    parser.add_argument('--modes', nargs='+', choices=EventGraphAnimation.RENDER_MODES,
+                        default=list(EventGraphAnimation.RENDER_MODES))
+    parser.add_argument('--frames', type=int, default=300,
+                        help="Output frames per run (the full animation is 3600; 'classic' needs ~0.25 s per frame)")
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--output-dir', default=None, help="Where the benchmark videos go (defaults to a temp folder)")
+    parser.add_argument('--ffmpeg', default=None, help="ffmpeg executable, if it is not on PATH")
+    parser.add_argument('--results-file', default=None)
+    args = parser.parse_args()
+
+    if args.ffmpeg:
+        matplotlib.rcParams['animation.ffmpeg_path'] = args.ffmpeg
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='animation_benchmark_')
+    os.makedirs(output_dir, exist_ok=True)
+
+    results = benchmark_writers(args.csv_file, output_dir, modes=args.modes, total_frames=args.frames,
+                                repeats=args.repeats)
+    print(results.to_string(index=False))
+    if args.results_file:
+        results.to_csv(args.results_file, index=False)
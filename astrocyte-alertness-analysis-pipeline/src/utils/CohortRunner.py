@@ -0,0 +1,180 @@
+# CohortRunner.py
+# -------------------------------------------------------------------------
+# Origin: New cohort driver for the per-day analysis scripts
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Discovers every animal/day/trial/stimcondition partition under the Correlated folder once, fans the per-day and per-partition analyses out across a process pool with per-task retries, and writes one consolidated results table.
+#
+# Inputs:
+#   - Root folder laid out as <animal>/<day>/<trial>/<stimcondition>/bindist_*.csv
+#
+# Outputs:
+#   - The usual outputs of each analysis script, in their usual per-day locations
+#   - 'cohort_run_results.csv' with status, attempts, runtime and error per task
+#
+# File Relationships:
+#   - Drives BinDistributionGenerator, CalciumPupilCrossCorrelation, SlidingWindowCorrelationDistribution, DerivativePeakTimingAnalysis and DerivativeSignalVisualization.
+#
+# Usage:
+#   python CohortRunner.py "C:\Users\ASH213\Documents\Correlated" --workers 8
+#   python CohortRunner.py ROOT --analyses cross_correlation sliding_correlation --animals 890 --days d084 d070
+#
+# Dependencies:
+#   - pandas, argparse, concurrent.futures, importlib, os, re, sys, time, traceback
+# -------------------------------------------------------------------------
+
+import argparse
+import importlib.util
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (script relative to src/, function, level, output location relative to the day folder)
+# 'partition' tasks get (day_folder, trial, stimcondition); 'day' tasks get (day_folder, output_folder).
+ANALYSES = {
+    'bin_distribution': ('analysis/BinDistributionGenerator.py', 'process_partition', 'partition', None),
+    'cross_correlation': ('analysis/CalciumPupilCrossCorrelation.py', 'process_folder', 'day',
+                          'average_cross_correlations'),
+    'sliding_correlation': ('analysis/SlidingWindowCorrelationDistribution.py', 'process_folder', 'day',
+                            'bin_cross_correlations'),
+    'derivative_peak_timing': ('analysis/DerivativePeakTimingAnalysis.py', 'process_day', 'day',
+                               'time_of_max_derivative_graphs'),
+    'derivative_visualization': ('visualization/DerivativeSignalVisualization.py', 'plot_day', 'day', ''),
+}
+
+# bin_distribution writes the bindist_2000.csv files the other analyses read
+DEPENDENCIES = {name: ['bin_distribution'] for name in ANALYSES if name != 'bin_distribution'}
+
+
+def discover_partitions(root, animals=None, days=None):
+    # Walk the tree once; one row per <animal>/<day>/<trial>/<stimcondition> folder
+    rows = []
+    for animal in sorted(os.listdir(root)):
+        animal_dir = os.path.join(root, animal)
+        if not re.fullmatch(r'\d+', animal) or not os.path.isdir(animal_dir):
+            continue
+        if animals and animal not in animals:
+            continue
+        for day in sorted(os.listdir(animal_dir)):
+            day_dir = os.path.join(animal_dir, day)
+            if not re.fullmatch(r'd\d{3}', day) or not os.path.isdir(day_dir):
+                continue
+            if days and day not in days:
+                continue
+            for trial in sorted(os.listdir(day_dir)):
+                if not re.fullmatch(r'trial_\d+', trial):
+                    continue
+                for stim in sorted(os.listdir(os.path.join(day_dir, trial))):
+                    stim_dir = os.path.join(day_dir, trial, stim)
+                    if re.fullmatch(r'stimcondition_\d+', stim) and os.path.isdir(stim_dir):
+                        rows.append({'animal': animal, 'day': day, 'trial': trial, 'stimcondition': stim,
+                                     'day_folder': day_dir, 'path': stim_dir})
+    return pd.DataFrame(rows, columns=['animal', 'day', 'trial', 'stimcondition', 'day_folder', 'path'])
+
+
+def build_tasks(partitions, analyses):
+    tasks = []
+    for name in analyses:
+        script, function, level, output = ANALYSES[name]
+        if level == 'partition':
+            for row in partitions.itertuples(index=False):
+                tasks.append({'analysis': name, 'animal': row.animal, 'day': row.day, 'trial': row.trial,
+                              'stimcondition': row.stimcondition, 'script': script, 'function': function,
+                              'args': (row.day_folder, row.trial, row.stimcondition)})
+        else:
+            for row in partitions.drop_duplicates('day_folder').itertuples(index=False):
+                output_folder = os.path.join(row.day_folder, output) if output else row.day_folder
+                tasks.append({'analysis': name, 'animal': row.animal, 'day': row.day, 'trial': None,
+                              'stimcondition': None, 'script': script, 'function': function,
+                              'args': (row.day_folder, output_folder)})
+    return tasks
+
+
+_modules = {}
+
+
+def _load_function(script, function):
+    # Import the script by path once per worker; its folder goes on sys.path for sibling imports
+    if script not in _modules:
+        path = os.path.join(SRC_DIR, script)
+        sys.path.insert(0, os.path.dirname(path))
+        spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[script] = module
+    return getattr(_modules[script], function)
+
+
+def run_task(task, retries=2, retry_delay=1.0):
+    # Executed in a worker process; never raises, the outcome is reported as a results row
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    row = {key: task[key] for key in ('analysis', 'animal', 'day', 'trial', 'stimcondition')}
+    start = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        try:
+            result = _load_function(task['script'], task['function'])(*task['args'])
+            # Only collections of results are counted; a returned path or scalar has no meaningful length
+            row.update(status='ok', attempts=attempt, error='',
+                       n_results=len(result) if isinstance(result, (list, tuple, pd.DataFrame)) else None)
+            break
+        except Exception as e:
+            row.update(status='failed', attempts=attempt, error=f"{type(e).__name__}: {e}",
+                       traceback=traceback.format_exc(limit=3))
+            if attempt <= retries:
+                time.sleep(retry_delay * attempt)
+    row['seconds'] = round(time.perf_counter() - start, 3)
+    return row
+
+
+def run_cohort(root, analyses=None, animals=None, days=None, workers=None, retries=2, results_file=None):
+    analyses = list(analyses or ANALYSES)
+    partitions = discover_partitions(root, animals=animals, days=days)
+    print(f"Discovered {len(partitions)} partitions across {partitions['day_folder'].nunique()} days")
+
+    # Analyses run in stages so that inputs (bindist_2000.csv) exist before they are read
+    stages = [[name for name in analyses if not DEPENDENCIES.get(name) or
+               not set(DEPENDENCIES[name]) & set(analyses)]]
+    stages.append([name for name in analyses if name not in stages[0]])
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for stage in stages:
+            futures = [executor.submit(run_task, task, retries) for task in build_tasks(partitions, stage)]
+            for future in as_completed(futures):
+                row = future.result()
+                rows.append(row)
+                if row['status'] != 'ok':
+                    print(f"[{row['analysis']}] {row['animal']}/{row['day']} failed after "
+                          f"{row['attempts']} attempts: {row['error']}")
+
+    results = pd.DataFrame(rows)
+    if not results.empty:
+        results = results.sort_values(['analysis', 'animal', 'day', 'trial', 'stimcondition'],
+                                      na_position='first').reset_index(drop=True)
+    results_file = results_file or os.path.join(root, 'cohort_run_results.csv')
+    results.to_csv(results_file, index=False)
+    n_ok = int((results['status'] == 'ok').sum()) if not results.empty else 0
+    print(f"{n_ok}/{len(results)} tasks succeeded; results table saved to '{results_file}'")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the per-day analysis scripts across a whole cohort.")
+    parser.add_argument('root', help="Folder containing one subfolder per animal (e.g. ...\\Correlated)")
+    parser.add_argument('--analyses', nargs='+', choices=sorted(ANALYSES), default=None)
+    parser.add_argument('--animals', nargs='+', default=None)
+    parser.add_argument('--days', nargs='+', default=None)
+    parser.add_argument('--workers', type=int, default=None, help="Defaults to all cores")
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--results-file', default=None)
+    args = parser.parse_args()
+    run_cohort(args.root, analyses=args.analyses, animals=args.animals, days=args.days,
+               workers=args.workers, retries=args.retries, results_file=args.results_file)
@@ -0,0 +1,100 @@
+# CohortSessionLoader.py
+# -------------------------------------------------------------------------
+# Origin: Shared loader factored out of the per-day analysis and event scripts
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Discovers every day/trial/stimcondition session under an animal folder and loads the requested columns of all sessions into NaN-padded stacked arrays (session x sample), read once. Also provides a row-wise np.gradient for stacked, non-uniformly sampled signals.
+#
+# Inputs:
+#   - Animal folder laid out as <day>/<trial>/<stimcondition>/bindist_2000.csv
+#
+# Outputs:
+#   - Session records (animal, day, trial, stimcondition, path) and stacked arrays
+#
+# File Relationships:
+#   - Used by DerivativePeakTimingAnalysis and the event detection modules.
+#
+# Dependencies:
+#   - pandas, numpy, os, re
+# -------------------------------------------------------------------------
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+DAYS = ['d084', 'd070', 'd056', 'd028', 'd021', 'd014', 'd007', 'd003', 'd001']
+TRIALS = ['trial_1', 'trial_2', 'trial_3']
+STIM_CONDITIONS = ['stimcondition_1', 'stimcondition_2', 'stimcondition_3', 'stimcondition_4', 'stimcondition_5']
+SESSION_COLUMNS = ('time', 'Pupil Diameter Ratio', 'calcium')
+
+
+def discover_cohort_sessions(base_dir, days=None, trials=TRIALS, stim_conditions=STIM_CONDITIONS,
+                             filename='bindist_2000.csv', report_missing=False):
+    # One record per existing session file; days default to every dNNN folder under base_dir
+    if days is None:
+        days = sorted((d for d in os.listdir(base_dir) if re.fullmatch(r'd\d{3}', d)), reverse=True)
+    animal = os.path.basename(os.path.normpath(base_dir))
+    records = []
+    for day in days:
+        for trial in trials:
+            for stim in stim_conditions:
+                csv_path = os.path.join(base_dir, day, trial, stim, filename)
+                if os.path.exists(csv_path):
+                    records.append({'animal': animal, 'day': day, 'trial': trial,
+                                    'stimcondition': stim, 'path': csv_path})
+                elif report_missing:
+                    print(f"File not found: {csv_path}")
+    return records
+
+
+def load_session_stack(records, columns=SESSION_COLUMNS, report_missing_columns=True):
+    # Read each session once into preallocated (n_sessions, max_samples) arrays padded with NaN.
+    # Sessions missing a required column are dropped; the kept records are returned alongside.
+    frames = []
+    kept = []
+    for record in records:
+        df = pd.read_csv(record['path'])
+        if not set(columns).issubset(df.columns):
+            if report_missing_columns:
+                print(f"Missing required columns in {record['path']}")
+            continue
+        frames.append(df)
+        kept.append(record)
+
+    lengths = np.array([len(df) for df in frames], dtype=int)
+    n_samples = int(lengths.max()) if len(lengths) else 0
+    stack = {column: np.full((len(frames), n_samples), np.nan) for column in columns}
+    for i, df in enumerate(frames):
+        for column in columns:
+            stack[column][i, :lengths[i]] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+    return kept, stack, lengths
+
+
+def stacked_gradient(values, time, lengths=None):
+    # Row-wise equivalent of np.gradient(values[i, :L], time[i, :L]) for every session at once
+    # (second-order central differences inside, first-order at both edges).
+    values = np.asarray(values, dtype=float)
+    time = np.asarray(time, dtype=float)
+    n_sessions, n_samples = values.shape
+    if lengths is None:
+        lengths = np.full(n_sessions, n_samples)
+    gradient = np.full(values.shape, np.nan)
+    if n_samples < 2:
+        return gradient
+
+    dx = np.diff(time, axis=1)
+    hs = dx[:, :-1]
+    hd = dx[:, 1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gradient[:, 1:-1] = (hs ** 2 * values[:, 2:] + (hd ** 2 - hs ** 2) * values[:, 1:-1]
+                             - hd ** 2 * values[:, :-2]) / (hs * hd * (hd + hs))
+        gradient[:, 0] = (values[:, 1] - values[:, 0]) / dx[:, 0]
+
+        # One-sided difference at each session's own last sample
+        rows = np.flatnonzero(lengths >= 2)
+        last = lengths[rows] - 1
+        gradient[rows, last] = (values[rows, last] - values[rows, last - 1]) / (time[rows, last] - time[rows, last - 1])
+    gradient[np.arange(n_samples)[None, :] >= lengths[:, None]] = np.nan
+    return gradient
@@ -0,0 +1,118 @@
+# FigureBatch.py
+# -------------------------------------------------------------------------
+# Origin: Shared job runner factored out of RawSignalVisualization and DerivativeSignalVisualization
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Turns a day folder into one figure job per (stimcondition, bindist file), listing the trial CSVs that feed it, and reads each of those CSVs once (only the needed columns, as float arrays).
+#   - Runs the jobs in a pool of worker processes drawing on Agg canvases (serially when already running inside a worker, as under CohortRunner). Each CSV feeds exactly one figure, so each worker reads its own inputs and no arrays cross process boundaries.
+#   - Incremental mode: a JSON manifest in the output folder records, per figure, the paths, sizes and modification times of its inputs (plus a figure version); figures whose inputs and version are unchanged and whose PNG still exists are skipped.
+#
+# Inputs:
+#   - Day folder laid out as <trial>/<stimcondition>/bindist_*.csv
+#
+# Outputs:
+#   - Whatever the render function writes; '<manifest>.json' in the output folder
+#
+# File Relationships:
+#   - Used by RawSignalVisualization and DerivativeSignalVisualization.
+#
+# Dependencies:
+#   - pandas, numpy, json, multiprocessing, os, concurrent.futures
+# -------------------------------------------------------------------------
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def figure_jobs(base_dir, output_dir, stim_conditions, timepoints, output_folder='{stim}', version=1):
+    # One job per bindist_* file found in the first timepoint's folder of each stim condition
+    jobs = []
+    for stim in stim_conditions:
+        bindist_files = sorted(f for f in os.listdir(os.path.join(base_dir, timepoints[0], stim))
+                               if f.startswith('bindist_'))
+        for bindist_file in bindist_files:
+            inputs = [(t, os.path.join(base_dir, t, stim, bindist_file)) for t in timepoints]
+            jobs.append({'stim': stim, 'bindist_file': bindist_file,
+                         'inputs': [(t, path) for t, path in inputs if os.path.exists(path)],
+                         'output_file': os.path.join(output_dir, output_folder.format(stim=stim),
+                                                     f'{bindist_file}.png'),
+                         'version': version})
+    return jobs
+
+
+def input_signature(job):
+    # Figure version plus path, size and modification time of every input; unchanged signature = unchanged figure
+    return json.dumps([job['version']] + [[path, os.path.getsize(path), os.path.getmtime(path)]
+                                          for _, path in job['inputs']])
+
+
+def read_sessions(job, columns):
+    # [(timepoint, {column: float array})], one read per CSV
+    sessions = []
+    for t, path in job['inputs']:
+        df = pd.read_csv(path, usecols=list(columns))
+        sessions.append((t, {column: df[column].to_numpy(dtype=float) for column in columns}))
+    return sessions
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path, manifest):
+    # Write-then-rename so an interrupted run never leaves a truncated manifest
+    temporary_path = manifest_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+
+def run_figure_jobs(jobs, render, output_dir, manifest_name, n_workers=None, incremental=False):
+    # render(job) draws and saves one figure and returns its path (None when there was nothing to draw)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, manifest_name)
+    manifest = load_manifest(manifest_path)
+
+    signatures = [input_signature(job) for job in jobs]
+    todo = []
+    for job, signature in zip(jobs, signatures):
+        key = os.path.relpath(job['output_file'], output_dir)
+        if incremental and manifest.get(key) == signature and os.path.exists(job['output_file']):
+            continue
+        todo.append((job, key, signature))
+    print(f"{len(todo)} of {len(jobs)} figures to draw")
+
+    # Inside a worker process already (e.g. a CohortRunner task) the figures are drawn serially
+    if n_workers == 1 or len(todo) <= 1 or multiprocessing.parent_process() is not None:
+        written = [render(job) for job, _, _ in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            written = list(executor.map(render, [job for job, _, _ in todo]))
+
+    for (job, key, signature), output_file in zip(todo, written):
+        if output_file is not None:
+            manifest[key] = signature
+    save_manifest(manifest_path, manifest)
+    return [output_file for output_file in written if output_file is not None]
+
+
+def symmetric_limits(values, floor, default, skipna=False):
+    # (-max|v|, max|v|) when the largest magnitude exceeds floor, otherwise the default limits.
+    # skipna=True ignores NaN like a pandas Series min/max; otherwise a NaN gives the default.
+    if skipna:
+        values = np.asarray(values)[~np.isnan(values)]
+        if not len(values):
+            return default
+    abs_max = max(abs(np.min(values)), abs(np.max(values)))
+    if abs_max > floor:
+        return (-abs_max, abs_max)
+    return default
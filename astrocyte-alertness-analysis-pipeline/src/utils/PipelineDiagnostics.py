@@ -0,0 +1,160 @@
+# PipelineDiagnostics.py
+# -------------------------------------------------------------------------
+# Origin: Split out of "Data correlation test.py" logging
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Low-overhead diagnostics for per-sample pipeline stages. Counters and histograms (e.g. points per averaging bin, pupil/calcium ratio) are aggregated in memory and emitted as one structured JSON record per file, with opt-in sampled verbose tracing.
+#
+# Inputs:
+#   - Values reported by the processing scripts while they run
+#
+# Outputs:
+#   - One JSON summary line per file (plus one cohort line) in the configured log file
+#
+# File Relationships:
+#   - Used by CalciumPupilCouplingAnalysisNormalized in place of per-row logging.
+#
+# Dependencies:
+#   - logging, json, os, time, collections, numpy
+# -------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+DIAGNOSTICS_LOGGER = 'pipeline.diagnostics'
+
+
+def configure_diagnostics_logging(log_file, verbose=False):
+    # Route diagnostics to a file; verbose enables the sampled DEBUG traces
+    logger = logging.getLogger(DIAGNOSTICS_LOGGER)
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    log_path = os.path.abspath(log_file)
+    if not any(isinstance(h, logging.FileHandler) and h.baseFilename == log_path for h in logger.handlers):
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    logger.propagate = False
+    return logger
+
+
+class FileDiagnostics:
+    """Counters and histograms for a single input file."""
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.counters = Counter()
+        self.histograms = defaultdict(Counter)
+        self.values = {}
+        self.start_time = time.perf_counter()
+        self.closed = False
+
+    def count(self, stage, n=1):
+        self.counters[stage] += n
+
+    def set(self, key, value):
+        # Scalar facts about the file (row counts, ratios, ...)
+        self.values[key] = value
+
+    def observe(self, metric, value, decimals=None):
+        if decimals is not None:
+            value = round(float(value), decimals)
+        self.histograms[metric][value] += 1
+
+    def observe_many(self, metric, values, decimals=None):
+        # Vectorised histogram update, one np.unique call instead of a Python loop
+        values = np.asarray(values)
+        if values.size == 0:
+            return
+        if decimals is not None:
+            values = np.round(values.astype(float), decimals)
+        uniques, counts = np.unique(values, return_counts=True)
+        hist = self.histograms[metric]
+        for value, count in zip(uniques.tolist(), counts.tolist()):
+            hist[value] += count
+
+    @property
+    def tracing(self):
+        return self.recorder.trace_every > 0 and self.recorder.logger.isEnabledFor(logging.DEBUG)
+
+    def should_trace(self, i):
+        # Sample one row in every `trace_every` when verbose tracing is enabled
+        return self.tracing and i % self.recorder.trace_every == 0
+
+    def trace(self, message, *args):
+        self.recorder.logger.debug(f"[{self.name}] " + message, *args)
+
+    def summary(self):
+        return {
+            'file': self.name,
+            'elapsed_s': round(time.perf_counter() - self.start_time, 6),
+            'values': self.values,
+            'counters': dict(self.counters),
+            'histograms': {metric: {str(k): v for k, v in sorted(hist.items())}
+                           for metric, hist in self.histograms.items()},
+        }
+
+    def close(self):
+        # Emit the single structured record for this file and fold it into the cohort totals
+        if self.closed:
+            return
+        self.closed = True
+        self.recorder.logger.info(json.dumps(self.summary(), default=_json_default))
+        self.recorder.merge(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.count('errors')
+            self.set('error', repr(exc))
+        self.close()
+        return False
+
+
+class DiagnosticsRecorder:
+    """Cohort-level aggregation of FileDiagnostics records."""
+
+    def __init__(self, logger=None, trace_every=0):
+        self.logger = logger or logging.getLogger(DIAGNOSTICS_LOGGER)
+        self.trace_every = trace_every
+        self.counters = Counter()
+        self.histograms = defaultdict(Counter)
+        self.files = 0
+
+    def file(self, name):
+        return FileDiagnostics(self, name)
+
+    def count(self, stage, n=1):
+        self.counters[stage] += n
+
+    def merge(self, file_diagnostics):
+        self.files += 1
+        self.counters.update(file_diagnostics.counters)
+        for metric, hist in file_diagnostics.histograms.items():
+            self.histograms[metric].update(hist)
+
+    def summary(self):
+        return {
+            'cohort_files': self.files,
+            'counters': dict(self.counters),
+            'histograms': {metric: {str(k): v for k, v in sorted(hist.items())}
+                           for metric, hist in self.histograms.items()},
+        }
+
+    def close(self):
+        self.logger.info(json.dumps(self.summary(), default=_json_default))
+
+
+def _json_default(value):
+    # numpy scalars are not JSON serialisable on their own
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
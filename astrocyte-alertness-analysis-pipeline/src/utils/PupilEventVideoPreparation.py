@@ -1,28 +1,32 @@
 # PupilEventVideoPreparation.py
 # -------------------------------------------------------------------------
 # Origin: "Pupil event videoplayer preparer.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Standardizes pupil videos for analysis by trimming to 2 minutes, adjusting frame rate, and aligning start times.
+#   - Each output gets a VideoKeyframeIndex sidecar so DualVideoPlayer can seek and scrub it immediately. This is best-effort: it uses moviepy's ffmpeg (IMAGEIO_FFMPEG_EXE) when set and is skipped with a message if ffprobe is unavailable.
 #
 # Inputs:
 #   - Raw/preprocessed pupil video (.h264 or similar)
 #
 # Outputs:
-#   - Trimmed, synchronized 2-minute video file
+#   - Trimmed, synchronized 2-minute video file and (when ffprobe is available) its '.keyframes.npz' sidecar
 #
 # File Relationships:
-#   - Precedes EventGraphAnimation for consistent inputs.
+#   - Precedes EventGraphAnimation for consistent inputs; outputs are played in DualVideoPlayer.
 #
 # Dependencies:
-#   - moviepy, os
+#   - moviepy, os, subprocess, VideoKeyframeIndex (ffmpeg/ffprobe, optional)
 # -------------------------------------------------------------------------
 
 import os
+import subprocess
 from moviepy.editor import VideoFileClip
 import moviepy.video.fx.all as vfx
 
+from VideoKeyframeIndex import VideoKeyframeIndex
+
 # Define the paths to the input folders
 folder1 = r"C:\Users\ASH213\Documents\Correlated\890\d084\animations"
 folder2 = r"C:\Users\ASH213\Documents\Correlated\890\d084\videos for animations"
@@ -53,7 +57,14 @@ def process_videos(input_folder, output_folder, prefix):
             # Save the adjusted video
             adjusted_video.write_videofile(output_path)
 
+            # Index the output for DualVideoPlayer; optional, the player builds it itself if this fails
+            try:
+                VideoKeyframeIndex.load(output_path, ffmpeg_path=os.environ.get('IMAGEIO_FFMPEG_EXE'))
+            except (OSError, ValueError, KeyError, subprocess.CalledProcessError) as e:
+                print(f"No keyframe index for {output_path} ({e})")
+
 
-# Process videos in both folders
-process_videos(folder1, output_folder, "f")
-process_videos(folder2, output_folder, "f")
+if __name__ == "__main__":
+    # Process videos in both folders
+    process_videos(folder1, output_folder, "f")
+    process_videos(folder2, output_folder, "f")
@@ -0,0 +1,174 @@
+# RawFrameWriter.py
+# -------------------------------------------------------------------------
+# Origin: New low-level video writer for the pipeline animations
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Pipes raw RGB frames straight into an ffmpeg subprocess (no savefig, no per-frame figure draw).
+#   - TraceCompositor rasterizes the static figure once. For traces that only grow, each frame restores just the band of pixel columns the new samples can touch from the cached background, redraws the full traces clipped to that band and copies only that band into one reusable RGB frame buffer. Joins and antialiasing therefore match a full restore-and-redraw (EventGraphAnimation 'fast'), apart from at most one intensity level on a few pixels where a stroke is clipped at a band edge; the per-frame cost is a narrow restore, clipped rasterization and a narrow copy instead of full-frame ones.
+#
+# Inputs:
+#   - A Matplotlib figure on an Agg canvas with animated (excluded from the background) Line2D artists, and their full x/y data
+#
+# Outputs:
+#   - Video file written by ffmpeg (h264 / yuv420p by default)
+#
+# File Relationships:
+#   - Used by EventGraphAnimation ('raw' mode); benchmarked by AnimationWriterBenchmark.
+#
+# Dependencies:
+#   - numpy, subprocess, matplotlib (rcParams for the ffmpeg path, Agg canvas), ffmpeg executable
+# -------------------------------------------------------------------------
+
+import subprocess
+
+import matplotlib as mpl
+import numpy as np
+from matplotlib.transforms import Bbox
+
+
+class RawFrameWriter:
+    """Writes (height, width, 3) uint8 frames to an ffmpeg pipe."""
+
+    def __init__(self, output_path, width, height, fps, output_fps=None, codec='h264', bitrate=1800,
+                 ffmpeg_path=None, extra_args=()):
+        self.output_path = output_path
+        self.width, self.height = int(width), int(height)
+        self.fps = fps
+        self.output_fps = output_fps
+        self.codec = codec
+        self.bitrate = bitrate
+        # Same setting matplotlib's FFMpegWriter uses, so one configuration serves both writers
+        self.ffmpeg_path = ffmpeg_path or mpl.rcParams['animation.ffmpeg_path']
+        self.extra_args = list(extra_args)
+        self.frames_written = 0
+        self._proc = None
+
+    def command(self):
+        args = [self.ffmpeg_path, '-y', '-loglevel', 'error',
+                '-f', 'rawvideo', '-vcodec', 'rawvideo', '-pix_fmt', 'rgb24',
+                '-s', f'{self.width}x{self.height}', '-framerate', str(self.fps), '-i', 'pipe:',
+                '-vcodec', self.codec, '-pix_fmt', 'yuv420p']
+        if self.width % 2 or self.height % 2:
+            # yuv420p needs even dimensions
+            args += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        if self.bitrate:
+            args += ['-b:v', f'{self.bitrate}k']
+        if self.output_fps:
+            # ffmpeg repeats frames up to the output rate instead of receiving duplicates through the pipe
+            args += ['-r', str(self.output_fps)]
+        return args + self.extra_args + [self.output_path]
+
+    def open(self):
+        self._proc = subprocess.Popen(self.command(), stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        return self
+
+    def write(self, frame):
+        if frame.shape != (self.height, self.width, 3) or frame.dtype != np.uint8:
+            raise ValueError(f"Expected a ({self.height}, {self.width}, 3) uint8 frame, got {frame.shape} {frame.dtype}")
+        self._proc.stdin.write(np.ascontiguousarray(frame))
+        self.frames_written += 1
+
+    def close(self):
+        if self._proc is None:
+            return
+        proc, self._proc = self._proc, None
+        proc.stdin.close()
+        error = proc.stderr.read()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, self.command(), stderr=error)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# The band's left edge snaps to multiples of this many columns. Clipping a stroke at the band edge rounds the
+# coverage of the pixels next to that edge by up to one intensity level; snapping keeps that to a few columns.
+BAND_ALIGN = 32
+
+# matplotlib.path.Path simplifies paths of this many vertices or more, which changes how the whole trace rasterizes
+SIMPLIFY_MIN_VERTICES = 128
+
+
+class TraceCompositor:
+    """Draws growing traces onto a cached Agg background, redrawing only the pixel columns that change."""
+
+    def __init__(self, canvas, lines, x, traces):
+        # lines must be animated=True so the one full draw below leaves them out of the background
+        self.canvas = canvas
+        self.lines = list(lines)
+        self.x = np.asarray(x, dtype=float)
+        self.traces = [np.asarray(trace, dtype=float) for trace in traces]
+
+        canvas.draw()
+        self.background = canvas.copy_from_bbox(canvas.figure.bbox)
+        self._rgba = np.asarray(canvas.buffer_rgba())
+        self.rgb = np.empty(self._rgba.shape[:2] + (3,), dtype=np.uint8)
+        self.shown = 0
+        # Pixel columns changed since the last frame(): None, True (everything) or (first, last)
+        self._dirty = True
+
+    @property
+    def size(self):
+        # (width, height) in pixels
+        return self.rgb.shape[1], self.rgb.shape[0]
+
+    def advance(self, n_points):
+        # Show the first n_points samples of every trace. Only the pixel columns the new samples can touch are
+        # redrawn: that band of the background is restored and every trace is drawn in full, clipped to the band,
+        # so joins and antialiasing come out as in a full redraw (see BAND_ALIGN for the one-level exception).
+        if n_points < self.shown:
+            self.canvas.restore_region(self.background)
+            self.shown = 0
+            self._dirty = True
+        if n_points > self.shown:
+            # Start one sample back so the band covers the segment joining the part already drawn; once the traces
+            # are long enough to be simplified, the part drawn unsimplified so far is redrawn as well
+            start = max(self.shown - 1, 0)
+            if self.shown < SIMPLIFY_MIN_VERTICES <= n_points:
+                start = 0
+            first, last = self._band(self.x[start], self.x[n_points - 1])
+            height = self.rgb.shape[0]
+            # xy=(0, 0) keeps the background region in place; only columns first..last are copied back
+            self.canvas.restore_region(self.background, bbox=(first, 0, last, height), xy=(0, 0))
+            band = Bbox.from_extents(first, 0, last, height)
+            for line, trace in zip(self.lines, self.traces):
+                line.set_data(self.x[:n_points], trace[:n_points])
+                clip = Bbox.intersection(line.axes.bbox, band)
+                if clip is None:
+                    continue
+                line.set_clip_box(clip)
+                line.axes.draw_artist(line)
+                line.set_clip_box(line.axes.bbox)
+            self._mark_dirty(first, last)
+            self.shown = n_points
+        return self
+
+    def _band(self, x_first, x_last):
+        # Columns a segment from x_first to x_last can touch: its x span in pixels plus the widest line and antialiasing
+        margin = max(line.get_linewidth() for line in self.lines) * self.canvas.figure.dpi / 72 + 2
+        columns = np.concatenate([line.axes.transData.transform([(x_first, 0), (x_last, 0)])[:, 0]
+                                  for line in self.lines])
+        first = max(int(np.floor(columns.min() - margin)) // BAND_ALIGN * BAND_ALIGN, 0)
+        last = min(int(np.ceil(columns.max() + margin)) + 1, self.rgb.shape[1])
+        return first, last
+
+    def _mark_dirty(self, first, last):
+        if self._dirty is True:
+            return
+        if self._dirty is not None:
+            first, last = min(first, self._dirty[0]), max(last, self._dirty[1])
+        self._dirty = (first, last)
+
+    def frame(self):
+        # The current canvas as RGB in the same buffer every time; only the columns drawn since the last call are copied
+        if self._dirty is True:
+            np.copyto(self.rgb, self._rgba[..., :3])
+        elif self._dirty is not None:
+            first, last = self._dirty
+            np.copyto(self.rgb[:, first:last], self._rgba[:, first:last, :3])
+        self._dirty = None
+        return self.rgb
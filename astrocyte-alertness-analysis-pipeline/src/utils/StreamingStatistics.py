@@ -0,0 +1,403 @@
+# StreamingStatistics.py
+# -------------------------------------------------------------------------
+# Origin: New module for cohort-wide derivative thresholds
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Bounded-memory, mergeable summaries of large value streams: Welford/Chan running moments, histograms whose bins follow the running min/max (bin width doubles as the range grows, so no value falls outside) and a relative-error quantile sketch (DDSketch style) for median, MAD and percentile thresholds. The sketch MAD has an additive error of up to relative_accuracy * (MAD + 2 * |median|), so it is only as tight as the quantiles for data centred near zero. Partial results from parallel workers merge exactly (moments, histograms, sketch buckets), so cohort thresholds come out of one pass over the files.
+#   - Per-timepoint moments of NaN-padded event traces (count, sum and M2 per timepoint and column), folded in one event at a time, so averaging memory depends on the trace length rather than on the number of events.
+#
+# Inputs:
+#   - Batches of values (e.g. one session's pupil derivatives at a time) or single event traces
+#
+# Outputs:
+#   - Mean/std (overall or per timepoint), histogram, quantiles, MAD and threshold pairs; JSON-serialisable dicts
+#
+# File Relationships:
+#   - Used by DilationEventDetection for the per-condition derivative statistics and by EventResponseAveraging for the mean +/- SD traces.
+#
+# Dependencies:
+#   - numpy
+# -------------------------------------------------------------------------
+
+import numpy as np
+
+# 1.4826 * MAD estimates the standard deviation of normally distributed data
+MAD_TO_STD = 1.4826
+
+# Histogram bins span the data range: at most HISTOGRAM_BINS bins, each a power-of-two multiple of the base width
+HISTOGRAM_BINS = 120
+HISTOGRAM_BASE_WIDTH = 2.0 ** -20
+
+
+def _finite(values):
+    values = np.asarray(values, dtype=float).ravel()
+    return values[np.isfinite(values)]
+
+
+class RunningMoments:
+    """Count, mean, M2, min and max of a stream (population variance, like np.std)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        # Chan et al. parallel update; a batch is folded in as one partial result
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def update(self, values):
+        values = _finite(values)
+        if values.size:
+            mean = values.mean()
+            self._combine(values.size, mean, float(((values - mean) ** 2).sum()), values.min(), values.max())
+        return self
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def variance(self, ddof=0):
+        return self.m2 / (self.count - ddof) if self.count > ddof else np.nan
+
+    def std(self, ddof=0):
+        return float(np.sqrt(self.variance(ddof)))
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': float(self.mean), 'm2': float(self.m2),
+                'min': float(self.min), 'max': float(self.max)}
+
+    @classmethod
+    def from_dict(cls, data):
+        moments = cls()
+        moments.count, moments.mean, moments.m2 = int(data['count']), data['mean'], data['m2']
+        moments.min, moments.max = data['min'], data['max']
+        return moments
+
+
+class TimepointMoments:
+    """Per-timepoint, per-column count, mean and M2 of NaN-padded traces (population std, like np.nanstd)."""
+
+    def __init__(self, n_columns=0):
+        # The running sum is kept instead of the mean so that, folded serially, mean() equals np.nanmean exactly
+        self.count = np.zeros((0, n_columns), dtype=np.int64)
+        self.total = np.zeros((0, n_columns))
+        self.m2 = np.zeros((0, n_columns))
+
+    @property
+    def length(self):
+        return self.count.shape[0]
+
+    def _grow(self, length, n_columns):
+        if self.count.shape[1] not in (0, n_columns) and self.length:
+            raise ValueError(f"Expected {self.count.shape[1]} columns, got {n_columns}")
+        if length <= self.length and self.count.shape[1] == n_columns:
+            return
+        length = max(length, self.length)
+        for name in ('count', 'total', 'm2'):
+            old = getattr(self, name)
+            grown = np.zeros((length, n_columns), dtype=old.dtype)
+            grown[:old.shape[0], :old.shape[1]] = old
+            setattr(self, name, grown)
+
+    def _running_mean(self, rows):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.total[:rows] / self.count[:rows]
+
+    def update(self, trace):
+        # trace: (timepoints, columns) of one event; shorter traces only touch their own timepoints (NaN padding)
+        trace = np.asarray(trace, dtype=float).reshape(len(trace), -1)
+        self._grow(*trace.shape)
+        rows = len(trace)
+        valid = ~np.isnan(trace)
+        values = np.where(valid, trace, 0.0)
+
+        # Welford step for every timepoint at once; NaN samples leave their timepoint untouched
+        old_mean = np.where(self.count[:rows] > 0, self._running_mean(rows), 0.0)
+        self.count[:rows] += valid
+        self.total[:rows] += values
+        new_mean = np.where(self.count[:rows] > 0, self._running_mean(rows), 0.0)
+        self.m2[:rows] += np.where(valid, (values - old_mean) * (values - new_mean), 0.0)
+        return self
+
+    def merge(self, other):
+        # Chan et al. parallel update, elementwise
+        if not other.length:
+            return self
+        self._grow(*other.count.shape)
+        rows = other.length
+        count = self.count[:rows]
+        total = count + other.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(total > 0, other._running_mean(rows) - self._running_mean(rows), 0.0)
+            correction = np.where((count > 0) & (other.count > 0), delta ** 2 * count * other.count / total, 0.0)
+        self.m2[:rows] += other.m2 + correction
+        self.total[:rows] += other.total
+        self.count[:rows] = total
+        return self
+
+    def mean(self):
+        # NaN where no event had a sample
+        return np.where(self.count > 0, self._running_mean(self.length), np.nan)
+
+    def variance(self, ddof=0):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+    def std(self, ddof=0):
+        return np.sqrt(self.variance(ddof))
+
+    def to_dict(self):
+        return {'count': self.count.tolist(), 'total': self.total.tolist(), 'm2': self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        moments = cls()
+        moments.count = np.asarray(data['count'], dtype=np.int64).reshape(len(data['count']), -1)
+        moments.total = np.asarray(data['total'], dtype=float).reshape(moments.count.shape)
+        moments.m2 = np.asarray(data['m2'], dtype=float).reshape(moments.count.shape)
+        return moments
+
+
+class RangeHistogram:
+    """Histogram whose bins follow the running min/max: at most max_bins bins of a power-of-two width; merges exactly."""
+
+    def __init__(self, max_bins=HISTOGRAM_BINS, base_width=HISTOGRAM_BASE_WIDTH):
+        # Bin k covers [k * width, (k + 1) * width); counts[0] is bin `first`
+        self.max_bins = max_bins
+        self.base_width = base_width
+        self.level = 0
+        self.first = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    @property
+    def width(self):
+        return self.base_width * 2.0 ** self.level
+
+    @property
+    def edges(self):
+        return (self.first + np.arange(self.counts.size + 1)) * self.width
+
+    def _coarsen(self):
+        # Double the bin width; bin k becomes bin k // 2, so every count stays in a bin that contains it
+        if self.counts.size:
+            bins = (self.first + np.arange(self.counts.size)) // 2
+            self.counts = np.bincount(bins - bins[0], weights=self.counts).astype(np.int64)
+            self.first = int(bins[0])
+        self.level += 1
+
+    def _cover(self, minimum, maximum):
+        # Coarsen until [minimum, maximum] and the bins already filled fit in max_bins, then extend the bins to it
+        while True:
+            low, high = int(np.floor(minimum / self.width)), int(np.floor(maximum / self.width))
+            if self.counts.size:
+                low, high = min(low, self.first), max(high, self.first + self.counts.size - 1)
+            if high - low < self.max_bins:
+                break
+            self._coarsen()
+        counts = np.zeros(high - low + 1, dtype=np.int64)
+        counts[self.first - low:self.first - low + self.counts.size] = self.counts
+        self.first, self.counts = low, counts
+
+    def update(self, values):
+        values = _finite(values)
+        if values.size:
+            self._cover(values.min(), values.max())
+            bins = np.floor(values / self.width).astype(np.int64) - self.first
+            self.counts += np.bincount(bins, minlength=self.counts.size)
+        return self
+
+    def merge(self, other):
+        if (self.max_bins, self.base_width) != (other.max_bins, other.base_width):
+            raise ValueError("Histograms with different bin settings cannot be merged")
+        if not other.counts.size:
+            return self
+        other = RangeHistogram.from_dict(other.to_dict())
+        while self.level < other.level:
+            self._coarsen()
+        while other.level < self.level:
+            other._coarsen()
+        self._cover(other.edges[0], other.edges[-1] - other.width / 2)
+        while other.level < self.level:
+            other._coarsen()
+        self.counts[other.first - self.first:other.first - self.first + other.counts.size] += other.counts
+        return self
+
+    def to_dict(self):
+        return {'max_bins': self.max_bins, 'base_width': self.base_width, 'level': self.level,
+                'first': self.first, 'counts': self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['max_bins'], data['base_width'])
+        histogram.level, histogram.first = int(data['level']), int(data['first'])
+        histogram.counts = np.asarray(data['counts'], dtype=np.int64)
+        return histogram
+
+
+class QuantileSketch:
+    """Log-bucketed quantile sketch: every quantile is within `relative_accuracy` of a true value."""
+
+    def __init__(self, relative_accuracy=0.005, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _add(self, store, magnitudes):
+        # Bucket k holds magnitudes in (gamma^(k-1), gamma^k]
+        keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def update(self, values):
+        values = _finite(values)
+        small = np.abs(values) < self.min_value
+        self.zero_count += int(small.sum())
+        self._add(self.positive, values[(values > 0) & ~small])
+        self._add(self.negative, -values[(values < 0) & ~small])
+        self.count += values.size
+        return self
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Sketches with different relative accuracy cannot be merged")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def _bucket_values(self, store):
+        keys = np.array(sorted(store), dtype=np.int64)
+        counts = np.array([store[k] for k in keys.tolist()], dtype=np.int64)
+        # Representative value with relative error <= relative_accuracy for the whole bucket
+        return 2 * self.gamma ** keys / (self.gamma + 1), counts
+
+    def weighted_values(self):
+        # All buckets as (value, count) in ascending value order
+        negative_values, negative_counts = self._bucket_values(self.negative)
+        positive_values, positive_counts = self._bucket_values(self.positive)
+        values = np.concatenate([-negative_values[::-1], [0.0], positive_values])
+        counts = np.concatenate([negative_counts[::-1], [self.zero_count], positive_counts])
+        return values, counts
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        values, counts = self.weighted_values()
+        return _weighted_quantile(values, counts, q)
+
+    def mad(self):
+        # Median absolute deviation, evaluated on the bucket representatives. Each value and the median are off
+        # by at most relative_accuracy * |value|, so |error| <= relative_accuracy * (MAD + 2 * |median|) (plus
+        # min_value for values folded into the zero bucket). That is relative accuracy when the data are centred
+        # near zero, like pupil derivatives, but can exceed the MAD itself when |median| >> MAD.
+        if self.count == 0:
+            return np.nan
+        values, counts = self.weighted_values()
+        deviations = np.abs(values - _weighted_quantile(values, counts, 0.5))
+        order = np.argsort(deviations)
+        return _weighted_quantile(deviations[order], counts[order], 0.5)
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'min_value': self.min_value,
+                'positive': {str(k): v for k, v in sorted(self.positive.items())},
+                'negative': {str(k): v for k, v in sorted(self.negative.items())},
+                'zero_count': self.zero_count, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'], data['min_value'])
+        sketch.positive = {int(k): int(v) for k, v in data['positive'].items()}
+        sketch.negative = {int(k): int(v) for k, v in data['negative'].items()}
+        sketch.zero_count, sketch.count = int(data['zero_count']), int(data['count'])
+        return sketch
+
+
+def _weighted_quantile(values, counts, q):
+    # Lower quantile of sorted (value, count) pairs, rank q * (n - 1) as in np.quantile(method='lower')
+    cumulative = np.cumsum(counts)
+    rank = q * (cumulative[-1] - 1)
+    return float(values[np.searchsorted(cumulative, rank, side='right')])
+
+
+class DerivativeThresholdAccumulator:
+    """Moments, histogram and quantile sketch of one stream of pupil derivatives."""
+
+    def __init__(self, max_bins=HISTOGRAM_BINS, relative_accuracy=0.005):
+        self.moments = RunningMoments()
+        self.histogram = RangeHistogram(max_bins)
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def update(self, values):
+        values = _finite(values)
+        self.moments.update(values)
+        self.histogram.update(values)
+        self.sketch.update(values)
+        return self
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.histogram.merge(other.histogram)
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    @property
+    def mean(self):
+        return float(self.moments.mean) if self.count else np.nan
+
+    @property
+    def std(self):
+        return self.moments.std()
+
+    def median(self):
+        return self.sketch.quantile(0.5)
+
+    def mad(self):
+        return self.sketch.mad()
+
+    def sigma_thresholds(self, sigma):
+        # (upper, lower) at `sigma` standard deviations from the mean
+        return self.mean + sigma * self.std, self.mean - sigma * self.std
+
+    def mad_thresholds(self, k):
+        # (upper, lower) at `k` robust standard deviations (1.4826 * MAD) from the median
+        spread = k * MAD_TO_STD * self.mad()
+        return self.median() + spread, self.median() - spread
+
+    def percentile_thresholds(self, percentile):
+        # (upper, lower) at the given upper percentile and its mirror, e.g. 97.5 -> (p97.5, p2.5)
+        return self.sketch.quantile(percentile / 100), self.sketch.quantile(1 - percentile / 100)
+
+    def to_dict(self):
+        return {'moments': self.moments.to_dict(), 'histogram': self.histogram.to_dict(),
+                'sketch': self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls(data['histogram']['max_bins'], data['sketch']['relative_accuracy'])
+        accumulator.moments = RunningMoments.from_dict(data['moments'])
+        accumulator.histogram = RangeHistogram.from_dict(data['histogram'])
+        accumulator.sketch = QuantileSketch.from_dict(data['sketch'])
+        return accumulator
@@ -0,0 +1,228 @@
+# VideoKeyframeIndex.py
+# -------------------------------------------------------------------------
+# Origin: New seek index for the recorded pupil / animation videos
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - Builds a sidecar index per video: the presentation time of every frame and which frames are keyframes (from ffprobe packet flags, no decoding), so a seek can jump straight to the keyframe at or before a frame and decode forward from there. Frame counts and durations come from the packets, not from container metadata, which is often missing or wrong for raw .h264.
+#   - Stores a thumbnail strip alongside: one small RGB image per keyframe, decoded by ffmpeg with non-keyframes skipped, plus 2x-downsampled pyramid levels. Scrubbing can show these without decoding any full frame.
+#   - The sidecar records the source file's size and modification time and is rebuilt when they change.
+#
+# Inputs:
+#   - Video file (.mp4, .h264, ...)
+#
+# Outputs:
+#   - '<video>.keyframes.npz' next to the video
+#
+# File Relationships:
+#   - Used by DualVideoPlayer (keyframe-aligned seeks, scrub thumbnails), PupilEventVideoPreparation (exact durations) and EventClipExtractor (keyframe seeks).
+#
+# Usage:
+#   python VideoKeyframeIndex.py VIDEO [VIDEO ...] [--thumbnail-width 160] [--levels 3] [--rebuild]
+#
+# Dependencies:
+#   - numpy, subprocess, json, argparse, os, matplotlib (rcParams for the ffmpeg path), ffmpeg and ffprobe executables
+# -------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import subprocess
+
+import matplotlib as mpl
+import numpy as np
+
+INDEX_VERSION = 1
+SIDECAR_SUFFIX = '.keyframes.npz'
+THUMBNAIL_WIDTH = 160
+PYRAMID_LEVELS = 3
+
+
+def sidecar_path(video_path):
+    return video_path + SIDECAR_SUFFIX
+
+
+def ffmpeg_executables(ffmpeg_path=None):
+    # Same ffmpeg setting the animation writers use; ffprobe is expected next to it
+    ffmpeg_path = ffmpeg_path or mpl.rcParams['animation.ffmpeg_path']
+    folder, name = os.path.split(ffmpeg_path)
+    return ffmpeg_path, os.path.join(folder, name.replace('ffmpeg', 'ffprobe'))
+
+
+def _parse_rate(rate):
+    # '30000/1001' -> 29.97; '0/0' -> nan
+    numerator, _, denominator = str(rate).partition('/')
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return np.nan
+
+
+def probe_keyframes(video_path, ffprobe_path):
+    # Frame times (presentation order, seconds from the first frame) and keyframe frame numbers
+    stream = json.loads(subprocess.run(
+        [ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+         '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate', '-of', 'json', video_path],
+        capture_output=True, text=True, check=True).stdout)['streams'][0]
+    fps = _parse_rate(stream.get('avg_frame_rate'))
+    if not np.isfinite(fps) or fps <= 0:
+        fps = _parse_rate(stream.get('r_frame_rate'))
+
+    packets = subprocess.run(
+        [ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+         '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path],
+        capture_output=True, text=True, check=True).stdout.split()
+    pts, keyframe = [], []
+    for packet in packets:
+        time_text, _, flags = packet.partition(',')
+        pts.append(float(time_text) if time_text not in ('', 'N/A') else np.nan)
+        keyframe.append('K' in flags)
+    pts, keyframe = np.asarray(pts, dtype=float), np.asarray(keyframe, dtype=bool)
+
+    if len(pts) and np.isfinite(pts).all():
+        # Packets come in decode order; B-frames make that differ from presentation order
+        order = np.argsort(pts, kind='stable')
+        pts, keyframe = pts[order], keyframe[order]
+        frame_times = pts - pts[0]
+        start_time = pts[0]
+    else:
+        # Raw elementary streams carry no timestamps: frames are evenly spaced at the stream rate
+        frame_times = np.arange(len(pts)) / fps
+        start_time = 0.0
+    keyframes = np.flatnonzero(keyframe)
+    synthetic_first = not len(keyframes) or keyframes[0] != 0
+    if synthetic_first:
+        # Decoding always starts at the beginning of the file, which therefore acts as a keyframe
+        keyframes = np.concatenate([[0], keyframes]).astype(int)
+    return {'frame_times': frame_times, 'keyframes': keyframes, 'synthetic_first': synthetic_first, 'fps': fps,
+            'start_time': start_time, 'width': int(stream['width']), 'height': int(stream['height'])}
+
+
+def extract_keyframe_thumbnails(video_path, ffmpeg_path, n_keyframes, width, height, synthetic_first=False):
+    # One (height, width, 3) image per keyframe; the decoder skips every non-keyframe.
+    # synthetic_first: keyframes[0] is the file start, not a real keyframe, so the decoder outputs nothing for it
+    result = subprocess.run(
+        [ffmpeg_path, '-v', 'error', '-skip_frame', 'nokey', '-i', video_path, '-an', '-vsync', '0',
+         '-vf', f'scale={width}:{height}', '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:'],
+        capture_output=True, check=True)
+    thumbnails = np.frombuffer(result.stdout, dtype=np.uint8)
+    thumbnails = thumbnails[:len(thumbnails) // (height * width * 3) * height * width * 3]
+    thumbnails = thumbnails.reshape(-1, height, width, 3)
+    if synthetic_first and len(thumbnails):
+        # Frames before the first real keyframe show its image, so the rest stay aligned with their keyframes
+        thumbnails = np.concatenate([thumbnails[:1], thumbnails])
+    if len(thumbnails) < n_keyframes:
+        # A keyframe the decoder could not output reuses the previous image
+        fill = thumbnails[-1:] if len(thumbnails) else np.zeros((1, height, width, 3), np.uint8)
+        thumbnails = np.concatenate([thumbnails, np.repeat(fill, n_keyframes - len(thumbnails), axis=0)])
+    return np.ascontiguousarray(thumbnails[:n_keyframes])
+
+
+def downsample(images):
+    # 2x2 mean pooling over (n, height, width, 3); an odd last row/column is dropped
+    n, height, width, channels = images.shape
+    height, width = max(height // 2, 1) * 2, max(width // 2, 1) * 2
+    images = images[:, :height, :width].astype(np.uint16)
+    pooled = images.reshape(n, height // 2, 2, width // 2, 2, channels).sum(axis=(2, 4))
+    return ((pooled + 2) // 4).astype(np.uint8)
+
+
+def build_video_index(video_path, thumbnail_width=THUMBNAIL_WIDTH, levels=PYRAMID_LEVELS, ffmpeg_path=None):
+    ffmpeg_path, ffprobe_path = ffmpeg_executables(ffmpeg_path)
+    probe = probe_keyframes(video_path, ffprobe_path)
+
+    arrays = {'frame_times': probe['frame_times'], 'keyframes': probe['keyframes']}
+    if thumbnail_width:
+        thumbnail_height = max(int(round(probe['height'] * thumbnail_width / probe['width'] / 2)) * 2, 2)
+        level = extract_keyframe_thumbnails(video_path, ffmpeg_path, len(probe['keyframes']),
+                                            thumbnail_width, thumbnail_height, probe['synthetic_first'])
+        for i in range(levels):
+            arrays[f'thumbnails_{i}'] = level
+            level = downsample(level)
+
+    status = os.stat(video_path)
+    metadata = {'version': INDEX_VERSION, 'fps': probe['fps'], 'start_time': probe['start_time'],
+                'width': probe['width'], 'height': probe['height'],
+                'source_size': status.st_size, 'source_mtime_ns': status.st_mtime_ns}
+    # Written through a file handle so numpy does not append a second .npz suffix
+    with open(sidecar_path(video_path), 'wb') as f:
+        np.savez(f, metadata=json.dumps(metadata), **arrays)
+    return VideoKeyframeIndex(video_path)
+
+
+class VideoKeyframeIndex:
+    """Keyframe positions, frame timestamps and thumbnails of one video, read from its sidecar."""
+
+    def __init__(self, video_path):
+        self.video_path = video_path
+        with np.load(sidecar_path(video_path)) as sidecar:
+            self.metadata = json.loads(str(sidecar['metadata']))
+            self.frame_times = sidecar['frame_times']
+            self.keyframes = sidecar['keyframes']
+            self.thumbnails = [sidecar[f'thumbnails_{i}'] for i in range(len(sidecar.files))
+                               if f'thumbnails_{i}' in sidecar.files]
+        self.fps = self.metadata['fps']
+
+    @classmethod
+    def load(cls, video_path, build=True, **build_options):
+        # The sidecar if it matches the video, otherwise (re)build it
+        if os.path.exists(sidecar_path(video_path)):
+            index = cls(video_path)
+            if index.is_current():
+                return index
+        if not build:
+            raise FileNotFoundError(f"No current keyframe index for {video_path}")
+        return build_video_index(video_path, **build_options)
+
+    def is_current(self):
+        status = os.stat(self.video_path)
+        return (self.metadata.get('version') == INDEX_VERSION
+                and self.metadata.get('source_size') == status.st_size
+                and self.metadata.get('source_mtime_ns') == status.st_mtime_ns)
+
+    @property
+    def frame_count(self):
+        return len(self.frame_times)
+
+    @property
+    def duration(self):
+        # Last frame's time plus its display time
+        if not self.frame_count:
+            return 0.0
+        return float(self.frame_times[-1] + 1 / self.fps)
+
+    def keyframe_position(self, frame_number):
+        # Position in self.keyframes of the keyframe at or before frame_number
+        return max(int(np.searchsorted(self.keyframes, frame_number, side='right')) - 1, 0)
+
+    def keyframe_at_or_before(self, frame_number):
+        return int(self.keyframes[self.keyframe_position(frame_number)])
+
+    def frame_time(self, frame_number):
+        return float(self.frame_times[min(max(int(frame_number), 0), self.frame_count - 1)])
+
+    def frame_at_time(self, seconds):
+        # Frame on screen at `seconds` from the start
+        return max(int(np.searchsorted(self.frame_times, seconds, side='right')) - 1, 0)
+
+    def thumbnail(self, frame_number, level=0):
+        # Thumbnail of the keyframe at or before frame_number, or None if the index has no thumbnails
+        if level >= len(self.thumbnails):
+            return None
+        return self.thumbnails[level][self.keyframe_position(frame_number)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build keyframe/thumbnail sidecar indexes for videos.")
+    parser.add_argument('videos', nargs='+')
+    parser.add_argument('--thumbnail-width', type=int, default=THUMBNAIL_WIDTH, help="0 skips thumbnails")
+    parser.add_argument('--levels', type=int, default=PYRAMID_LEVELS)
+    parser.add_argument('--ffmpeg', default=None, help="ffmpeg executable, if it is not on PATH (ffprobe next to it)")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild even if the sidecar is current")
+    args = parser.parse_args()
+
+    for video in args.videos:
+        options = {'thumbnail_width': args.thumbnail_width, 'levels': args.levels, 'ffmpeg_path': args.ffmpeg}
+        index = build_video_index(video, **options) if args.rebuild else VideoKeyframeIndex.load(video, **options)
+        print(f"{video}: {index.frame_count} frames, {len(index.keyframes)} keyframes, "
+              f"{index.duration:.2f} s at {index.fps:.3f} fps")
@@ -0,0 +1,151 @@
+# WindowedStatistics.py
+# -------------------------------------------------------------------------
+# Origin: Factored out of the per-sample loop in "Dilation events shifted.py"
+# Last Updated: 2026-10-19
+#
+# Purpose:
+#   - O(n) asymmetric window statistics for every index at once: the window for index i is [i - behind, i + ahead], truncated at the edges of each session exactly like a Python slice. Means/sums use cumulative sums, areas use a cumulative trapezoid, maxima use the van Herk/Gil-Werman block algorithm.
+#   - Every statistic skips NaN samples like np.mean on a pandas slice (the original loop): sums and means cover the valid samples, maxima ignore NaN like np.nanmax, and areas leave out trapezoid segments with a NaN end. A window with no valid sample gives NaN for all of them. Running this file checks window_means and window_maxima against per-sample loops on NaN-containing input.
+#
+# Inputs:
+#   - 1-D signals or stacked (session x sample) arrays with per-session lengths
+#
+# Outputs:
+#   - Arrays of the same shape holding the window mean, sum, max or area at every index
+#
+# File Relationships:
+#   - Used by DilationEventDetectionShifted; intended for the other event modules as well.
+#
+# Dependencies:
+#   - numpy (pandas only for the parity check)
+# -------------------------------------------------------------------------
+
+import numpy as np
+
+
+def _prepare(values, lengths):
+    values = np.asarray(values, dtype=float)
+    squeeze = values.ndim == 1
+    values = np.atleast_2d(values)
+    n_samples = values.shape[1]
+    if lengths is None:
+        lengths = np.full(values.shape[0], n_samples)
+    lengths = np.asarray(lengths, dtype=int)
+    inside = np.arange(n_samples)[None, :] < lengths[:, None]
+    return values, lengths, inside, squeeze
+
+
+def window_bounds(n_samples, lengths, behind, ahead):
+    # Per-row [start, end) bounds of every window, clipped to the row's own length
+    index = np.arange(n_samples)[None, :]
+    start = np.clip(index - behind, 0, lengths[:, None])
+    end = np.clip(index + ahead + 1, 0, lengths[:, None])
+    return start, end
+
+
+def _prefix(values):
+    # Cumulative sum with a leading zero column so that sum(v[a:b]) = c[b] - c[a]
+    return np.concatenate([np.zeros((values.shape[0], 1)), np.cumsum(values, axis=1)], axis=1)
+
+
+def window_sums(values, behind, ahead, lengths=None):
+    values, lengths, inside, squeeze = _prepare(values, lengths)
+    start, end = window_bounds(values.shape[1], lengths, behind, ahead)
+    rows = np.arange(values.shape[0])[:, None]
+
+    # NaNs are skipped, as np.mean/np.sum on a pandas slice do: sums and counts cover valid samples only
+    valid = ~np.isnan(values) & inside
+    csum = _prefix(np.where(valid, values, 0.0))
+    cvalid = _prefix(valid.astype(float))
+    sums = csum[rows, end] - csum[rows, start]
+    counts = (cvalid[rows, end] - cvalid[rows, start]).astype(int)
+    sums[~inside] = np.nan
+    if squeeze:
+        return sums[0], counts[0]
+    return sums, counts
+
+
+def window_means(values, behind, ahead, lengths=None):
+    # Mean over [i - behind, i + ahead] for every i; replaces the per-sample np.mean(slice) loop
+    sums, counts = window_sums(values, behind, ahead, lengths)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    # No valid sample in the window (or outside the session)
+    means[counts == 0] = np.nan
+    return means
+
+
+def window_maxima(values, behind, ahead, lengths=None):
+    # van Herk/Gil-Werman: block-wise prefix and suffix maxima give every window max in O(n)
+    counts = window_sums(values, behind, ahead, lengths)[1]
+    values, lengths, inside, squeeze = _prepare(values, lengths)
+    n_rows, n_samples = values.shape
+    width = behind + ahead + 1
+    # NaN samples are skipped like padding; windows without a valid sample are set to NaN below
+    filled = np.where(inside & ~np.isnan(values), values, -np.inf)
+
+    # Pad so that window i covers padded[i : i + width], then round up to whole blocks
+    n_blocks = -(-(n_samples + width - 1) // width)
+    padded = np.full((n_rows, n_blocks * width), -np.inf)
+    padded[:, behind:behind + n_samples] = filled
+    blocks = padded.reshape(n_rows, n_blocks, width)
+    prefix = np.maximum.accumulate(blocks, axis=2).reshape(n_rows, -1)
+    suffix = np.maximum.accumulate(blocks[:, :, ::-1], axis=2)[:, :, ::-1].reshape(n_rows, -1)
+
+    index = np.arange(n_samples)
+    maxima = np.maximum(suffix[:, index], prefix[:, index + width - 1])
+    maxima[np.atleast_2d(counts) == 0] = np.nan
+    maxima[~inside] = np.nan
+    return maxima[0] if squeeze else maxima
+
+
+def window_areas(values, time, behind, ahead, lengths=None):
+    # Trapezoidal area under `values` against `time` over each window; segments with a NaN end are left out
+    counts = window_sums(values, behind, ahead, lengths)[1]
+    values, lengths, inside, squeeze = _prepare(values, lengths)
+    time = np.atleast_2d(np.asarray(time, dtype=float))
+    start, end = window_bounds(values.shape[1], lengths, behind, ahead)
+    rows = np.arange(values.shape[0])[:, None]
+
+    # Segment k spans samples k and k+1; only segments inside the row contribute
+    segments = 0.5 * (values[:, 1:] + values[:, :-1]) * np.diff(time, axis=1)
+    ctrap = _prefix(np.where(inside[:, 1:] & ~np.isnan(segments), segments, 0.0))
+    # A window [start, end) contains segments start .. end - 2
+    last = np.maximum(end - 1, start)
+    areas = ctrap[rows, last] - ctrap[rows, start]
+    areas[np.atleast_2d(counts) == 0] = np.nan
+    areas[~inside] = np.nan
+    return areas[0] if squeeze else areas
+
+
+def _loop_window_means(values, behind, ahead):
+    # The original per-sample loop of "Dilation events shifted.py", on a pandas Series
+    import pandas as pd
+    series = pd.Series(values)
+    return np.array([np.mean(series[max(0, i - behind):min(len(series), i + ahead + 1)])
+                     for i in range(len(series))])
+
+
+if __name__ == "__main__":
+    # Parity check: one interior NaN, a NaN run longer than the window and a NaN tail
+    rng = np.random.default_rng(0)
+    session = rng.normal(size=1198)
+    session[400] = np.nan
+    session[600:700] = np.nan
+    session[-150:] = np.nan
+    expected = _loop_window_means(session, 8, 75)
+    result = window_means(session, 8, 75)
+    assert np.array_equal(np.isnan(result), np.isnan(expected)), "NaN positions differ from the loop"
+    assert np.allclose(result, expected, equal_nan=True), "window means differ from the loop"
+
+    # Stacked sessions of different lengths give the same rows as separate calls
+    stacked = np.full((2, 1198), np.nan)
+    stacked[0], stacked[1, :900] = session, session[:900]
+    rows = window_means(stacked, 8, 75, lengths=[1198, 900])
+    assert np.allclose(rows[1, :900], _loop_window_means(session[:900], 8, 75), equal_nan=True)
+
+    # Maxima skip NaN like np.nanmax on each slice
+    expected_maxima = np.array([np.nan if np.isnan(window).all() else np.nanmax(window) for window in
+                                (session[max(0, i - 8):i + 76] for i in range(len(session)))])
+    assert np.array_equal(window_maxima(session, 8, 75), expected_maxima, equal_nan=True), "window maxima differ"
+    print(f"window_means matches the loop ({int(np.isnan(expected).sum())} NaN means of {len(expected)})")
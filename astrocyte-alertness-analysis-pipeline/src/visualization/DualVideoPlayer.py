@@ -1,10 +1,15 @@
 # DualVideoPlayer.py
 # -------------------------------------------------------------------------
 # Origin: "Dual videoplayer.py"
-# Last Updated: 2025-10-27
+# Last Updated: 2026-10-19
 #
 # Purpose:
 #   - Displays two synchronized videos side by side (e.g., calcium and pupil) allowing user to scrub and review temporal alignment interactively.
+#   - Each video is decoded on its own background thread into a bounded ring buffer of ready-to-display RGB frames, so the Tk main thread only turns arrays into images.
+#   - Decoded frames are kept in an LRU cache of keyframe blocks (the frames from one keyframe up to the next). A seek decodes forward from the keyframe at or before the requested frame, so scrubbing back and forth inside recently visited blocks never touches the decoder.
+#   - Keyframe positions, exact frame counts and scrub thumbnails come from each video's VideoKeyframeIndex sidecar. A missing sidecar is built on a background thread; until it is ready the video plays with OpenCV's frame count and evenly spaced keyframes.
+#   - The frame cache is bounded in bytes (CACHE_BYTES per video), so high-resolution videos keep fewer frames instead of exhausting memory. While the slider moves over frames that are not cached, the panels show the thumbnail of the nearest keyframe instead of waiting for a decode.
+#   - Slider events are debounced; playback follows a wall clock (frame = start frame + elapsed * fps) and schedules each tick for the next frame's due time, dropping late frames instead of drifting, and only shows a frame once both videos have it.
 #
 # Inputs:
 #   - Two preprocessed video files
@@ -13,25 +18,204 @@
 #   - Interactive playback window
 #
 # File Relationships:
-#   - Standalone visualization utility.
+#   - Standalone visualization utility; uses VideoKeyframeIndex (utils).
 #
 # Dependencies:
-#   - cv2 (OpenCV), PIL (Pillow), tkinter
+#   - cv2 (OpenCV), PIL (Pillow), tkinter, numpy, threading, queue, bisect, collections, time, subprocess, os, sys, VideoKeyframeIndex (ffmpeg/ffprobe to build a missing index)
 # -------------------------------------------------------------------------
 
+import bisect
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
 import tkinter as tk
+from collections import OrderedDict
 from tkinter import filedialog, Scale
+
 import cv2
+import numpy as np
 from PIL import Image, ImageTk
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from VideoKeyframeIndex import VideoKeyframeIndex
+
+RING_SIZE = 64            # decoded frames buffered ahead of playback, per video
+CACHE_BYTES = 512 * 2**20 # decoded RGB bytes kept in the keyframe-block cache, per video
+KEYFRAME_INTERVAL = 30    # assumed GOP length when a video has no keyframe index
+SCRUB_DEBOUNCE_MS = 40    # slider must rest this long before a seek is issued
+POLL_MS = 5               # retry delay while a decoder has not produced the frame yet
+INDEX_POLL_MS = 250       # how often the Tk thread checks for keyframe indexes finished in the background
+
+
+class KeyframeFrameCache:
+    """Thread-safe LRU cache of decoded frames, grouped into blocks that start at a keyframe."""
+
+    def __init__(self, keyframes, max_bytes=CACHE_BYTES):
+        self.keyframes = np.asarray(sorted(keyframes), dtype=int)
+        # Bounded by memory rather than frame count: the same budget holds ~550 480p frames or ~85 1080p frames
+        self.max_bytes = max_bytes
+        self._blocks = OrderedDict()   # keyframe -> list of frames from that keyframe on
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+    def keyframe_at_or_before(self, frame_number):
+        i = bisect.bisect_right(self.keyframes, frame_number) - 1
+        return int(self.keyframes[max(i, 0)])
+
+    def get(self, frame_number):
+        key = self.keyframe_at_or_before(frame_number)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or frame_number - key >= len(block):
+                return None
+            self._blocks.move_to_end(key)
+            return block[frame_number - key]
+
+    def put(self, frame_number, frame):
+        # Frames arrive in decode order, always starting at a keyframe, so a block only ever grows at its end
+        key = self.keyframe_at_or_before(frame_number)
+        with self._lock:
+            block = self._blocks.setdefault(key, [])
+            if frame_number - key != len(block):
+                return
+            block.append(frame)
+            self._blocks.move_to_end(key)
+            self._n_bytes += frame.nbytes
+            while self._n_bytes > self.max_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self._n_bytes -= sum(f.nbytes for f in evicted)
+
+
+class VideoDecoder(threading.Thread):
+    """Decodes one video on a background thread into a ring buffer and the frame cache."""
+
+    def __init__(self, video_path, ring_size=RING_SIZE, cache_bytes=CACHE_BYTES, index=None):
+        super().__init__(daemon=True)
+        # The capture is only read from the decoder thread once it is started
+        self.capture = cv2.VideoCapture(video_path)
+        self.index = index
+        if index is not None:
+            # Counted from the packets; CAP_PROP_FRAME_COUNT is an estimate for many h264 files
+            self.fps, self.frame_count, keyframes = index.fps, index.frame_count, index.keyframes
+        else:
+            self.fps = self.capture.get(cv2.CAP_PROP_FPS)
+            self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            keyframes = range(0, max(self.frame_count, 1), KEYFRAME_INTERVAL)
+        self.cache = KeyframeFrameCache(keyframes, cache_bytes)
+        self._built_index = None
+
+        self.ring = queue.Queue(maxsize=ring_size)   # (generation, frame number, RGB frame)
+        self._generation = 0
+        self._seek_target = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def seek(self, frame_number):
+        # Called from the Tk thread: drop everything buffered and restart decoding at frame_number
+        with self._lock:
+            self._generation += 1
+            self._seek_target = frame_number
+            self._pending = None
+            while True:
+                try:
+                    self.ring.get_nowait()
+                except queue.Empty:
+                    break
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def index_built(self, index):
+        # Called from the index-building thread; the Tk thread picks the index up in apply_index
+        self._built_index = index
+
+    def apply_index(self):
+        # Called from the Tk thread: switch to the exact frame count and keyframe blocks of a finished index.
+        # The decoder thread only ever sees a whole cache object; the caller seeks so decoding restarts at a keyframe.
+        index, self._built_index = self._built_index, None
+        if index is None:
+            return False
+        self.fps, self.frame_count = index.fps, index.frame_count
+        self.cache = KeyframeFrameCache(index.keyframes, self.cache.max_bytes)
+        self.index = index
+        return True
+
+    def next_frame(self, frame_number):
+        # Called from the Tk thread: the buffered frame for frame_number, or None if it is not decoded yet.
+        # Older frames are discarded (they are late); a newer frame is kept for a later tick.
+        while True:
+            item = self._pending
+            if item is None:
+                try:
+                    item = self.ring.get_nowait()
+                except queue.Empty:
+                    return self.cache.get(frame_number)
+            generation, index, frame = item
+            if generation != self._generation or index < frame_number:
+                self._pending = None
+                continue
+            self._pending = item
+            return frame if index == frame_number else self.cache.get(frame_number)
+
+    def _enqueue(self, generation, index, frame):
+        # Blocks while the ring is full; gives up if a seek or stop makes the frame obsolete
+        while not self._stopped.is_set() and generation == self._generation:
+            try:
+                self.ring.put((generation, index, frame), timeout=0.05)
+                return
+            except queue.Full:
+                continue
+
+    def run(self):
+        position, show_from, generation = self.frame_count, 0, -1
+        while not self._stopped.is_set():
+            with self._lock:
+                target, self._seek_target = self._seek_target, None
+                if target is not None:
+                    show_from, generation = target, self._generation
+            if target is not None:
+                # Decode forward from the keyframe so the whole block lands in the cache
+                position = self.cache.keyframe_at_or_before(show_from)
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, position)
+
+            if position >= self.frame_count:
+                self._wake.wait(0.1)
+                self._wake.clear()
+                continue
+
+            ret, frame = self.capture.read()
+            if not ret:
+                position = self.frame_count
+                continue
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            self.cache.put(position, frame)
+            if position >= show_from:
+                self._enqueue(generation, position, frame)
+            position += 1
+        self.capture.release()
+
+
 class DualVideoPlayer:
     def __init__(self, root):
         self.root = root
         self.root.title("Dual Video Player")
 
-        self.cap1 = None
-        self.cap2 = None
+        self.decoder1 = None
+        self.decoder2 = None
         self.playing = False
+        self.fps = None
+        self.frame_count = 0
+        self.current_frame = 0
+        self._scrub_job = None
+        self._clock_start = None
+        self._clock_frame = 0
 
         self.panel1 = tk.Label(root)
         self.panel1.pack(side="left", padx=10, pady=10)
@@ -51,68 +235,158 @@ class DualVideoPlayer:
         btn_play = tk.Button(root, text="Play/Pause", command=self.toggle_play)
         btn_play.pack(fill="x", padx=10, pady=10)
 
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.root.after(INDEX_POLL_MS, self.poll_indexes)
+
     def load_video1(self):
         video_path = filedialog.askopenfilename()
         if video_path:
-            self.cap1 = cv2.VideoCapture(video_path)
+            self.decoder1 = self.open_decoder(self.decoder1, video_path)
             self.update_slider_range()
 
     def load_video2(self):
         video_path = filedialog.askopenfilename()
         if video_path:
-            self.cap2 = cv2.VideoCapture(video_path)
+            self.decoder2 = self.open_decoder(self.decoder2, video_path)
             self.update_slider_range()
 
-    def update_slider_range(self):
-        if self.cap1 and self.cap2:
-            total_frames1 = int(self.cap1.get(cv2.CAP_PROP_FRAME_COUNT))
-            total_frames2 = int(self.cap2.get(cv2.CAP_PROP_FRAME_COUNT))
-            self.slider.config(to=min(total_frames1, total_frames2))
+    def open_decoder(self, previous, video_path):
+        if previous is not None:
+            previous.stop()
+        # Only a current sidecar is read here; building one runs ffprobe/ffmpeg over the whole file, so a missing
+        # index is built in the background and the decoder plays with estimated keyframes until it is ready
+        try:
+            index = VideoKeyframeIndex.load(video_path, build=False)
+        except (OSError, ValueError, KeyError):
+            index = None
+        decoder = VideoDecoder(video_path, index=index)
+        decoder.start()
+        if index is None:
+            threading.Thread(target=self.build_index, args=(decoder, video_path), daemon=True).start()
+        return decoder
+
+    def build_index(self, decoder, video_path):
+        # Runs on its own thread; never touches Tk
+        try:
+            decoder.index_built(VideoKeyframeIndex.load(video_path))
+        except (OSError, ValueError, KeyError, subprocess.CalledProcessError) as e:
+            print(f"No keyframe index for {video_path} ({e}); seeking without thumbnails")
+
+    def poll_indexes(self):
+        # Adopt indexes finished in the background; the slider range and seek follow the exact frame counts
+        if any([decoder.apply_index() for decoder in self.decoders]):
+            self.update_slider_range()
+        self.root.after(INDEX_POLL_MS, self.poll_indexes)
 
-    def get_video_fps(self, cap):
-        return cap.get(cv2.CAP_PROP_FPS)
+    @property
+    def decoders(self):
+        return [d for d in (self.decoder1, self.decoder2) if d is not None]
+
+    def update_slider_range(self):
+        if self.decoder1 and self.decoder2:
+            self.frame_count = min(self.decoder1.frame_count, self.decoder2.frame_count)
+            # Use the minimum fps of both videos to avoid skipping frames
+            self.fps = min(self.decoder1.fps, self.decoder2.fps)
+            self.slider.config(to=max(self.frame_count - 1, 0))
+            self.seek(min(self.current_frame, max(self.frame_count - 1, 0)))
 
     def toggle_play(self):
+        if not (self.decoder1 and self.decoder2):
+            return
         self.playing = not self.playing
         if self.playing:
-            fps1 = self.get_video_fps(self.cap1)
-            fps2 = self.get_video_fps(self.cap2)
-            # Use the minimum fps of both videos to avoid skipping frames
-            self.fps = min(fps1, fps2)
+            self.start_clock(self.current_frame)
             self.play_videos()
 
+    def start_clock(self, frame_number):
+        self._clock_start = time.perf_counter()
+        self._clock_frame = frame_number
+
     def play_videos(self):
         if not self.playing:
             return
 
-        ret1, frame1 = self.cap1.read()
-        ret2, frame2 = self.cap2.read()
+        # Which frame should be on screen now, from the wall clock rather than from counting ticks
+        now = time.perf_counter()
+        target = self._clock_frame + int((now - self._clock_start) * self.fps)
+        if target >= self.frame_count:
+            self.playing = False
+            return
+
+        frames = [self.decoder1.next_frame(target), self.decoder2.next_frame(target)]
+        ready = all(frame is not None for frame in frames)
+        if ready and target != self.current_frame:
+            self.show_frames(target, *frames)
 
-        if ret1 and ret2:
-            self.display_frame(self.panel1, frame1)
-            self.display_frame(self.panel2, frame2)
-            self.slider.set(self.slider.get() + 1)
+        # Wake up when the next frame is due; poll sooner if a decoder is still behind
+        next_due = self._clock_start + (target + 1 - self._clock_frame) / self.fps
+        delay = max(1, int(round((next_due - time.perf_counter()) * 1000)))
+        self.root.after(delay if ready else min(delay, POLL_MS), self.play_videos)
 
-        delay = int(1000 / self.fps)  # Convert fps to milliseconds
-        self.root.after(delay, self.play_videos)
+    def show_frames(self, frame_number, frame1, frame2):
+        self.display_frame(self.panel1, frame1)
+        self.display_frame(self.panel2, frame2)
+        self.current_frame = frame_number
+        self.slider.set(frame_number)
 
-    def display_frame(self, panel, frame):
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def display_frame(self, panel, frame, size=None):
+        # Frames arrive already converted to RGB by the decoder threads
         frame = Image.fromarray(frame)
+        if size is not None:
+            frame = frame.resize(size, Image.BILINEAR)
         frame = ImageTk.PhotoImage(frame)
         panel.configure(image=frame)
         panel.image = frame
 
+    def show_thumbnails(self, frame_number):
+        # Keyframe thumbnails scaled to the panel size, as a preview until the debounced seek has decoded the frame
+        for panel, decoder in ((self.panel1, self.decoder1), (self.panel2, self.decoder2)):
+            if decoder.index is None:
+                continue
+            thumbnail = decoder.index.thumbnail(frame_number)
+            if thumbnail is not None:
+                size = (decoder.index.metadata['width'], decoder.index.metadata['height'])
+                self.display_frame(panel, thumbnail, size)
+
     def scrub(self, value):
         frame_number = int(value)
-        if self.cap1 and self.cap2:
-            self.cap1.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            self.cap2.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            ret1, frame1 = self.cap1.read()
-            ret2, frame2 = self.cap2.read()
-            if ret1 and ret2:
-                self.display_frame(self.panel1, frame1)
-                self.display_frame(self.panel2, frame2)
+        # Scale also calls back for slider.set() during playback; that frame is already on screen
+        if frame_number == self.current_frame or not (self.decoder1 and self.decoder2):
+            return
+        # Immediate feedback when both frames are cached; the decoders are only asked once the slider rests
+        cached = [self.decoder1.cache.get(frame_number), self.decoder2.cache.get(frame_number)]
+        if all(frame is not None for frame in cached):
+            self.show_frames(frame_number, *cached)
+        else:
+            self.show_thumbnails(frame_number)
+        if self._scrub_job is not None:
+            self.root.after_cancel(self._scrub_job)
+        self._scrub_job = self.root.after(SCRUB_DEBOUNCE_MS, self.seek, frame_number)
+
+    def seek(self, frame_number):
+        self._scrub_job = None
+        for decoder in self.decoders:
+            decoder.seek(frame_number)
+        if self.playing:
+            self.start_clock(frame_number)
+        else:
+            self.show_when_decoded(frame_number)
+
+    def show_when_decoded(self, frame_number):
+        # Paused seek: wait for both decoders, unless another seek or playback has taken over
+        if self.playing or self._scrub_job is not None or not (self.decoder1 and self.decoder2):
+            return
+        frames = [self.decoder1.next_frame(frame_number), self.decoder2.next_frame(frame_number)]
+        if all(frame is not None for frame in frames):
+            self.show_frames(frame_number, *frames)
+        else:
+            self.root.after(POLL_MS, self.show_when_decoded, frame_number)
+
+    def close(self):
+        self.playing = False
+        for decoder in self.decoders:
+            decoder.stop()
+        self.root.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()